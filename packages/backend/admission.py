@@ -0,0 +1,278 @@
+"""
+Admission of self registrations for a stueble (PUT /guests) \n
+When registration opens, far more residents try to register than there are slots. Instead of letting every request
+run into the capacity check of event_guest_change, a request first takes a slot from an in-memory token counter:
+- free slots = maximum_guests - registered_guests - registrations in flight, synced from the db every SYNC_SECONDS
+- slots are handed out in arrival order, once the stueble is full the user is put on a waitlist and gets a position
+- when a registered guest is removed, count_guests sends NOTIFY guest_slot_freed (see triggers.sql and
+  websocket_runner.py) and a background worker registers the first users of the waitlist \n
+The trigger stays the source of truth, the counter only keeps requests that would fail away from the db.
+The waitlist only lives in memory.
+"""
+
+import asyncio
+from collections import OrderedDict
+import os
+import queue
+import threading
+import time
+from typing import Literal, TypedDict
+
+from psycopg2.extensions import cursor
+
+from packages.backend import websocket as ws
+from packages.backend.sql_connection import database as db, events, sessions, users
+from packages.backend.sql_connection.common_types import GenericFailure, error_to_failure
+from packages.backend.sql_connection.conn_cursor_functions import close_conn_cursor, get_conn_cursor, unit_of_work
+
+SYNC_SECONDS = float(os.getenv("ADMISSION_SYNC_SECONDS", "1"))
+
+class AdmissionData(TypedDict):
+    granted: bool
+    position: int | None
+
+class AdmissionSuccess(TypedDict):
+    success: Literal[True]
+    data: AdmissionData
+
+class StuebleSlots:
+    """
+    token counter and waitlist of one stueble
+    """
+
+    def __init__(self):
+        self.capacity: int | None = None # None if maximum_guests isn't configured
+        self.registered = 0
+        self.in_flight = 0
+        self.synced_at = 0.0
+        self.waitlist: OrderedDict[int, str] = OrderedDict() # user_id -> user_uuid, in arrival order
+
+    def free(self) -> int | None:
+        if self.capacity is None:
+            return None
+        return self.capacity - self.registered - self.in_flight
+
+class Admission:
+    """
+    thread safe admission of all stuebles
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stuebles: dict[int, StuebleSlots] = {}
+        self.promotions = queue.SimpleQueue()
+        self.worker: threading.Thread | None = None
+
+    def _slots(self, stueble_id: int) -> StuebleSlots:
+        return self.stuebles.setdefault(stueble_id, StuebleSlots())
+
+    def sync(self, cursor: cursor, stueble_id: int, force: bool = False) -> dict:
+        """
+        reloads the number of registered guests and the capacity if the last sync is older than SYNC_SECONDS
+
+        Parameters:
+            cursor: cursor for the connection
+            stueble_id (int): id of the stueble
+            force (bool): reload regardless of the age (used by the worker)
+        Returns:
+            dict: {"success": True}, {"success": False, "error": e} if error occurred
+        """
+        slots = self._slots(stueble_id)
+        if not force and time.monotonic() - slots.synced_at < SYNC_SECONDS:
+            return {"success": True}
+        result = db.custom_call(
+            cursor=cursor,
+            query="""SELECT COALESCE(c.registered_guests, 0), (SELECT CAST(value AS INTEGER) FROM configurations WHERE key = 'maximum_guests')
+            FROM stueble_motto m LEFT JOIN stueble_counters c ON c.stueble_id = m.id WHERE m.id = %s""",
+            type_of_answer=db.ANSWER_TYPE.SINGLE_ANSWER,
+            variables=[stueble_id],
+            read_only=True)
+        if result["success"] is False:
+            return error_to_failure(result)
+        if result["data"] is None:
+            return {"success": False, "error": "no stueble found"}
+        with self.lock:
+            slots.registered, slots.capacity = result["data"]
+            slots.synced_at = time.monotonic()
+            promote = slots.waitlist and (slots.free() is None or slots.free() > 0)
+        # slots were freed without a notification, e.g. maximum_guests was raised
+        if promote and not force:
+            self._schedule(stueble_id)
+        return {"success": True}
+
+    def request_slot(self, cursor: cursor, stueble_id: int, user_id: int, user_uuid: str) -> AdmissionSuccess | GenericFailure:
+        """
+        takes a slot for a registration, or puts the user on the waitlist \n
+        a granted slot has to be given back with confirm after the registration was tried
+
+        Parameters:
+            cursor: cursor for the connection
+            stueble_id (int): id of the stueble
+            user_id (int): id of the user registering
+            user_uuid (str): uuid of the user registering
+        Returns:
+            dict: {"success": True, "data": {"granted": bool, "position": int | None}}, {"success": False, "error": e} if error occurred
+        """
+        result = self.sync(cursor=cursor, stueble_id=stueble_id)
+        if result["success"] is False:
+            return result
+        with self.lock:
+            slots = self._slots(stueble_id)
+            free = slots.free()
+            # nobody overtakes the waitlist, only its first user gets a slot that becomes free
+            first_waiting = next(iter(slots.waitlist), user_id)
+            if (free is None or free > 0) and first_waiting == user_id:
+                slots.waitlist.pop(user_id, None)
+                slots.in_flight += 1
+                return {"success": True, "data": {"granted": True, "position": None}}
+            slots.waitlist.setdefault(user_id, user_uuid)
+            return {"success": True, "data": {"granted": False, "position": list(slots.waitlist).index(user_id) + 1}}
+
+    def confirm(self, stueble_id: int, user_id: int, user_uuid: str, registered: bool, full: bool = False) -> int | None:
+        """
+        gives back a slot of request_slot
+
+        Parameters:
+            stueble_id (int): id of the stueble
+            user_id (int): id of the user
+            user_uuid (str): uuid of the user
+            registered (bool): whether the registration was successful
+            full (bool): whether the db rejected the registration, because the stueble is full
+        Returns:
+            int | None: position on the waitlist if full, otherwise None
+        """
+        with self.lock:
+            slots = self._slots(stueble_id)
+            slots.in_flight = max(slots.in_flight - 1, 0)
+            if registered:
+                slots.registered += 1
+            if not full:
+                return None
+            # the counter was behind the db, the user keeps their place at the front
+            if slots.capacity is not None:
+                slots.registered = max(slots.registered, slots.capacity - slots.in_flight)
+            slots.waitlist[user_id] = user_uuid
+            slots.waitlist.move_to_end(user_id, last=False)
+            return 1
+
+    def leave(self, stueble_id: int, user_id: int) -> bool:
+        """
+        removes the user from the waitlist
+
+        Returns:
+            bool: whether the user was waiting
+        """
+        with self.lock:
+            return self._slots(stueble_id).waitlist.pop(user_id, None) is not None
+
+    def slot_freed(self, stueble_id: int):
+        """
+        called for NOTIFY guest_slot_freed, lets the worker register the first users of the waitlist
+        """
+        with self.lock:
+            slots = self.stuebles.get(stueble_id, None)
+            if slots is None:
+                return
+            # the db has one guest less, the next sync corrects the counter if there were more
+            slots.registered = max(slots.registered - 1, 0)
+            if not slots.waitlist:
+                return
+        self._schedule(stueble_id)
+
+    def resync(self):
+        """
+        called when notifications may have been missed, every stueble is synced again with its next request and the
+        waitlists are moved up if slots were freed meanwhile
+        """
+        with self.lock:
+            waiting = []
+            for stueble_id, slots in self.stuebles.items():
+                slots.synced_at = 0.0
+                if slots.waitlist:
+                    waiting.append(stueble_id)
+        for stueble_id in waiting:
+            self._schedule(stueble_id)
+
+    def _schedule(self, stueble_id: int):
+        """
+        hands the stueble to the worker, which is started if it isn't running
+        """
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._promote_waitlists, name="admission", daemon=True)
+                self.worker.start()
+        self.promotions.put(stueble_id)
+
+    def _promote_waitlists(self):
+        """
+        worker registering waiting users while there are free slots
+        """
+        while True:
+            stueble_id = self.promotions.get()
+            while self._promote_next(stueble_id):
+                pass
+
+    def _promote_next(self, stueble_id: int) -> bool:
+        """
+        registers the first user of the waitlist in its own transaction and notifies the user and the hosts
+
+        Returns:
+            bool: whether the next user should be tried
+        """
+        with self.lock:
+            slots = self._slots(stueble_id)
+            if not slots.waitlist:
+                return False
+            user_id, user_uuid = next(iter(slots.waitlist.items()))
+
+        # a granted slot is given back in any case, it only counts as registered once the registration is committed
+        slot_taken = False
+        registered = False
+        full = False
+        try:
+            with unit_of_work():
+                conn, cursor = get_conn_cursor()
+                result = self.sync(cursor=cursor, stueble_id=stueble_id, force=True)
+                if result["success"] is False:
+                    close_conn_cursor(conn, cursor)
+                    return False
+                result = self.request_slot(cursor=cursor, stueble_id=stueble_id, user_id=user_id, user_uuid=user_uuid)
+                if result["success"] is False or result["data"]["granted"] is False:
+                    close_conn_cursor(conn, cursor)
+                    return False
+                slot_taken = True
+
+                result = events.add_guest(cursor=cursor, user_id=user_id, stueble_id=stueble_id)
+                if result["success"] is False:
+                    full = "Maximum capacity" in str(result["error"])
+                    close_conn_cursor(conn, cursor, failed=True)
+                    # skip users that can't be registered anymore, e.g. because they were added by a host meanwhile
+                    return not full
+
+                keywords = ["first_name", "last_name", "room", "residence", "verified"]
+                user_result = users.get_user(cursor=cursor, user_id=user_id, keywords=keywords, expect_single_answer=True)
+                session_result = sessions.get_session_ids(cursor=cursor, user_id=user_id, uuid=True)
+                close_conn_cursor(conn, cursor)
+            registered = True
+        finally:
+            if slot_taken:
+                self.confirm(stueble_id=stueble_id, user_id=user_id, user_uuid=user_uuid, registered=registered, full=full)
+
+        # the registration is committed, now the user and the hosts can be notified
+        if user_result["success"] is True:
+            user_info = dict(zip(keywords, user_result["data"]))
+            asyncio.run(ws.broadcast(event="guestAdded", stueble_id=stueble_id, data={
+                "id": user_uuid,
+                "present": False,
+                "firstName": user_info["first_name"],
+                "lastName": user_info["last_name"],
+                "extern": False,
+                "roomNumber": user_info["room"],
+                "residence": user_info["residence"],
+                "verified": bool(user_info["verified"])}))
+        if session_result["success"] is True:
+            for sess_id in session_result["data"]:
+                asyncio.run(ws.stueble_status(session_id=sess_id, registered=True, present=False))
+        return True
+
+admission = Admission()
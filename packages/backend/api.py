@@ -4,22 +4,30 @@
 import asyncio
 import datetime
 import json
+import math
 
 from flask import Flask, Response, request
 
-from packages.backend import hash_pwd as hp, websocket as ws, qr_code as qr
+from packages.backend import export, hash_pwd as hp, websocket as ws
+from packages.backend.admission import admission
+from packages.backend.guest_list_cache import etag_matches, guest_list_cache
+from packages.backend.occupancy import occupancy
+from packages.backend.rate_limit import client_address, rate_limiter
 from packages.backend.data_types import *
-from packages.backend.google_functions import email as mail
+from packages.backend.google_functions import drive, email as mail
 from packages.backend.sql_connection import (
-    configs,
     database as db,
     events,
-    guest_events,
     motto,
+    search,
     sessions,
+    statistics,
     users,
 )
 from packages.backend.mail_assets import templates
+from packages.backend.resident_directory import resident_directory
+from packages.backend.services import auth, config as config_service, guests as guest_service, hosts as host_service, invitees
+from packages.backend.services.common import require_role
 from packages.backend.sql_connection.common_functions import check_permissions
 from packages.backend.sql_connection.conn_cursor_functions import *
 from packages.backend.sql_connection.signup_validation import validate_user_data
@@ -31,11 +39,58 @@ from packages.backend.basic_functions import *
 # initialize flask app
 app = Flask(__name__)
 
+def service_response(result: dict, status: int = 200) -> Response:
+    """
+    encodes the result of a service function (see services/common.py) once and sends its websocket notifications \n
+    has to be called after the connection was closed, so the notifications follow the commit
+
+    Parameters:
+        result (dict): result of the service function
+        status (int): status code on success, no body is sent for 204
+    Returns:
+        Response: the response of the route
+    """
+    if result["success"] is False:
+        return Response(
+            response=json.dumps({"code": result["status"], "message": result["error"]}),
+            status=result["status"],
+            mimetype="application/json")
+
+    if len(result["notifications"]) > 0:
+        asyncio.run(ws.notify(result["notifications"]))
+
+    if status == 204:
+        return Response(status=204)
+    return Response(
+        response=json.dumps(result["data"]),
+        status=status,
+        mimetype="application/json")
+
+def rate_limit(budget: str) -> Response | None:
+    """
+    takes a token of the budget for the session and the address of the request (see rate_limit.py)
+
+    Parameters:
+        budget (str): name of the budget
+    Returns:
+        Response | None: None if allowed, the 429 response if the budget is used up
+    """
+    ip = client_address(peer=request.remote_addr, forwarded_for=request.headers.get("X-Forwarded-For", None))
+    retry_after = rate_limiter.take(budget, session_id=request.cookies.get("SID", None), ip=ip)
+    if retry_after == 0:
+        return None
+    return Response(
+        response=json.dumps({"code": 429, "message": "Too many requests"}),
+        status=429,
+        headers={"Retry-After": str(math.ceil(retry_after))},
+        mimetype="application/json")
+
 """
 Session and account management
 """
 
 @app.route("/auth/login", methods=["POST"])
+@unit_of_work()
 def login():
     """
     checks, whether a user exists and whether user is logged in (if exists and not logged in, session is created)
@@ -43,118 +98,28 @@ def login():
 
     # load data
     data = request.get_json()
-    
-    name = data.get("user", None)
-    password = data.get("password", None)
-
-    # password can't be empty
-    if password == "":
-        response = Response(
-            response=json.dumps({"code": 400, "message": "password cannot be empty"}),
-            status=401,
-            mimetype="application/json")
-        return response
-
-    if name is None:
-        response = Response(
-            response=json.dumps({"code": 400, "message": "specify user"}),
-            status=400,
-            mimetype="application/json")
-        return response
-
-    user_email: Email | None = None
-    user_name: str | None = None
-
-    if "@" in name:
-        try:
-            name = Email(email=name)
-        except ValueError:
-            response = Response(
-                response=json.dumps({"code": 400, "message": "Invalid email format"}),
-                status=400,
-                mimetype="application/json")
-            return response
-        user_email = name
-    else:
-        user_name = name
 
-    # if data is not valid return error
-    if password is None:
-        response = Response(
-            response=json.dumps({"code": 400, "message": "specify password"}),
-            status=400,
-            mimetype="application/json")
-        return response
-    
     # get connection and cursor
     conn, cursor = get_conn_cursor()
-
-    # get user data from table
-    result = users.get_user(cursor=cursor, keywords=["id", "password_hash", "user_role"], user_email=user_email, user_name=user_name)
-
-    # return error
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
-
-    if result["data"] is None:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 500, "message": "Failed to find user"}),
-            status=500,
-            mimetype="application/json")
-        return response
-
-    # check password
-    user = result["data"]
-
-    if user[1] is None:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 401, "message": "account was deleted, can be reactivated by signup"}),
-            status=401,
-            mimetype="application/json")
-        return response
-
-    # if passwords don't match return error
-    if not hp.match_pwd(password, user[1]):
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 401, "message": "invalid password"}),
-            status=401,
-            mimetype="application/json")
-        return response
-
-    # create a new session
-    result = sessions.create_session(cursor=cursor, user_id=user[0])
-
-    close_conn_cursor(conn, cursor) # close conn, cursor
+    result = auth.login(cursor=cursor, user=data.get("user", None), password=data.get("password", None))
+    close_conn_cursor(conn, cursor, failed=result["success"] is False) # close conn, cursor
     if result["success"] is False:
-        response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
-
-    session_id, expiration_date = result["data"]
+        return service_response(result)
 
     # return 204
     response = Response(
         status=204)
 
     response.set_cookie("SID",
-                        session_id,
-                        expires=expiration_date,
+                        result["data"]["session_id"],
+                        expires=result["data"]["expiration_date"],
                         httponly=True,
                         secure=True,
                         samesite='Lax')
     return response
 
 @app.route("/auth/signup", methods=["POST"])
+@unit_of_work()
 def signup_data():
     """
     create a new user
@@ -227,7 +192,7 @@ def signup_data():
     # check whether user data is unique
     result = validate_user_data(cursor=cursor, **check_info)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": result["status"], "message": str(result["error"])}),
             status=result["status"],
@@ -248,7 +213,7 @@ def signup_data():
 
     result = users.create_verification_code(cursor=cursor, user_id=None, additional_data=additional_data)
 
-    close_conn_cursor(conn, cursor)
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
     if result["success"] is False:
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
@@ -274,6 +239,7 @@ def signup_data():
     return response
 
 @app.route("/auth/verify_signup", methods=["POST"])
+@unit_of_work()
 def verify_signup():
     """
     verifies the signup
@@ -296,7 +262,7 @@ def verify_signup():
     # verify token
     result = users.confirm_verification_code(cursor=cursor, reset_code=token, additional_data=True, expiration_minutes=30)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
             status=500,
@@ -328,7 +294,7 @@ def verify_signup():
             **user_info)
     # if server error occurred, return error
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
             status=500,
@@ -340,7 +306,7 @@ def verify_signup():
     # create a new session
     result = sessions.create_session(cursor=cursor, user_id=user_id)
 
-    close_conn_cursor(conn, cursor)  # close conn, cursor
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)  # close conn, cursor
     if result["success"] is False:
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
@@ -363,38 +329,20 @@ def verify_signup():
     return response
 
 @app.route("/auth/logout", methods=["POST"])
+@unit_of_work()
 def logout():
     """
     removes the session id
     """
     session_id = request.cookies.get("SID", None)
-    if session_id is None:
-        response = Response(
-            response=json.dumps({"code": 401, "message": "The session id must be specified"}),
-            status=401,
-            mimetype="application/json")
-        return response
 
     # get connection and cursor
     conn, cursor = get_conn_cursor()
-
-    # remove session from table
-    result = sessions.remove_session(cursor=cursor, session_id=session_id)
-
-    close_conn_cursor(conn, cursor)
-
-    # if nothing could be removed, return error
-    if result["success"] is False:
-        response = Response(
-            response=json.dumps({"code": 401, "message": str(result["error"])}),
-            status=401,
-            mimetype="application/json")
-        return response
+    result = auth.logout(cursor=cursor, session_id=session_id)
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
 
     # return 204
-    response = Response(
-        status=204)
-    return response
+    return service_response(result, status=204)
 
 # @app.route("/auth/delete", methods=["DELETE"])
 def TEST_DELETE_PLEASE_REMOVE():
@@ -416,7 +364,7 @@ def TEST_DELETE_PLEASE_REMOVE():
     result = sessions.get_user(cursor=cursor, session_id=session_id, keywords=["id", "user_role"])
 
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 401, "message": str(result["error"])}),
             status=401,
@@ -427,6 +375,7 @@ def TEST_DELETE_PLEASE_REMOVE():
     user_id = result["data"][0]
 
     result = db.remove_table(cursor=cursor, table_name="users", conditions={"id": user_id})
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
     if result["success"] is False:
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
@@ -439,6 +388,7 @@ def TEST_DELETE_PLEASE_REMOVE():
 # TODO: test automatic deletion from all stueble parties
 # TODO: uncomment route
 @app.route("/auth/delete", methods=["DELETE"])
+@unit_of_work()
 def delete():
     """
     delete a user (set password to NULL)
@@ -459,7 +409,7 @@ def delete():
     result = sessions.get_user(cursor=cursor, session_id=session_id, keywords=["id", "user_role"])
 
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 401, "message": str(result["error"])}),
             status=401,
@@ -467,7 +417,7 @@ def delete():
         return response
 
     if result["data"][1] == UserRole.ADMIN.value:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 403, "message": "Admins cannot be deleted"}),
             status=403,
@@ -480,7 +430,7 @@ def delete():
     # remove user from table
     result = users.remove_user(cursor=cursor, user_id=user_id)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
             status=500,
@@ -490,7 +440,7 @@ def delete():
     # remove session from table
     result = sessions.remove_session(cursor=cursor, session_id=session_id)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
             status=500,
@@ -499,7 +449,7 @@ def delete():
 
     # remove from guest_list
     result = events.remove_guest(cursor=cursor, user_id=user_id, stueble_id=-1)
-    close_conn_cursor(conn, cursor)
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
     if result["success"] is False:
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
@@ -513,6 +463,7 @@ def delete():
     return response
 
 @app.route("/auth/reset_password", methods=["POST"])
+@unit_of_work()
 def reset_password_mail():
     """
     reset password of a user
@@ -550,7 +501,7 @@ def reset_password_mail():
     # check whether user with email exists
     result = users.get_user(cursor=cursor, keywords=["id", "first_name", "last_name", "email", "password_hash"], user_email=user_email, user_name=user_name)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 500 if result["error"] != "No matching user found" else 404, "message": str(result["error"])}),
             status=500 if result["error"] != "No matching user found" else 404,
@@ -563,7 +514,7 @@ def reset_password_mail():
     password_hash = result["data"][4]
 
     if password_hash is None or password_hash == "":
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 400, "message": "User was deleted, needs to signup again."}),
             status=400,
@@ -573,7 +524,7 @@ def reset_password_mail():
     email = Email(email=email)
 
     result = users.create_verification_code(cursor=cursor, user_id=user_id)
-    close_conn_cursor(conn, cursor)
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
     if result["success"] is False:
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
@@ -596,6 +547,7 @@ def reset_password_mail():
     return response
 
 @app.route("/auth/reset_password_confirm", methods=["POST"])
+@unit_of_work()
 def confirm_code():
     """
     confirm the reset code and set a new password
@@ -626,7 +578,7 @@ def confirm_code():
     # check whether reset token exists
     result = users.confirm_verification_code(cursor=cursor, reset_code=reset_token, expiration_minutes=30)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
             status=500,
@@ -641,7 +593,7 @@ def confirm_code():
     # set new password
     result = users.update_user(cursor=cursor, user_id=user_id, password_hash=hashed_password)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
             status=500,
@@ -652,7 +604,7 @@ def confirm_code():
     result = sessions.remove_user_sessions(cursor=cursor, user_id=user_id)
     if result["success"] is False:
         if result["error"] != "no sessions found":
-            close_conn_cursor(conn, cursor)
+            close_conn_cursor(conn, cursor, failed=True)
             response = Response(
                 response=json.dumps({"code": 500, "message": str(result["error"])}),
                 status=500,
@@ -661,7 +613,7 @@ def confirm_code():
 
     # create a new session
     result = sessions.create_session(cursor=cursor, user_id=user_id)
-    close_conn_cursor(conn, cursor)
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
     if result["success"] is False:
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
@@ -685,6 +637,7 @@ def confirm_code():
 # NOTE: no websocket update, since neither password nor username are needed
 @app.route("/auth/change_password", methods=["POST"])
 @app.route("/auth/change_username", methods=["POST"])
+@unit_of_work()
 def change_user_data():
     """
     changes user data when logged in \n
@@ -705,14 +658,14 @@ def change_user_data():
     # check permissions
     result = check_permissions(cursor=cursor, session_id=session_id, required_role=UserRole.USER)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 401, "message": str(result["error"])}),
             status=401,
             mimetype="application/json")
         return response
     if result["data"]["allowed"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 403, "message": "invalid permissions, need role user or above"}),
             status=403,
@@ -725,14 +678,14 @@ def change_user_data():
     if request.path == "/user/change_password":
         new_pwd = data.get("newPassword", None)
         if new_pwd is None:
-            close_conn_cursor(conn, cursor)
+            close_conn_cursor(conn, cursor, failed=True)
             response = Response(
                 response=json.dumps({"code": 400, "message": "The new_password must be specified"}),
                 status=400,
                 mimetype="application/json")
             return response
         if new_pwd == "":
-            close_conn_cursor(conn, cursor)
+            close_conn_cursor(conn, cursor, failed=True)
             response = Response(
                 response=json.dumps({"code": 400, "message": "Password cannot be empty"}),
                 status=400,
@@ -742,14 +695,14 @@ def change_user_data():
     elif request.path == "/user/change_username":
         username = data.get("username", None)
         if username is None:
-            close_conn_cursor(conn, cursor)
+            close_conn_cursor(conn, cursor, failed=True)
             response = Response(
                 response=json.dumps({"code": 400, "message": "Username must be specified"}),
                 status=400,
                 mimetype="application/json")
             return response
         if username == "":
-            close_conn_cursor(conn, cursor)
+            close_conn_cursor(conn, cursor, failed=True)
             response = Response(
                 response=json.dumps({"code": 400, "message": "Username cannot be empty"}),
                 status=400,
@@ -760,7 +713,7 @@ def change_user_data():
     # get user id from session id
     result = users.update_user(cursor=cursor, session_id=session_id,
                                user_id=user_id, **data)
-    close_conn_cursor(conn, cursor)
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
     if result["success"] is False and ("user_name" in data.keys()):
         error = result["error"]
         if f"Key (user_name)=({data['user_name']}) already exists." in error:
@@ -787,9 +740,12 @@ Guest list management
 
 # NOTE: if no stueble is happening today or yesterday, an empty list is returned
 @app.route("/guests", methods=["GET"])
+@unit_of_work()
 def guests():
     """
-    returns list of all guests
+    returns list of all guests \n
+    the encoded list is cached per stueble and sent with an ETag, with a matching If-None-Match 304 is returned \n
+    with Accept: application/x-msgpack the list is sent as msgpack
     """
 
     session_id = request.cookies.get("SID", None)
@@ -801,28 +757,37 @@ def guests():
         return response
 
     # get connection and cursor
-    conn, cursor = get_conn_cursor()
+    conn, cursor = get_read_conn_cursor()
 
     # check permissions, since only hosts can add guests
     result = check_permissions(cursor=cursor, session_id=session_id, required_role=UserRole.HOST)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
             status=500,
             mimetype="application/json")
         return response
     if result["data"]["allowed"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 401, "message": "invalid permissions, need role host or above"}),
             status=401,
             mimetype="application/json")
         return response
 
-    # get guest list
-    result = guest_events.guest_list(cursor=cursor)
-    close_conn_cursor(conn, cursor) # close conn, cursor
+    # get guest list of the current stueble
+    result = motto.get_motto(cursor=cursor)
+    if result["success"] is False and result["error"] == "no motto found":
+        close_conn_cursor(conn, cursor)
+        response = Response(
+            response=json.dumps([]),
+            status=200,
+            mimetype="application/json")
+        return response
+    if result["success"] is True:
+        result = guest_list_cache.get(stueble_id=result["data"][2])
+    close_conn_cursor(conn, cursor, failed=result["success"] is False) # close conn, cursor
     if result["success"] is False:
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
@@ -830,14 +795,25 @@ def guests():
             mimetype="application/json")
         return response
 
+    if request.accept_mimetypes.best_match(["application/json", "application/x-msgpack"]) == "application/x-msgpack":
+        body, etag, mimetype = result["data"]["msgpack"], result["data"]["msgpack_etag"], "application/x-msgpack"
+    else:
+        body, etag, mimetype = result["data"]["json"], result["data"]["json_etag"], "application/json"
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept, Cookie"}
+
+    if etag_matches(request.headers.get("If-None-Match", None), etag):
+        return Response(status=304, headers=headers)
+
     response = Response(
-        response=json.dumps(result["data"]),
+        response=body,
         status=200,
-        mimetype="application/json"
+        mimetype=mimetype,
+        headers=headers
     )
     return response
 
 @app.route("/guest", methods=["POST"])
+@unit_of_work()
 def guest_change():
     """
     add / remove a guest to the guest_list of present people
@@ -846,131 +822,39 @@ def guest_change():
     # load data
     data = request.get_json()
     session_id = request.cookies.get("SID", None)
-    user_uuid = data.get("id", None)
-    present = data.get("present", None)
-
-    if session_id is None or user_uuid is None or present is None:
-        response = Response(
-            response=json.dumps({"code": 401, "message": "The session id, uuid, present must be specified"}),
-            status=401,
-            mimetype="application/json")
-        return response
 
     # get connection and cursor
     conn, cursor = get_conn_cursor()
 
-    # check permissions, since only hosts can add guests
-    result = check_permissions(cursor=cursor, session_id=session_id, required_role=UserRole.HOST)
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 401, "message": str(result["error"])}),
-            status=401,
-            mimetype="application/json")
-        return response
-    if result["data"]["allowed"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 403, "message": "invalid permissions, need role host or above"}),
-            status=403,
-            mimetype="application/json")
-        return response
-
-    event_type = EventType.ARRIVE if present else EventType.LEAVE
-
-    # get user data
-    keywords = ["first_name", "last_name", "room", "residence", "verified", "user_role", "id"]
-    data = users.get_user(
-        cursor=cursor,
-        user_uuid=user_uuid,
-        keywords=keywords,
-        expect_single_answer=True)
-
-    if data["success"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 500, "message": str(data["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
-    
-    guest_user_id = data["data"][-1]
-    data["data"] = data["data"][:-1]
-
-    if event_type == EventType.ARRIVE:
-        # verify guest if not verified yet
-        if data["data"][4] is False:
-            result = users.update_user(cursor=cursor,
-                                       user_uuid_key=user_uuid, 
-                                       verified=True)
-            if result["success"] is False:
-                close_conn_cursor(conn, cursor)
-                response = Response(
-                    response=json.dumps({"code": 500, "message": str(result["error"])}),
-                    status=500,
-                    mimetype="application/json")
-                return response
-
-    # change guest status to arrive / leave
-    result = guest_events.change_guest(cursor=cursor, user_uuid=user_uuid, event_type=event_type)
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        error = {"code": 500, "message": str(result["error"])}
-        if all(i in error["message"] for i in ["Inviter of user", "is not registered for stueble"]):
-            error = {"code": 400, "message": "Inviter not registered to stueble any more"}
-        elif "is not registered for stueble" in error["message"]:
-            error = {"code": 400, "message": "User not registered to stueble"}
-        elif "; code: " in error["message"]:
-            error_message, status_code = error["message"].split("; code: ")
-            status_code = int(status_code.split("\n")[0])
-            error = {"code": status_code, "message": error_message}
-        response = Response(
-            response=json.dumps(error),
-            status=error["code"],
-            mimetype="application/json")
-        return response
-
-    user_info = {key: value for key, value in zip(keywords, data["data"])}
-    user_info["user_role"] = FrontendUserRole.EXTERN if user_info["user_role"] == "extern" else FrontendUserRole.INTERN
+    # check permissions, verify guest and change guest status to arrive / leave in one call
+    result = guest_service.check_in(cursor=cursor, session_id=session_id, user_uuid=data.get("id", None), present=data.get("present", None))
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
 
-    user_data = {
-            "id": user_uuid,
-            "present": present,
-            "firstName": user_info["first_name"],
-            "lastName": user_info["last_name"],
-            "extern": user_info["user_role"] == FrontendUserRole.EXTERN}
-
-    if user_info["user_role"] == FrontendUserRole.INTERN:
-        user_data["roomNumber"] = user_info["room"]
-        user_data["residence"] = user_info["residence"]
-        user_data["verified"] = True
+    # the hosts get guestModified, the guest the stueble status
+    return service_response(result, status=204)
 
-    message = user_data
-
-    result = sessions.get_session_ids(cursor=cursor, user_id=guest_user_id, uuid=True)
-    close_conn_cursor(conn, cursor)
-    if result["success"] is False:
-        response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
-    guest_session_ids = result["data"]
+@app.route("/guest/batch", methods=["POST"])
+@unit_of_work()
+def guest_change_batch():
+    """
+    apply buffered door scans (e.g. after the connection of a scanner dropped) in one request
+    """
 
-    # send a websocket message to all hosts that the guest list changed
-    asyncio.run(ws.broadcast(event="guestModified", data=message)) # don't skip_sid for guestModified
+    # load data
+    data = request.get_json()
+    session_id = request.cookies.get("SID", None)
 
-    # send a websocket message to the user
-    for sess_id in guest_session_ids:
-        asyncio.run(ws.stueble_status(session_id=sess_id, registered=True, present=present))
+    # get connection and cursor
+    conn, cursor = get_conn_cursor()
+    result = guest_service.check_in_batch(cursor=cursor, session_id=session_id, scans=data.get("scans", None))
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
 
-    # return 204
-    response = Response(
-        status=204)
-    return response
+    # one guestModified message for all scans, stueble status for the guests
+    return service_response(result)
 
 # TODO broadcast add remove user
 @app.route("/guests", methods=["PUT", "DELETE"])
+@unit_of_work()
 def attend_stueble():
     """
     sign up for a stueble party
@@ -989,6 +873,8 @@ def attend_stueble():
     required_role = UserRole.USER
     if user_uuid is not None:
         required_role = UserRole.HOST
+    # only self registrations go through the admission queue
+    self_registration = user_uuid is None
 
     # get connection and cursor
     conn, cursor = get_conn_cursor()
@@ -996,14 +882,14 @@ def attend_stueble():
     if date is None:
         result = motto.get_motto(cursor=cursor)
         if result["success"] is False:
-            close_conn_cursor(conn, cursor)
+            close_conn_cursor(conn, cursor, failed=True)
             response = Response(
                 response=json.dumps({"code": 500, "message": str(result["error"])}),
                 status=500,
                 mimetype="application/json")
             return response
         if result["data"] is None:
-            close_conn_cursor(conn, cursor)
+            close_conn_cursor(conn, cursor, failed=True)
             response = Response(
                 response=json.dumps({"code": 400, "message": "No stueble is happening in the next time"}),
                 status=400,
@@ -1012,6 +898,7 @@ def attend_stueble():
         date = result["data"][1]
 
     if session_id is None or date is None:
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 401, "message": f"The session id and date must be specified"}),
             status=401,
@@ -1023,14 +910,14 @@ def attend_stueble():
     result = check_permissions(cursor=cursor, session_id=session_id, required_role=required_role)
 
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 401, "message": str(result["error"])}),
             status=401,
             mimetype="application/json")
         return response
     if result["data"]["allowed"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 403, "message": "invalid permissions, need role user or above"}),
             status=403,
@@ -1043,7 +930,7 @@ def attend_stueble():
     else:
         result = users.get_user(cursor=cursor, user_uuid=user_uuid, keywords=["id", "user_uuid"], expect_single_answer=True)
         if result["success"] is False:
-            close_conn_cursor(conn, cursor)
+            close_conn_cursor(conn, cursor, failed=True)
             response = Response(
                 response=json.dumps({"code": 500, "message": str(result["error"])}),
                 status=500,
@@ -1055,7 +942,7 @@ def attend_stueble():
     # get all sessions of user
     result = sessions.get_session_ids(cursor=cursor, user_id=user_id, uuid=True)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
             status=500,
@@ -1065,7 +952,7 @@ def attend_stueble():
 
     result = motto.get_info(cursor=cursor, date=date)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
             status=500,
@@ -1074,325 +961,80 @@ def attend_stueble():
 
     stueble_id = result["data"][0]
 
-    if request.method == "PUT":
-        result = events.add_guest(
-            cursor=cursor,
-            user_id=user_id,
-            stueble_id=stueble_id)
-    else:
-        result = events.remove_guest(
-            cursor=cursor,
-            user_id=user_id,
-            stueble_id=stueble_id)
-
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        status_code = 500
-        error = str(result["error"])
-        if "; code: " in str(result["error"]):
-            error, status_code = str(result["error"]).split("; code: ")
-            status_code = status_code.split("\n")[0]
-            status_code = int(status_code)
-        response = Response(
-            response=json.dumps({"code": status_code, "message": error}),
-            status=status_code,
-            mimetype="application/json")
-        return response
-
-    if request.method == "PUT":
-        # TODO unneccessary
-        timestamp = int(datetime.datetime.now().timestamp())
-        
-        information = {"id": user_uuid, "timestamp": timestamp, "extern": False}
-
-        signature = hp.create_signature(message=information)
-
-        data = {"data":
-                    information,
-                "signature": signature}
-        response = Response(
-            response=json.dumps(data),
-            status=200,
-            mimetype="application/json")
-
-        # get user data
-        keywords = ["first_name", "last_name", "room", "residence", "verified"]
-        result = users.get_user(
-            cursor=cursor,
-            user_id=user_id,
-            keywords=keywords,
-            expect_single_answer=True)
-
-        close_conn_cursor(conn, cursor)
+    if self_registration and request.method == "PUT":
+        # a registered user would be put on the waitlist of a full stueble, the trigger only rejects it on insert
+        result = events.check_guest(cursor=cursor, user_id=user_id, stueble_id=stueble_id)
         if result["success"] is False:
+            close_conn_cursor(conn, cursor, failed=True)
             response = Response(
                 response=json.dumps({"code": 500, "message": str(result["error"])}),
                 status=500,
                 mimetype="application/json")
             return response
-
-        user_info = {key: value for key, value in zip(keywords, result["data"])}
-        user_info["user_role"] = FrontendUserRole.INTERN
-
-        user_data = {
-            "id": user_uuid,
-            "present": False,
-            "firstName": user_info["first_name"],
-            "lastName": user_info["last_name"],
-            "extern": False,
-            "roomNumber": user_info["room"],
-            "residence": user_info["residence"],
-            "verified": True if user_info["verified"] is not None else False}
-    else:
-        response = Response(
-            status=204)
-    action_type = Action_Type("guestAdded" if request.method == "PUT" else "guestRemoved")
-
-    # send a websocket message to all hosts that the guest list changed
-    asyncio.run(ws.broadcast(event=action_type.value, data=user_data if request.method == "PUT" else user_uuid, skip_sid=session_id))
-
-    # send a websocket message to the user
-    for sess_id in guest_session_ids:
-        asyncio.run(ws.stueble_status(session_id=sess_id, date=date, registered=True if request.method == "PUT" else False, present=False))
-
-    return response
-
-# NOTE: extern guest can be multiple times in table users since only first_name, last_name are specified, which are not unique
-@app.route("/guests/invitee", methods=["PUT", "DELETE"])
-def invitee():
-    """
-    invite a friend and share a qr-code
-    """
-    try:
-        # load data
-        data = request.get_json()
-        session_id = request.cookies.get("SID", None)
-        date = data.get("date", None)
-        invitee_first_name = data.get("firstName", None)
-        invitee_last_name = data.get("lastName", None)
-        invitee_email = data.get("email", None)
-        if invitee_email is not None:
-            try:
-                invitee_email = Email(invitee_email)
-            except ValueError:
-                response = Response(
-                    response=json.dumps({"code": 400, "message": "Invalid email format"}),
-                    status=400,
-                    mimetype="application/json")
-                return response
-
-        if any(i is None for i in [session_id, invitee_first_name, invitee_last_name, invitee_email]):
-            response = Response(
-                response=json.dumps({"code": 401,
-                    "message": f"session_id, date, invitee_first_name, invitee_last_name, invitee_email must be specified"}),
-                status=401,
-                mimetype="application/json")
-            return response
-
-        # get connection and cursor
-        conn, cursor = get_conn_cursor()
-
-        # check permissions, since only users can add guests
-        result = check_permissions(cursor=cursor, session_id=session_id, required_role=UserRole.USER)
-
-        if result["success"] is False:
-            # close_conn_cursor(conn, cursor)
+        if result["data"] is True:
+            close_conn_cursor(conn, cursor, failed=True)
             response = Response(
-                response=json.dumps({"code": 401, "message": str(result["error"])}),
-                status=401,
-                mimetype="application/json")
-            return response
-        if result["data"]["allowed"] is False:
-            # close_conn_cursor(conn, cursor)
-            response = Response(
-                response=json.dumps({"code": 403, "message": "invalid permissions, need role user or above"}),
-                status=403,
+                response=json.dumps({"code": 400, "message": f"User cannot be added to stueble {stueble_id} since already added to stueble {stueble_id}"}),
+                status=400,
                 mimetype="application/json")
             return response
-
-        user_role = UserRole(result["data"]["user_role"])
-
-        user_id = result["data"]["user_id"]
-        first_name = result["data"]["first_name"]
-        last_name = result["data"]["last_name"]
-
-        if user_role < UserRole.HOST:
-            result = users.check_user_guest_list(cursor=cursor, user_id=user_id)
-            if result["success"] is False:
-                # close_conn_cursor(conn, cursor)
-                response = Response(
-                    response=json.dumps({"code": 500, "message": str(result["error"])}),
-                    status=500,
-                    mimetype="application/json")
-                return response
-            if result["data"] is False:
-                # close_conn_cursor(conn, cursor)
-                response = Response(
-                    response=json.dumps({"code": 403, "message": "You need to be on the guest list to invite someone"}),
-                    status=403,
-                    mimetype="application/json")
-                return response
-        
-            # check, whether user is present
-            result = users.check_user_present(cursor=cursor, user_id=user_id)
-            if result["success"] is False:
-                close_conn_cursor(conn, cursor)
-                return response
-            present = result["data"]
-        else:
-            present = False
-
-        # get all sessions for user
-        result = sessions.get_session_ids(cursor=cursor, user_id=user_id, uuid=True)
+        result = admission.request_slot(cursor=cursor, stueble_id=stueble_id, user_id=user_id, user_uuid=user_uuid)
         if result["success"] is False:
-            close_conn_cursor(conn, cursor)
+            close_conn_cursor(conn, cursor, failed=True)
             response = Response(
                 response=json.dumps({"code": 500, "message": str(result["error"])}),
                 status=500,
                 mimetype="application/json")
             return response
-        guest_session_ids = result["data"]
-
-        result = motto.get_info(cursor=cursor, date=date)
-        if result["success"] is False:
-            # close_conn_cursor(conn, cursor)
+        if result["data"]["granted"] is False:
+            close_conn_cursor(conn, cursor)
             response = Response(
-                response=json.dumps({"code": 500, "message": str(result["error"])}),
-                status=500,
+                response=json.dumps({"code": 202, "message": "The stueble is full, you are on the waitlist", "position": result["data"]["position"]}),
+                status=202,
                 mimetype="application/json")
             return response
+    elif self_registration and admission.leave(stueble_id=stueble_id, user_id=user_id):
+        # the user was only on the waitlist
+        close_conn_cursor(conn, cursor)
+        response = Response(
+            status=204)
+        return response
 
-        stueble_id = result["data"][0]
-        motto_name = result["data"][1]
-        stueble_date = result["data"][2]
-        stueble_date = stueble_date.strftime("%d.%m.%Y")
-
+    # a slot of the admission is given back in any case, it only counts as registered once the registration is committed
+    slot_taken = self_registration and request.method == "PUT"
+    registered = False
+    try:
         if request.method == "PUT":
-            # add user to table
-            result = users.add_user(
-                cursor=cursor,
-                user_role=UserRole.EXTERN,
-                first_name=invitee_first_name,
-                last_name=invitee_last_name,
-                returning_column="id, user_uuid") # id, user_uuid on purpose like that
-
-        else:
-            # get user to remove
-            result = users.get_user(
+            result = events.add_guest(
                 cursor=cursor,
-                keywords=["id", "user_uuid"],
-                conditions={"first_name": invitee_first_name, "last_name": invitee_last_name, "user_role": UserRole.EXTERN.value},
-                expect_single_answer=False)
-
-        if result["success"] is False:
-            # close_conn_cursor(conn, cursor)
-            response = Response(
-                response=json.dumps({"code": 500, "message": str(result["error"])}),
-                status=500,
-                mimetype="application/json")
-            return response
-        if request.method == "PUT":
-            created_invitee_id = result["data"][0]
-
-        if request.method == "DELETE":
-            possible_users = result["data"]
-            if len(possible_users) == 0:
-                # close_conn_cursor(conn, cursor)
-                response = Response(
-                    response=json.dumps({"code": 404, "message": "No such user found"}),
-                    status=404,
-                    mimetype="application/json")
-                return response
-            users_list = []
-            for i in possible_users:
-                query = """
-                SELECT user_id FROM events
-                WHERE user_id = %s AND stueble_id = %s AND event_type = 'add' AND invited_by = %s
-                ORDER BY submitted DESC LIMIT 1"""
-                result = db.custom_call(cursor=cursor,
-                                        query=query,
-                                        type_of_answer=db.ANSWER_TYPE.SINGLE_ANSWER,
-                                        variables=[i[0], stueble_id, user_id])
-                if result["success"] is False:
-                    # close_conn_cursor(conn, cursor)
-                    response = Response(
-                        response=json.dumps({"code": 500, "message": str(result["error"])}),
-                        status=500,
-                        mimetype="application/json")
-                    return response
-                if result["data"] is None:
-                    continue
-                possible_invitee_id = result["data"][0][0]
-
-                result = users.get_user(cursor=cursor,
-                                        user_id=possible_invitee_id,
-                                        keywords=["user_uuid"],
-                                        expect_single_answer=True)
-                if result["success"] is False:
-                    # close_conn_cursor(conn, cursor)
-                    response = Response(
-                        response=json.dumps({"code": 500, "message": str(result["error"])}),
-                        status=500,
-                        mimetype="application/json")
-                    return response
-                if result["data"] is None:
-                    # close_conn_cursor(conn, cursor)
+                user_id=user_id,
+                stueble_id=stueble_id)
+            if slot_taken and result["success"] is False and "Maximum capacity" in str(result["error"]):
+                # the counter of the admission was behind the db, the user keeps their place at the front of the waitlist
+                slot_taken = False
+                position = admission.confirm(stueble_id=stueble_id, user_id=user_id, user_uuid=user_uuid,
+                                             registered=False, full=True)
+                if position is not None:
+                    close_conn_cursor(conn, cursor, failed=True)
                     response = Response(
-                        response=json.dumps({"code": 500, "message": "Data integrity error, user not found"}),
-                        status=500,
+                        response=json.dumps({"code": 202, "message": "The stueble is full, you are on the waitlist", "position": position}),
+                        status=202,
                         mimetype="application/json")
                     return response
-                possible_invitee_uuid = result["data"][0]
-                users_list.append({"invitee_id": possible_invitee_id, "invitee_uuid": possible_invitee_uuid})
-            if len(users_list) == 0:
-                # close_conn_cursor(conn, cursor)
-                response = Response(
-                    response=json.dumps({"code": 401, "message": "No such user found"}),
-                    status=401,
-                    mimetype="application/json")
-                return response
-            if len(users_list) > 1:
-                # close_conn_cursor(conn, cursor)
-                response = Response(
-                    response=json.dumps({"code": 409, "message": "Multiple users found, please contact an admin"}),
-                    status=409,
-                    mimetype="application/json")
-                return response
-            invitee_id = users_list[0]["invitee_id"]
-            invitee_uuid = users_list[0]["invitee_uuid"]
-        else:
-            invitee_id = result["data"][0]
-            invitee_uuid = result["data"][1]
-
-        if request.method == "PUT":
-            result = events.add_guest(
-                cursor=cursor,
-                user_id=invitee_id,
-                stueble_id=stueble_id,
-                invited_by=user_id)
         else:
             result = events.remove_guest(
                 cursor=cursor,
-                user_id=invitee_id,
+                user_id=user_id,
                 stueble_id=stueble_id)
 
         if result["success"] is False:
+            close_conn_cursor(conn, cursor, failed=True)
             status_code = 500
             error = str(result["error"])
             if "; code: " in str(result["error"]):
                 error, status_code = str(result["error"]).split("; code: ")
                 status_code = status_code.split("\n")[0]
                 status_code = int(status_code)
-            if request.method == "PUT":
-                result = db.remove_table(cursor=cursor, table_name="users", conditions={"id": created_invitee_id})
-                # close_conn_cursor(conn, cursor)
-                if result["success"] is False:
-                    response = Response(
-                        response=json.dumps({"code": 500, "message": str(result["error"])}),
-                        status=500,
-                        mimetype="application/json")
-                    return response
-            # close_conn_cursor(conn, cursor)
             response = Response(
                 response=json.dumps({"code": status_code, "message": error}),
                 status=status_code,
@@ -1400,139 +1042,114 @@ def invitee():
             return response
 
         if request.method == "PUT":
+            # TODO unneccessary
             timestamp = int(datetime.datetime.now().timestamp())
+        
+            information = {"id": user_uuid, "timestamp": timestamp, "extern": False}
+
+            signature = hp.create_signature(message=information)
+
+            data = {"data":
+                        information,
+                    "signature": signature}
+            response = Response(
+                response=json.dumps(data),
+                status=200,
+                mimetype="application/json")
 
-            information = {"id": invitee_uuid, "timestamp": timestamp, "extern": True}
+            # get user data
+            keywords = ["first_name", "last_name", "room", "residence", "verified"]
+            result = users.get_user(
+                cursor=cursor,
+                user_id=user_id,
+                keywords=keywords,
+                expect_single_answer=True)
 
-            result = hp.create_signature(message=information)
+            close_conn_cursor(conn, cursor, failed=result["success"] is False)
             if result["success"] is False:
-                close_conn_cursor(conn, cursor)
                 response = Response(
                     response=json.dumps({"code": 500, "message": str(result["error"])}),
                     status=500,
                     mimetype="application/json")
                 return response
-            
-            signature = result["data"]
-
-            data = {"data":information,
-                    "signature": signature}
-
-        # get user data
-        keywords = ["first_name", "last_name", "room", "residence", "verified"]
-        result = users.get_user(
-            cursor=cursor,
-            user_id=invitee_id,
-            keywords=keywords,
-            expect_single_answer=True)
 
-        # close_conn_cursor(conn, cursor)
-        if result["success"] is False:
+            user_info = {key: value for key, value in zip(keywords, result["data"])}
+            user_info["user_role"] = FrontendUserRole.INTERN
+
+            user_data = {
+                "id": user_uuid,
+                "present": False,
+                "firstName": user_info["first_name"],
+                "lastName": user_info["last_name"],
+                "extern": False,
+                "roomNumber": user_info["room"],
+                "residence": user_info["residence"],
+                "verified": bool(user_info["verified"])}
+        else:
             response = Response(
-                response=json.dumps({"code": 500, "message": str(result["error"])}),
-                status=500,
-                mimetype="application/json")
-            return response
-
-        invitee_info = {key: value for key, value in zip(keywords, result["data"])}
-        invitee_info["user_role"] = FrontendUserRole.EXTERN
+                status=204)
+        registered = True
+    finally:
+        if slot_taken:
+            admission.confirm(stueble_id=stueble_id, user_id=user_id, user_uuid=user_uuid, registered=registered)
 
-        invitee_data = {
-            "id": invitee_uuid,
-            "present": False,
-            "firstName": invitee_info["first_name"],
-            "lastName": invitee_info["last_name"],
-            "extern": True}
+    action_type = Action_Type("guestAdded" if request.method == "PUT" else "guestRemoved")
 
-        action_type = Action_Type("guestAdded") if request.method == "PUT" else Action_Type("guestRemoved")
+    # send a websocket message to all hosts that the guest list changed
+    asyncio.run(ws.broadcast(event=action_type.value, data=user_data if request.method == "PUT" else user_uuid, skip_sid=session_id,
+                             stueble_id=stueble_id))
 
-        # send a websocket message to all hosts that the guest list changed
-        asyncio.run(ws.broadcast(event=action_type.value, data=invitee_data)) # don't skip_sid for guestModified
+    # send a websocket message to the user
+    for sess_id in guest_session_ids:
+        asyncio.run(ws.stueble_status(session_id=sess_id, date=date, registered=True if request.method == "PUT" else False, present=False))
 
-        # send a websocket message to the user
-        for sess_id in guest_session_ids:
-            asyncio.run(ws.stueble_status(session_id=sess_id, date=date, registered=True, present=present))
+    return response
 
-        if request.method == "DELETE":
-            response = Response(
-                status=204)
-            return response
+@app.route("/guests/invitee", methods=["PUT", "DELETE"])
+@unit_of_work()
+def invitee():
+    """
+    invite a friend and share a qr-code
+    """
+    # load data
+    data = request.get_json()
+    session_id = request.cookies.get("SID", None)
 
-        if invitee_email is not None:
-            qr_code = qr.generate(json.dumps(data), size=400, rounded_edges=30)
-            result = templates.stueble_guest(invitee_first_name=invitee_first_name,
-                                    invitee_last_name=invitee_last_name,
-                                    first_name=first_name,
-                                    last_name=last_name,
-                                    stueble_date=stueble_date,
-                                    motto_name=motto_name,
-                                    qr_code=qr_code)
-            mail.send_mail(invitee_email, result["subject"], result["body"], html=True, images=result["images"])
+    # get connection and cursor
+    conn, cursor = get_conn_cursor()
+    result = invitees.change_invitee(cursor=cursor,
+                                     session_id=session_id,
+                                     method="add" if request.method == "PUT" else "remove",
+                                     first_name=data.get("firstName", None),
+                                     last_name=data.get("lastName", None),
+                                     email=data.get("email", None),
+                                     date=data.get("date", None))
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
 
-        if request.method == "PUT":
-            response = Response(
-                status=204)
-            return response
+    return service_response(result, status=204)
 
-        response = Response(
-            response=json.dumps(data),
-            status=200,
-            mimetype="application/json")
-        return response
-    finally:
-        try:
-            close_conn_cursor(conn, cursor)
-        except:
-            pass
 """
 User management
 """
 
 @app.route("/user", methods=["GET"])
+@unit_of_work()
 def user():
     """
     return data to user
     """
 
     session_id = request.cookies.get("SID", None)
-    if session_id is None:
-        response = Response(
-            response=json.dumps({"code": 401, "message": "The session id must be specified"}),
-            status=400,
-            mimetype="application/json")
-        return response
 
     # get connection and cursor
     conn, cursor = get_conn_cursor()
+    result = auth.current_user(cursor=cursor, session_id=session_id)
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
 
-    # get user id from session id
-    result = sessions.get_user(cursor=cursor, session_id=session_id, keywords=("id", "user_role", "user_uuid", "room", "residence", "first_name", "last_name", "email", "user_name"))
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 401, "message": str(result["error"])}),
-            status=401,
-            mimetype="application/json")
-        return response
-    data = result["data"]
-
-    # initialize user
-    user = {"firstName": data[5],
-            "lastName": data[6],
-            "roomNumber": data[3],
-            "residence": data[4],
-            "email": data[7],
-            "id": data[0], 
-            "username": data[8]}
-
-    close_conn_cursor(conn, cursor)
-    response = Response(
-        response=json.dumps(user),
-        status=200,
-        mimetype="application/json")
-    return response
+    return service_response(result)
 
 @app.route("/user", methods=["POST"])
+@unit_of_work()
 def verify_user():
     """
     verify a user (only hosts and above can verify users)
@@ -1540,89 +1157,17 @@ def verify_user():
     # load data
     data = request.get_json()
     session_id = request.cookies.get("SID", None)
-    if session_id is None:
-        response = Response(
-            response=json.dumps({"code": 401, "message": "The session id must be specified"}),
-            status=401,
-            mimetype="application/json")
-        return response
 
     # get connection and cursor
     conn, cursor = get_conn_cursor()
+    result = guest_service.verify_guest(cursor=cursor, session_id=session_id, user_uuid=data.get("id", None), method=data.get("method", None))
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
 
-    # check permissions, since only tutors or above can change user role
-    result = check_permissions(cursor=cursor, session_id=session_id,
-                               required_role=UserRole.USER)
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 401, "message": str(result["error"])}),
-            status=401,
-            mimetype="application/json")
-        return response
-    if result["data"]["allowed"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 403, "message": "invalid permissions, need role tutor or above"}),
-            status=403,
-            mimetype="application/json")
-        return response
-    user_id = result["data"]["user_id"]
-
-    result = users.update_user(cursor=cursor,
-                               user_id=user_id,
-                               verified=True)
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
-
-    keywords = ["user_uuid", "first_name", "last_name", "user_role"]
-    result = users.get_user(cursor=cursor, user_id=user_id, keywords=keywords)
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
-    user_info = {key: value for key, value in zip(keywords, result["data"])}
-
-    result = users.check_user_present(cursor=cursor, user_id=user_id)
-    close_conn_cursor(conn, cursor)
-    if result["success"] is False:
-        response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
-    present = result["data"]
-
-    user_data = {
-        "id": user_info["user_uuid"],
-        "present": present,
-        "firstName": user_info["first_name"],
-        "lastName": user_info["last_name"],
-        "extern": user_info["user_role"] == FrontendUserRole.EXTERN.value}
-
-    if user_info["user_role"] == FrontendUserRole.INTERN.value:
-        user_data["roomNumber"] = user_info["room"]
-        user_data["residence"] = user_info["residence"]
-        user_data["verified"] = True
-
-    asyncio.run(ws.broadcast(event="guestModified", data=user_data)) # don't skip_sid for guestModified
-
-    response = Response(
-        response=json.dumps(user_data),
-        status=200,
-        mimetype="application/json")
-    return response
+    return service_response(result)
 
 # TODO websocket change update user
 @app.route("/user/change_role", methods=["POST"])
+@unit_of_work()
 def change_user_role():
     """
     change the user role of a user (only admin can change user to tutor)
@@ -1652,14 +1197,14 @@ def change_user_role():
     # check permissions, since only tutors or above can change user role
     result = check_permissions(cursor=cursor, session_id=session_id, required_role=UserRole.ADMIN if new_role == UserRole.TUTOR else UserRole.TUTOR)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 401, "message": str(result["error"])}),
             status=401,
             mimetype="application/json")
         return response
     if result["data"]["allowed"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 403, "message": "invalid permissions, need role tutor or above"}),
             status=403,
@@ -1672,7 +1217,7 @@ def change_user_role():
         user_role=UserRole(new_role))
 
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
             status=500,
@@ -1688,7 +1233,7 @@ def change_user_role():
 
     result = sessions.get_session_ids(cursor=cursor, user_id=user_id)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
             status=500,
@@ -1704,7 +1249,7 @@ def change_user_role():
 
     result = users.check_user_guest_list(cursor=cursor, user_id=user_id)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
             status=500,
@@ -1715,7 +1260,7 @@ def change_user_role():
         keywords = ["user_uuid", "first_name", "last_name", "user_role"]
         result = users.get_user(cursor=cursor, user_id=user_id, keywords=keywords)
         if result["success"] is False:
-            close_conn_cursor(conn, cursor)
+            close_conn_cursor(conn, cursor, failed=True)
             response = Response(
                 response=json.dumps({"code": 500, "message": str(result["error"])}),
                 status=500,
@@ -1724,7 +1269,7 @@ def change_user_role():
         user_info = {key: value for key, value in zip(keywords, result["data"])}
 
         result = users.check_user_present(cursor=cursor, user_id=user_id)
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=result["success"] is False)
         if result["success"] is False:
             response = Response(
                 response=json.dumps({"code": 500, "message": str(result["error"])}),
@@ -1752,12 +1297,19 @@ def change_user_role():
     return response
 
 @app.route("/user/search", methods=["GET"])
+@unit_of_work()
 def search_intern():
     """
     search for a guest \n
-    allowed keys for searching are first_name, last_name, email, (room, residence), user_uuid
+    allowed keys for searching are first_name, last_name, email, (room, residence), user_uuid \n
+    q searches names and user names ranked, paged with limit and cursor, typeahead=true for a cheap prefix search
     """
 
+    # before the database is used
+    response = rate_limit("search")
+    if response is not None:
+        return response
+
     session_id = request.cookies.get("SID", None)
     if session_id is None:
         response = Response(
@@ -1769,18 +1321,18 @@ def search_intern():
     # check permissions, since only hosts can see guests
 
     # get connection and cursor
-    conn, cursor = get_conn_cursor()
+    conn, cursor = get_read_conn_cursor()
 
     result = check_permissions(cursor=cursor, session_id=session_id, required_role=UserRole.HOST)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 401, "message": str(result["error"])}),
             status=401,
             mimetype="application/json")
         return response
     if result["data"]["allowed"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 401, "message": "invalid permissions, need at least role host"}),
             status=401,
@@ -1791,7 +1343,7 @@ def search_intern():
     data = request.args.to_dict()
 
     if data is None or not isinstance(data, dict):
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 400, "message": "The data must be a valid json object"}),
             status=400,
@@ -1802,101 +1354,87 @@ def search_intern():
 
     # allowed keys to search for a user
     allowed_keys = ["first_name", "last_name", "room", "residence", "email", "id", "username"]
+    search_keys = ["q", "typeahead", "limit", "cursor"]
 
     # if no key was specified return error
-    if any(key not in allowed_keys for key in data.keys()):
-        close_conn_cursor(conn, cursor)
+    if len(data) == 0 or any(key not in allowed_keys + search_keys for key in data.keys()) \
+            or ("q" not in data and any(key in search_keys for key in data.keys())):
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
-            response=json.dumps({"code": 400, "message": f"Only the following keys are allowed: {', '.join(allowed_keys)}"}),
+            response=json.dumps({"code": 400, "message": f"Only the following keys are allowed: {', '.join(allowed_keys)} or q with {', '.join(search_keys[1:])}"}),
             status=400,
             mimetype="application/json")
         return response
 
-    keywords = ["first_name", "last_name", "user_uuid", "residence"]
-    negated_conditions = {"user_role": "extern"}
-    # search user_name
-    if "username" in data:
-        conditions = {"user_name": data["username"]}
-        result = db.read_table(
-            cursor=cursor,
-            table_name="users",
-            keywords=keywords,
-            conditions=conditions,
-            negated_conditions=negated_conditions,
-            expect_single_answer=False) # originally True but since it is handled as list, False is specified
-    
-    # search user_uuid
-    elif "id" in data:
-        conditions = {"user_uuid":data["id"]}
-        result = db.read_table(
-            cursor=cursor,
-            table_name="users",
-            keywords=keywords,
-            conditions=conditions,
-            negated_conditions=negated_conditions,
-            expect_single_answer=False) # originally True but since it is handled as list, False is specified
-
-    # search email
-    elif "email" in data:
-        conditions = {"email": data["email"]}
-        negated_conditions = {"user_role": "extern"}
-        result = db.read_table(
-            cursor=cursor,
-            table_name="users",
-            keywords=keywords,
-            conditions=conditions,
-            negated_conditions=negated_conditions,
-            expect_single_answer=False) # originally True but since it is handled as list, False is specified
-
-    # search room AND residence
-    elif "room" in data and "residence" in data:
-        conditions = {key: value for key, value in data.items() if key in ["room", "residence"]}
-        result = db.read_table(
-            cursor=cursor,
-            table_name="users",
-            keywords=keywords,
-            conditions=conditions,
-            negated_conditions=negated_conditions,
-            expect_single_answer=False) # originally True but since it is handled as list, False is specified
-        
-    # search first_name and / or last_name as well as room or residence
-    else:
-        search_dict = {
-            "first_name": "first_name ILIKE %s", 
-            "last_name": "last_name ILIKE %s", 
-            "room": "room = %s", 
-            "residence": "residence = %s"}
-        query = f"""
-        SELECT {', '.join(keywords)} FROM users
-        WHERE {" AND ".join([search_dict[key] for key in data.keys()])}
-        AND user_role != 'extern'
-        """
-        variables = [f"{value}%" if key in ["first_name", "last_name"] else value for key, value in data.items()]
-        result = db.custom_call(cursor=cursor,
-                                query=query,
-                                type_of_answer=db.ANSWER_TYPE.LIST_ANSWER,
-                                variables=variables)
-
-    close_conn_cursor(conn, cursor) # close conn, cursor
-    if result["success"] is False:
-        response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
-
-    # if data is None, set it to empty list
-    if result["data"] is None:
-        result["data"] = []
-
-    users = []
-    for entry in result["data"]:
+    # ranked search / typeahead
+    if "q" in data:
+        typeahead = data.get("typeahead", "false").lower() == "true"
+        try:
+            limit = int(data["limit"]) if "limit" in data else None
+        except ValueError:
+            limit = 0
+        invalid_query = typeahead is False and data["q"].strip() == ""
+        invalid_limit = limit is not None and limit < 1
+        invalid_cursor = "cursor" in data and (typeahead is True or search.decode_cursor(data["cursor"]) is None)
+        if invalid_query or invalid_limit or invalid_cursor:
+            close_conn_cursor(conn, cursor, failed=True)
+            response = Response(
+                response=json.dumps({"code": 400, "message": "q must not be empty, limit must be a positive integer and cursor a nextCursor of a previous search"}),
+                status=400,
+                mimetype="application/json")
+            return response
 
-        users.append({"first_name": entry[0], 
-                      "last_name": entry[1], 
-                      "id": entry[2], 
-                      "residence": entry[3]})
-    users = [{snake_to_camel_case(key): value for key, value in i.items()} for i in users]
+        if typeahead is True:
+            # suggestions come from the in-memory resident directory
+            result = resident_directory.ensure_loaded(cursor=cursor)
+            if result["success"] is True:
+                result = {"success": True, "data": resident_directory.typeahead(
+                    prefix=data["q"], limit=search.clamp_limit(limit, default=search.TYPEAHEAD_RESULTS))}
+        else:
+            result = search.search_users(cursor=cursor, query=data["q"], limit=limit, page_cursor=data.get("cursor", None))
+        close_conn_cursor(conn, cursor, failed=result["success"] is False)
+        if result["success"] is False:
+            response = Response(
+                response=json.dumps({"code": 500, "message": str(result["error"])}),
+                status=500,
+                mimetype="application/json")
+            return response
+
+        response = Response(
+            response=json.dumps(result["data"]),
+            status=200,
+            mimetype="application/json")
+        return response
+
+    try:
+        room = int(data["room"]) if "room" in data else None
+    except ValueError:
+        close_conn_cursor(conn, cursor, failed=True)
+        response = Response(
+            response=json.dumps({"code": 400, "message": "room must be a number"}),
+            status=400,
+            mimetype="application/json")
+        return response
+
+    # field searches are served from the in-memory resident directory, the db is only queried to (re)load it
+    result = resident_directory.ensure_loaded(cursor=cursor)
+    close_conn_cursor(conn, cursor, failed=result["success"] is False) # close conn, cursor
+    if result["success"] is False:
+        response = Response(
+            response=json.dumps({"code": 500, "message": str(result["error"])}),
+            status=500,
+            mimetype="application/json")
+        return response
+
+    users = resident_directory.find(
+        limit=search.MAX_RESULTS,
+        first_name=data.get("first_name", None),
+        last_name=data.get("last_name", None),
+        room=room,
+        residence=data.get("residence", None),
+        email=data.get("email", None),
+        user_name=data.get("username", None),
+        user_uuid=data.get("id", None))
 
     response = Response(
         response=json.dumps(users),
@@ -1911,6 +1449,7 @@ Motto management (GET via WebSocket)
 
 # TODO allow date changes
 @app.route("/motto", methods=["POST"])
+@unit_of_work()
 def create_stueble():
     """
     creates a new stueble event
@@ -1949,14 +1488,14 @@ def create_stueble():
     # check permissions, since only hosts or above can change the motto
     result = check_permissions(cursor=cursor, session_id=session_id, required_role=user_role)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 500, "message": str(result["error"])}),
             status=500,
             mimetype="application/json")
         return response
     if result["data"]["allowed"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
             response=json.dumps({"code": 403, "message": f"invalid permissions, need role {user_role.value} or above"}),
             status=403,
@@ -1974,7 +1513,7 @@ def create_stueble():
     if result["success"] is False:
         if result["error"] == "no stueble found":
             if actual_user_role == UserRole.HOST:
-                close_conn_cursor(conn, cursor)
+                close_conn_cursor(conn, cursor, failed=True)
                 response = Response(
                     response=json.dumps({"code": 403, "message": "invalid permissions, need role tutor or above to create a new stueble"}),
                     status=403,
@@ -1988,14 +1527,14 @@ def create_stueble():
                                     shared_apartment=shared_apartment)
 
             if result["success"] is False:
-                close_conn_cursor(conn, cursor)
+                close_conn_cursor(conn, cursor, failed=True)
                 response = Response(
                     response=json.dumps({"code": 500, "message": str(result["error"])}),
                     status=500,
                     mimetype="application/json")
                 return response
         else:
-            close_conn_cursor(conn, cursor)
+            close_conn_cursor(conn, cursor, failed=True)
             response = Response(
                 response=json.dumps({"code": 500, "message": str(result["error"])}),
                 status=500,
@@ -2011,579 +1550,300 @@ Hosts management (Changes via WebSocket)
 """
 
 @app.route("/tutors", methods=["PUT", "DELETE"])
+@unit_of_work()
 def update_tutors():
     """
     Update tutors.
     """
-
-    session_id = request.cookies.get("SID", None)
-    if session_id is None:
-        response = Response(
-            response=json.dumps({"code": 401, "message": "The session id must be specified"}),
-            status=401,
-            mimetype="application/json")
-        return response
-    
     data = request.get_json()
-    user_uuids = data.get("tutors", None)
+    session_id = request.cookies.get("SID", None)
 
-    if not user_uuids:
-        response = Response(
-            response=json.dumps({"code": 403, "message": "tutors must be specified"}),
-            status=403,
-            mimetype="application/json")
-        return response
-        
     # get conn, cursor
     conn, cursor = get_conn_cursor()
-    
-    # check permissions, since only admins can change user role
-    result = check_permissions(cursor=cursor, session_id=session_id, required_role=UserRole.ADMIN)
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 401, "message": str(result["error"])}),
-            status=401,
-            mimetype="application/json")
-        return response
-    if result["data"]["allowed"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 403, "message": "invalid permissions, need role admin"}),
-            status=403,
-            mimetype="application/json")
-        return response
-
-    # get information about users
-    result = users.get_users(cursor=cursor, user_uuids=user_uuids, keywords=["user_uuid", "first_name", "last_name", "residence", "user_role", "user_uuid"])
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
-    
-    # clean result data
-    tutors_data = result["data"]
-    tutors_data = [{"id": i[0], "firstName": i[1], "lastName": i[2], "residence": i[3], "user_role": UserRole(i[4]), "user_uuid": i[5]} for i in tutors_data]
-    
-    # check, whether all users were found
-    if len(tutors_data) != len(user_uuids):
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 404, "message": "Not all users found"}),
-            status=404,
-            mimetype="application/json")
-        return response
-
-    # if any user is admin, raise error
-    if any(i["user_role"] >= UserRole.ADMIN for i in tutors_data):
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 403, "message": "Can only remove tutors or make admins to tutors"}),
-            status=403,
-            mimetype="application/json")
-        return response
-    
-    hosts_removed = []
-
-    # changing tutors back to users
-    if request.method == "DELETE":
-        # set new role
-        new_role = UserRole.USER
-
-        # remove wrong users from tutor list
-        tutors_data = [{key: value for key, value in i.items() if key != "user_role"} for i in tutors_data if i["user_role"] == UserRole.TUTOR]
-    else:
-        if any(i["user_role"] == UserRole.EXTERN for i in tutors_data):
-            close_conn_cursor(conn, cursor)
-            response = Response(
-                response=json.dumps({"code": 403, "message": "Can't promote extern users to tutors"}),
-                status=403,
-                mimetype="application/json")
-            return response
-        hosts_removed = [i["user_uuid"] for i in tutors_data if i["user_role"] == UserRole.HOST]
-        # set new role
-        new_role = UserRole.TUTOR
-        # remove wrong users from tutor list
-        tutors_data = [{key: value for key, value in i.items() if key != "user_role"} for i in tutors_data if i["user_role"] == UserRole.USER or i["user_role"] == UserRole.HOST]
-    if len(tutors_data) != len(user_uuids):
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 400, "message": "Some users can't be promoted to tutors"}),
-            status=403,
-            mimetype="application/json")
-        return response
-
-    query = """
-        UPDATE users
-        SET user_role = %s
-        WHERE user_uuid IN %s
-        RETURNING id
-    """
-    result = db.custom_call(cursor=cursor,
-                            query=query,
-                            type_of_answer=db.ANSWER_TYPE.LIST_ANSWER,
-                            variables=[new_role.value, tuple(i["id"] for i in tutors_data)])
-    
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
-
-    # NOTE: unneccessary due to trigger
-    user_ids = result["data"]
-    query = """DELETE FROM hosts WHERE user_id IN %s"""
-    result = db.custom_call(cursor=cursor, query=query, type_of_answer=db.ANSWER_TYPE.NO_ANSWER, variables=(tuple(user_ids),))
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
+    result = host_service.change_tutors(cursor=cursor,
+                                        session_id=session_id,
+                                        method="add" if request.method == "PUT" else "remove",
+                                        user_uuids=data.get("tutors", None))
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
 
-    query = f"SELECT id FROM sessions WHERE user_id IN ({', '.join(['%s' for _ in range(len(user_ids))])})"
-    result = db.custom_call(
-        cursor=cursor,
-        query=query,
-        type_of_answer=db.ANSWER_TYPE.LIST_ANSWER,
-        variables=tuple(user_ids))
-
-    close_conn_cursor(conn, cursor)
-    if result["success"] is False:
-        response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
-
-    session_ids = [i[0] for i in result["data"]]
-
-    result = ws.update_hosts_tutors(session_ids, "add" if request.method == "PUT" else "remove")
-
-    if request.method == "PUT":
-        for user in tutors_data:
-            asyncio.run(ws.broadcast(event="tutorAdded", data=user, skip_sid=session_id))
-            asyncio.run(ws.status(user_uuid=user["id"]))
-        for host in hosts_removed:
-            asyncio.run(ws.broadcast(event="hostRemoved", data=host))
-    else:
-        for user in user_uuids:
-            asyncio.run(ws.broadcast(event="tutorRemoved", data=user, skip_sid=session_id))
-            asyncio.run(ws.status(user_uuid=user))
-
-    if request.method == "DELETE":
-        response = Response(
-            status=204)
-        return response
-    
-    response = Response(
-        response=json.dumps(tutors_data),
-        status=201,
-        mimetype="application/json")
-    return response
+    return service_response(result, status=201 if request.method == "PUT" else 204)
 
 @app.route("/hosts", methods=["PUT", "DELETE"])
+@unit_of_work()
 def update_hosts():
     """
     Update hosts for a stueble.
     """
-    session_id = request.cookies.get("SID", None)
-    if session_id is None:
-        response = Response(
-            response=json.dumps({"code": 401, "message": "The session id must be specified"}),
-            status=401,
-            mimetype="application/json")
-        return response
-    
     data = request.get_json()
-    date = data.get("date", None)
-    user_uuids = data.get("hosts", None)
+    session_id = request.cookies.get("SID", None)
 
-    if not user_uuids:
-        response = Response(
-            response=json.dumps({"code": 403, "message": "hosts must be specified"}),
-            status=403,
-            mimetype="application/json")
-        return response
-    
     # get conn, cursor
     conn, cursor = get_conn_cursor()
+    result = host_service.change_hosts(cursor=cursor,
+                                       session_id=session_id,
+                                       method="add" if request.method == "PUT" else "remove",
+                                       user_uuids=data.get("hosts", None),
+                                       date=data.get("date", None))
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
 
-    # check permissions, since only tutors or above can change user role
-    result = check_permissions(cursor=cursor, session_id=session_id, required_role=UserRole.TUTOR)
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 401, "message": str(result["error"])}),
-            status=401,
-            mimetype="application/json")
-        return response
-    if result["data"]["allowed"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 403, "message": "invalid permissions, need role tutor or above"}),
-            status=403,
-            mimetype="application/json")
-        return response
-    
-    result = motto.get_motto(cursor=cursor, date=date)
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
-    if result["data"] is None:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 404, "message": "no stueble party found"}),
-            status=404,
-            mimetype="application/json")
-        return response
-    stueble_id = result["data"][2]
+    return service_response(result, status=201 if request.method == "PUT" else 204)
 
-    # stueble_id is the id of the current stueble, therefore also delete the host priviledges from users
+@app.route("/hosts", methods=["GET"])
+@app.route("/tutors", methods=["GET"])
+@unit_of_work()
+def get_hosts_tutors():
+    """
+    Get hosts for a stueble.
+    """
+    session_id = request.cookies.get("SID", None)
+    data = request.get_json(silent=True)
+    date = data.get("date", None) if isinstance(data, dict) else None
 
-    result = users.get_users(cursor=cursor, user_uuids=user_uuids, keywords=["user_uuid", "first_name", "last_name", "residence", "user_role"])
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
-    hosts_data = result["data"]
-    hosts_data = [{"id": i[0], "firstName": i[1], "lastName": i[2], "residence": i[3]} for i in hosts_data if i[4] == ('user' if request.method == "PUT" else 'host')]
-    if len(hosts_data) != len(user_uuids):
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 404, "message": "Tutoren und Admins können nicht zu Hosts gemacht werden"}), # "Not all users found"}),
-            status=404,
-            mimetype="application/json")
-        return response
+    # get conn, cursor
+    conn, cursor = get_read_conn_cursor()
+    if request.path == "/tutors":
+        result = host_service.list_tutors(cursor=cursor, session_id=session_id)
+    else:
+        result = host_service.list_hosts(cursor=cursor, session_id=session_id, date=date)
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
 
-    result = motto.update_hosts(cursor=cursor, stueble_id=stueble_id, method="add" if request.method == "PUT" else "remove", user_uuids=user_uuids)
+    return service_response(result)
 
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
+@app.route("/hosts/force_add_guest", methods=["POST"])
+@unit_of_work()
+def force_add_guest():
+    """
+    force add guest to current stueble
+    """
 
-    user_ids = result["data"]
+    # load data
+    data = request.get_json()
+    session_id = request.cookies.get("SID", None)
 
-    # stueble_id is the id of the current stueble, therefore also delete the host priviledges from users
-    if request.method == "DELETE":
-        result = db.custom_call(cursor=cursor, query="UPDATE users SET user_role = 'user' WHERE id IN %s AND user_role = 'host'", type_of_answer=db.ANSWER_TYPE.NO_ANSWER, variables=(tuple(user_ids),))
-        if result["success"] is False:
-            close_conn_cursor(conn, cursor)
-            response = Response(
-                response=json.dumps({"code": 500, "message": str(result["error"])}),
-                status=500,
-                mimetype="application/json")
-            return response
-    else:
-        result = db.custom_call(cursor=cursor, query="UPDATE users SET user_role = 'host' WHERE id IN %s AND user_role = 'user'", type_of_answer=db.ANSWER_TYPE.NO_ANSWER, variables=(tuple(user_ids),))
-        if result["success"] is False:
-            close_conn_cursor(conn, cursor)
-            response = Response(
-                response=json.dumps({"code": 500, "message": str(result["error"])}),
-                status=500,
-                mimetype="application/json")
-            return response
-    
-    query = f"SELECT id FROM sessions WHERE user_id IN ({', '.join(['%s' for _ in range(len(user_ids))])})"
-    result = db.custom_call(
-        cursor=cursor,
-        query=query,
-        type_of_answer=db.ANSWER_TYPE.LIST_ANSWER,
-        variables=tuple(user_ids)
-    )
+    # get connection and cursor
+    conn, cursor = get_conn_cursor()
+    result = guest_service.force_add_guest(cursor=cursor, session_id=session_id, user_uuid=data.get("id", None))
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
 
-    close_conn_cursor(conn, cursor)
-    if result["success"] is False:
-        response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
+    return service_response(result, status=204)
+
+"""
+Config management
+"""
 
-    session_ids = [i[0] for i in result["data"]]
+@app.route("/config", methods=["GET", "POST"])
+@unit_of_work()
+def config():
+    """
+    get or update config values
+    """
 
-    result = ws.update_hosts_tutors(session_ids, "add" if request.method == "PUT" else "remove")
+    session_id = request.cookies.get("SID", None)
 
-    if request.method == "PUT":
-        for user in hosts_data:
-            asyncio.run(ws.broadcast(event="hostAdded", data=user, skip_sid=session_id))
-            asyncio.run(ws.status(user_uuid=user["id"]))
+    # get connection and cursor
+    conn, cursor = get_conn_cursor()
+    if request.method == "POST":
+        result = config_service.update_config(cursor=cursor, session_id=session_id, values=request.get_json())
     else:
-        for user in user_uuids:
-            asyncio.run(ws.broadcast(event="hostRemoved", data=user, skip_sid=session_id))
+        result = config_service.get_config(cursor=cursor, session_id=session_id)
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
 
-            asyncio.run(ws.status(user_uuid=user))
+    return service_response(result)
 
-    if request.method == "DELETE":
-        response = Response(
-            status=204)
-        return response
 
-    response = Response(
-        response=json.dumps(hosts_data),
-        status=201,
-        mimetype="application/json")
-    return response
+"""
+Statistics
+"""
 
-@app.route("/hosts", methods=["GET"])
-@app.route("/tutors", methods=["GET"])
-def get_hosts_tutors():
+@app.route("/stats", methods=["GET"])
+@app.route("/stats/occupancy", methods=["GET"])
+@unit_of_work()
+def stats():
     """
-    Get hosts for a stueble.
+    returns the statistics (tutors and above) or the live occupancy (hosts and above) of a stueble \n
+    query parameter stuebleId selects the stueble, the current stueble is used if it is missing
     """
     session_id = request.cookies.get("SID", None)
     if session_id is None:
         response = Response(
-            response=json.dumps({"code": 401, "message": "The session_id must be specified"}),
+            response=json.dumps({"code": 401, "message": "The session id must be specified"}),
             status=401,
             mimetype="application/json")
         return response
-    
-    try:
-        data = request.get_json()
-        date = data.get("date", None)
-    except:
-        date = None
 
-    # get conn, cursor
-    conn, cursor = get_conn_cursor()
+    stueble_id = request.args.get("stuebleId", None)
+    if stueble_id is not None:
+        try:
+            stueble_id = int(stueble_id)
+        except ValueError:
+            response = Response(
+                response=json.dumps({"code": 400, "message": "stuebleId must be an integer"}),
+                status=400,
+                mimetype="application/json")
+            return response
 
-    # check permissions, since only hosts or above can change user role
-    result = check_permissions(cursor=cursor, session_id=session_id, required_role=UserRole.HOST)
+    required_role = UserRole.HOST if request.path == "/stats/occupancy" else UserRole.TUTOR
+
+    # get connection and cursor
+    conn, cursor = get_read_conn_cursor()
+
+    result = check_permissions(cursor=cursor, session_id=session_id, required_role=required_role)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
-            response=json.dumps({"code": 401, "message": str(result["error"])}),
-            status=401,
+            response=json.dumps({"code": 500, "message": str(result["error"])}),
+            status=500,
             mimetype="application/json")
         return response
     if result["data"]["allowed"] is False:
-        close_conn_cursor(conn, cursor)
+        close_conn_cursor(conn, cursor, failed=True)
         response = Response(
-            response=json.dumps({"code": 403, "message": "invalid permissions, need role host or above"}),
+            response=json.dumps({"code": 403, "message": f"invalid permissions, need role {required_role.value} or above"}),
             status=403,
             mimetype="application/json")
         return response
-    
-    if request.path == "/tutors":
-        query = """SELECT user_uuid, first_name, last_name, residence FROM users WHERE user_role = 'tutor'"""
-        result = db.custom_call(cursor=cursor,
-                                query=query,
-                                type_of_answer=db.ANSWER_TYPE.LIST_ANSWER)
-        close_conn_cursor(conn, cursor)
+
+    if stueble_id is None:
+        result = motto.get_motto(cursor=cursor)
         if result["success"] is False:
+            close_conn_cursor(conn, cursor, failed=True)
             response = Response(
-                response=json.dumps({"code": 500, "message": str(result["error"])}),
-                status=500,
+                response=json.dumps({"code": 404, "message": "no stueble party found"}),
+                status=404,
                 mimetype="application/json")
             return response
-        tutors = [{"id": i[0], "firstName": i[1], "lastName": i[2], "residence": i[3]} for i in result["data"]]
-        response = Response(
-            response=json.dumps(tutors),
-            status=200,
-            mimetype="application/json")
-        return response
+        stueble_id = result["data"][2]
 
-    result = motto.get_motto(cursor=cursor, date=date)
-    if result["success"] is False:
+    # the live counts of the websocket server, the counters in the db if the stueble isn't tracked
+    live_occupancy = occupancy.get(stueble_id) if request.path == "/stats/occupancy" else None
+    if live_occupancy is not None:
         close_conn_cursor(conn, cursor)
         response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
-    if result["data"] is None:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 404, "message": "no stueble party found"}),
-            status=404,
+            response=json.dumps(live_occupancy),
+            status=200,
             mimetype="application/json")
         return response
-    stueble_id = result["data"][2]
-    result = motto.get_hosts(cursor=cursor, stueble_id=stueble_id)
-    close_conn_cursor(conn, cursor)
+
+    if request.path == "/stats/occupancy":
+        result = statistics.get_occupancy(cursor=cursor, stueble_id=stueble_id)
+    else:
+        result = statistics.get_stats(cursor=cursor, stueble_id=stueble_id)
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
     if result["success"] is False:
+        code = 404 if result["error"] == "no stueble found" else 500
         response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
+            response=json.dumps({"code": code, "message": str(result["error"])}),
+            status=code,
             mimetype="application/json")
         return response
 
-    result["data"] = [{"id": i["user_uuid"], "firstName": i["first_name"], "lastName": i["last_name"], "residence": i["residence"]} for i in result["data"]]
-
     response = Response(
         response=json.dumps(result["data"]),
         status=200,
         mimetype="application/json")
     return response
 
-@app.route("/hosts/force_add_guest", methods=["POST"])
-def force_add_guest():
+
+"""
+Exports
+"""
+
+@app.route("/export", methods=["POST"])
+@unit_of_work()
+def export_guests():
     """
-    force add guest to current stueble
+    exports the guest list of a past stueble, or all past stuebles if stuebleId is missing, to Google Drive \n
+    the export runs in the background, the job can be polled with GET /export/<job_id>
     """
-
-    # load data
-    data = request.get_json()
     session_id = request.cookies.get("SID", None)
     if session_id is None:
         response = Response(
-            response=json.dumps({"code": 400, "message": "The session id must be specified"}),
+            response=json.dumps({"code": 401, "message": "The session id must be specified"}),
             status=401,
             mimetype="application/json")
         return response
-    user_uuid = data.get("id", None)
-    if user_uuid is None:
+
+    data = request.get_json(silent=True) or {}
+    stueble_id = data.get("stuebleId", None)
+    file_format = data.get("format", "csv")
+    if (stueble_id is not None and not isinstance(stueble_id, int)) or file_format not in export.FORMATS:
         response = Response(
-            response=json.dumps({"code": 400, "message": "The user_uuid must be specified"}),
+            response=json.dumps({"code": 400, "message": f"stuebleId must be an integer and format one of {', '.join(export.FORMATS)}"}),
             status=400,
             mimetype="application/json")
         return response
 
     # get connection and cursor
-    conn, cursor = get_conn_cursor()
+    conn, cursor = get_read_conn_cursor()
 
-    # check permissions, since only hosts and above can add guests
-    result = check_permissions(cursor=cursor, session_id=session_id, required_role=UserRole.HOST)
+    # guest lists contain personal data, so only admins can export them
+    result = check_permissions(cursor=cursor, session_id=session_id, required_role=UserRole.ADMIN)
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
         response = Response(
-            response=json.dumps({"code": 401, "message": str(result["error"])}),
-            status=401,
+            response=json.dumps({"code": 500, "message": str(result["error"])}),
+            status=500,
             mimetype="application/json")
         return response
     if result["data"]["allowed"] is False:
-        close_conn_cursor(conn, cursor)
         response = Response(
-            response=json.dumps({"code": 403, "message": "invalid permissions, need role host or above"}),
+            response=json.dumps({"code": 403, "message": "invalid permissions, need role admin"}),
             status=403,
             mimetype="application/json")
         return response
 
-    # get user_id from user_uuid
-    result = users.get_user(cursor=cursor, user_uuid=user_uuid, keywords=["id"])
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
-    user_id = result["data"][0]
-    query = """SET additional.skip_triggers = 'on';
-INSERT INTO events (user_id, stueble_id, event_type) VALUES (%s, %s, %s), (%s, %s, %s);  -- Triggers will be skipped
-RESET additional.skip_triggers;"""
-    result = db.custom_call(cursor=cursor,
-                            query=query,
-                            type_of_answer=db.ANSWER_TYPE.NO_ANSWER,
-                            variables=[user_id, 1, 'add', user_id, 1, 'arrive'])
-    close_conn_cursor(conn, cursor)
-    if result["success"] is False:
-        response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
-            mimetype="application/json")
-        return response
+    job_id = drive.schedule_export(stueble_id=stueble_id, file_format=file_format)
     response = Response(
-        status=204)
+        response=json.dumps({"code": 202, "message": "The export was started", "jobId": job_id}),
+        status=202,
+        mimetype="application/json")
     return response
 
-"""
-Config management
-"""
-
-@app.route("/config", methods=["GET", "POST"])
-def config():
+@app.route("/export/<job_id>", methods=["GET"])
+@unit_of_work()
+def export_status(job_id: str):
     """
-    get or update config values
+    returns the state of an export job
     """
-
     session_id = request.cookies.get("SID", None)
     if session_id is None:
         response = Response(
             response=json.dumps({"code": 401, "message": "The session id must be specified"}),
             status=401,
             mimetype="application/json")
-        return response        
+        return response
 
     # get connection and cursor
-    conn, cursor = get_conn_cursor()
+    conn, cursor = get_read_conn_cursor()
 
-    # check permissions, since only admins can change config values
     result = check_permissions(cursor=cursor, session_id=session_id, required_role=UserRole.ADMIN)
+    close_conn_cursor(conn, cursor, failed=result["success"] is False)
     if result["success"] is False:
-        close_conn_cursor(conn, cursor)
         response = Response(
-            response=json.dumps({"code": 401, "message": str(result["error"])}),
-            status=401,
+            response=json.dumps({"code": 500, "message": str(result["error"])}),
+            status=500,
             mimetype="application/json")
         return response
     if result["data"]["allowed"] is False:
-        close_conn_cursor(conn, cursor)
         response = Response(
             response=json.dumps({"code": 403, "message": "invalid permissions, need role admin"}),
             status=403,
             mimetype="application/json")
         return response
 
-    if request.method == "POST":
-        data = request.get_json()
-
-        case_statements = '\n'.join(["WHEN %s THEN %s" for _ in range (len(data))])
-        keys = tuple(camel_to_snake_case(key) for key in data.keys())
-        values = tuple(value for value in data.values())
-
-        params = [elem for i in zip(keys, values) for elem in i] + [tuple(keys)]
-        
-        query = f"""UPDATE configurations
-        SET value = CASE key
-        {case_statements}
-        END
-        WHERE key IN %s"""
-        result = db.custom_call(cursor=cursor,
-                                query=query,
-                                type_of_answer=db.ANSWER_TYPE.NO_ANSWER,
-                                variables=params)
-        if result["success"] is False:
-            close_conn_cursor(conn, cursor)
-            response = Response(
-                response=json.dumps({"code": 500, "message": str(result["error"])}),
-                status=500,
-                mimetype="application/json")
-            return response
-
-        # send websocket message to all admins
-        # asyncio.run(ws.broadcast(event="configUpdate", data=data, room=ws.Room.ADMINS, skip_sid=session_id))
-    # Method GET & POST
-    result = configs.get_all_configurations(cursor=cursor)
-    close_conn_cursor(conn, cursor)
-
-    if result["success"] is False:
+    job = drive.uploader.status(job_id)
+    if job is None:
         response = Response(
-            response=json.dumps({"code": 500, "message": str(result["error"])}),
-            status=500,
+            response=json.dumps({"code": 404, "message": "export job not found"}),
+            status=404,
             mimetype="application/json")
         return response
 
+    job_result = job["result"] or {}
     response = Response(
-        response=json.dumps({snake_to_camel_case(key): value for key, value in result["data"].items()}),
+        response=json.dumps({"state": job["state"],
+                             "fileId": job_result.get("data", {}).get("file_id", None) if job_result.get("success", False) else None,
+                             "error": str(job_result["error"]) if "error" in job_result else None}),
         status=200,
         mimetype="application/json")
     return response
@@ -2610,7 +1870,8 @@ def websocket_change():
     first_name = data.get("first_name", None)
     last_name = data.get("last_name", None)
     user_uuid = data.get("user_uuid", None)
-    stueble_id = data.get("stuebleId", None)
+    # websocket_runner sends stueble_id
+    stueble_id = data.get("stuebleId", data.get("stueble_id", None))
     # event = data.get("event", None)
     if first_name is None or last_name is None or user_uuid is None: # or event is None:
         response = Response(
@@ -2619,8 +1880,34 @@ def websocket_change():
             mimetype="application/json")
         return response
 
-    asyncio.run(ws.broadcast(event="guestRemoved", data=user_uuid))
+    asyncio.run(ws.broadcast(event="guestRemoved", data=user_uuid, stueble_id=stueble_id))
 
     response = Response(
         status=200)
     return response
+
+@app.route("/internal/metrics", methods=["GET"])
+def internal_metrics():
+    """
+    returns the metrics of the connection pool (checkouts, wait and hold times, connections held too long) and the
+    allowed and rejected requests of the rate limits, only for admins \n
+    every request arrives from the reverse proxy on 127.0.0.1, so the address can't tell local requests apart
+    """
+    session_id = request.cookies.get("SID", None)
+
+    # get connection and cursor
+    conn, cursor = get_read_conn_cursor()
+    result = require_role(cursor=cursor, session_id=session_id, required_role=UserRole.ADMIN)
+    close_conn_cursor(conn, cursor)
+    if result["success"] is False:
+        response = Response(
+            response=json.dumps({"code": result["status"], "message": result["error"]}),
+            status=result["status"],
+            mimetype="application/json")
+        return response
+
+    response = Response(
+        response=json.dumps({**get_pool_metrics(), "rate_limit": rate_limiter.metrics()}),
+        status=200,
+        mimetype="application/json")
+    return response
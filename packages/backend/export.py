@@ -1,20 +1,202 @@
-from typing import Any
+import csv
+import datetime
+import os
+import tempfile
+from collections.abc import Iterable, Iterator, Sequence
+from typing import IO, Any, Literal, TypedDict
+from zoneinfo import ZoneInfo
 
+import msgpack
+from psycopg2.extensions import cursor
 
-def export_csv(result: list[dict[str, Any]]):
+from packages.backend.sql_connection import database as db
+from packages.backend.sql_connection.common_types import GenericFailure, StreamSuccess, error_to_failure
+
+ExportFormat = Literal["csv", "msgpack"]
+
+# mime type and file extension of the formats
+FORMATS: dict[str, tuple[str, str]] = {
+    "csv": ("text/csv", ".csv"),
+    "msgpack": ("application/x-msgpack", ".msgpack"),
+}
+
+# rows per row group of the msgpack format, a reader only needs one group in memory
+ROW_GROUP_SIZE = int(os.getenv("EXPORT_ROW_GROUP_SIZE", "5000"))
+COLUMNAR_FORMAT = "stueble-columnar"
+
+DEFAULT_TZ = ZoneInfo("Europe/Berlin")
+
+# guest and event history, one row per event
+HISTORY_COLUMNS = ("stueble_id", "date_of_time", "event_id", "event_type", "submitted",
+                   "first_name", "last_name", "email", "room", "residence", "user_role")
+HISTORY_QUERY = """SELECT e.stueble_id, m.date_of_time, e.id, e.event_type, e.submitted,
+                u.first_name, u.last_name, u.email, u.room, u.residence, u.user_role
+                FROM events e
+                JOIN stueble_motto m ON m.id = e.stueble_id
+                LEFT JOIN users u ON u.id = e.user_id
+                WHERE {condition}
+                ORDER BY e.stueble_id, e.submitted, e.id"""
+
+class ExportData(TypedDict):
+    path: str
+    rows: int
+    mime_type: str
+    extension: str
+
+class ExportSuccess(TypedDict):
+    success: Literal[True]
+    data: ExportData
+
+def latest_exportable_date(now: datetime.datetime | None = None) -> datetime.date:
+    """
+    returns the date of the latest stueble whose guest list may be exported \n
+    e.g. if the stueble was on 01.01.2000 its guest list can be exported earliest on 02.01.2000 at 11:00
+    """
+    now = datetime.datetime.now(DEFAULT_TZ) if now is None else now
+    if now.hour < 11:
+        return now.date() - datetime.timedelta(days=2)
+    return now.date() - datetime.timedelta(days=1)
+
+def to_msgpack_value(value: Any) -> Any:
+    """
+    converts values msgpack can't serialize, dates as ISO strings and everything else (uuid, enums) as string
+    """
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+def write_csv(rows: Iterable[Sequence[Any]], columns: Sequence[str], file: IO[str]) -> int:
+    """
+    writes rows as CSV with a header line, values are quoted if necessary and None is written as empty field
+    Parameters:
+        rows (Iterable[Sequence]): rows in the order of columns, can be a generator so rows are only read once
+        columns (Sequence[str]): names of the columns
+        file (IO[str]): text file opened with newline=""
+    Returns:
+        int: number of written rows
+    """
+    writer = csv.writer(file)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+def write_msgpack(rows: Iterable[Sequence[Any]], columns: Sequence[str], file: IO[bytes], row_group_size: int = ROW_GROUP_SIZE) -> int:
     """
-    Export the given result as a JSON string.
+    writes rows in a compact columnar format: a msgpack header {"format", "version", "columns"} followed by row groups
+    {"rows": n, "columns": [[values of column 0], ...]}, each group holds at most row_group_size rows
     Parameters:
-        result (list[dict]): The data to be exported.
+        rows (Iterable[Sequence]): rows in the order of columns, can be a generator so rows are only read once
+        columns (Sequence[str]): names of the columns
+        file (IO[bytes]): binary file
+        row_group_size (int): maximum number of rows per group
     Returns:
-        dict: A dictionary containing the success status and the JSON string or an error message.
-    """
-    if any(", " in key for key in result[0].keys()):
-        return {"success": False, "message": "Keys can't contain ', '."}
-    keys = [tuple(row.keys()) for row in result]
-    if len(set(keys)) != 1:
-        return {"success": False, "message": "All rows must have the same keys and in the same order."}
-    data = ", ".join(result[0].keys())
-    for row in result:
-        data += "\n" + ", ".join(str(value) for value in row.values())
-    return {"success": True, "data": data}
\ No newline at end of file
+        int: number of written rows
+    """
+    packer = msgpack.Packer(default=to_msgpack_value, use_bin_type=True)
+    file.write(packer.pack({"format": COLUMNAR_FORMAT, "version": 1, "columns": list(columns)}))
+    count = 0
+    group = [[] for _ in columns]
+    group_rows = 0
+    for row in rows:
+        for values, value in zip(group, row):
+            values.append(value)
+        group_rows += 1
+        if group_rows == row_group_size:
+            file.write(packer.pack({"rows": group_rows, "columns": group}))
+            count += group_rows
+            group = [[] for _ in columns]
+            group_rows = 0
+    if group_rows > 0:
+        file.write(packer.pack({"rows": group_rows, "columns": group}))
+        count += group_rows
+    return count
+
+def read_msgpack(file: IO[bytes]) -> Iterator[dict[str, Any]]:
+    """
+    reads a file of write_msgpack row by row
+    Parameters:
+        file (IO[bytes]): binary file
+    Returns:
+        Iterator[dict]: rows as {column: value}
+    """
+    unpacker = msgpack.Unpacker(file, raw=False)
+    header = next(unpacker, None)
+    if not isinstance(header, dict) or header.get("format", None) != COLUMNAR_FORMAT:
+        raise ValueError("not a stueble columnar file")
+    columns = header["columns"]
+    for group in unpacker:
+        for row in zip(*group["columns"]):
+            yield dict(zip(columns, row))
+
+def stream_history(cursor: cursor, stueble_id: int | None = None) -> StreamSuccess | GenericFailure:
+    """
+    streams the guest and event history of HISTORY_COLUMNS with a server side cursor
+    Parameters:
+        cursor: cursor for the connection
+        stueble_id (int | None): id of the stueble, if None all stuebles up to latest_exportable_date (archive)
+    Returns:
+        dict: {"success": True, "data": generator of tuples}, {"success": False, "error": e} if error occurred
+    """
+    if stueble_id is None:
+        query = HISTORY_QUERY.format(condition="m.date_of_time <= %s")
+        variables = [latest_exportable_date()]
+    else:
+        query = HISTORY_QUERY.format(condition="e.stueble_id = %s")
+        variables = [stueble_id]
+    result = db.stream_query(cursor=cursor, query=query, variables=variables)
+    if result["success"] is False:
+        return error_to_failure(result)
+    return result
+
+def export_history(cursor: cursor, file_format: ExportFormat = "csv", stueble_id: int | None = None,
+                   directory: str | None = None) -> ExportSuccess | GenericFailure:
+    """
+    writes the guest and event history of a past stueble, or of all past stuebles (archive), incrementally into a
+    temporary file \n
+    the caller has to remove the file
+    Parameters:
+        cursor: cursor for the connection
+        file_format (str): "csv" or "msgpack" (columnar)
+        stueble_id (int | None): id of the stueble, None for the archive of all past stuebles
+        directory (str | None): directory of the file, the default temporary directory if None
+    Returns:
+        dict: {"success": True, "data": {"path", "rows", "mime_type", "extension"}}, {"success": False, "error": e} if error occurred
+    """
+    if file_format not in FORMATS:
+        return {"success": False, "error": f"invalid export format {file_format}"}
+    mime_type, extension = FORMATS[file_format]
+
+    if stueble_id is not None:
+        result = db.read_table(
+            cursor=cursor,
+            table_name="stueble_motto",
+            keywords=["date_of_time"],
+            conditions={"id": stueble_id},
+            expect_single_answer=True)
+        if result["success"] is False:
+            return error_to_failure(result)
+        if result["data"] is None:
+            return {"success": False, "error": "no stueble found"}
+        if result["data"][0] > latest_exportable_date():
+            return {"success": False, "error": "Can only export guest lists for past stueble events (e.g. if stueble was on 01.01.2000 then guest list can be exported earliest at 02.01.2000 11:00)."}
+
+    result = stream_history(cursor=cursor, stueble_id=stueble_id)
+    if result["success"] is False:
+        return result
+
+    file = tempfile.NamedTemporaryFile(mode="w" if file_format == "csv" else "wb", suffix=extension, dir=directory,
+                                       delete=False, **({"newline": "", "encoding": "utf-8"} if file_format == "csv" else {}))
+    try:
+        with file:
+            if file_format == "csv":
+                rows = write_csv(rows=result["data"], columns=HISTORY_COLUMNS, file=file)
+            else:
+                rows = write_msgpack(rows=result["data"], columns=HISTORY_COLUMNS, file=file)
+    except Exception as e:
+        result["data"].close() # closes the server side cursor
+        os.remove(file.name)
+        return {"success": False, "error": e}
+    return {"success": True, "data": {"path": file.name, "rows": rows, "mime_type": mime_type, "extension": extension}}
@@ -0,0 +1,71 @@
+"""
+Encoding of the websocket frames, msgpack maps {"event": str, <reqId / resId>, "data": ...} \n
+Frames that never change (heartbeat, status per capabilities) are encoded once. For frames with one id the bytes of
+the event and the id key are prebuilt, so only the id and the data are packed per message. Everything is packed by
+one msgpack.Packer per thread, the websocket server and the waitress threads (ws.notify) both send frames.
+"""
+
+import threading
+from functools import lru_cache
+
+import msgpack
+
+ID_KEYS = ("reqId", "resId")
+
+local = threading.local()
+prefixes: dict[tuple[str, str], bytes] = {}
+
+def packer() -> msgpack.Packer:
+    """
+    returns the packer of the current thread
+    """
+    thread_packer = getattr(local, "packer", None)
+    if thread_packer is None:
+        thread_packer = local.packer = msgpack.Packer(use_bin_type=True)
+    return thread_packer
+
+def pack(value) -> bytes:
+    """
+    packs a value with the packer of the current thread
+    """
+    return packer().pack(value)
+
+DATA_KEY = pack("data")
+
+def prefix(event: str, id_key: str) -> bytes:
+    """
+    returns the bytes of a frame with event and one id before the id value: map header, event and the id key
+    """
+    key = (event, id_key)
+    encoded = prefixes.get(key, None)
+    if encoded is None:
+        # fixmap with the 3 entries event, id and data
+        encoded = prefixes.setdefault(key, b"\x83" + pack("event") + pack(event) + pack(id_key))
+    return encoded
+
+def encode(event: str, data=None, **fields) -> bytes:
+    """
+    encodes a frame, the fields are placed between event and data like {"event": event, **fields, "data": data}
+
+    Parameters:
+        event (str): the event of the frame
+        data: the data of the frame
+        **fields: additional fields, e.g. reqId, resId, manifestVersion
+    Returns:
+        bytes: the frame
+    """
+    if len(fields) == 1:
+        (id_key, value), = fields.items()
+        if id_key in ID_KEYS:
+            return prefix(event, id_key) + pack(value) + DATA_KEY + pack(data)
+    return pack({"event": event, **fields, "data": data})
+
+# sent to idle clients, never changes
+HEARTBEAT = pack({"event": "heartbeat"})
+
+@lru_cache(maxsize=None)
+def status(capabilities: tuple[str, ...]) -> bytes:
+    """
+    returns the status frame of an authorized connection with the capabilities, one per combination of roles
+    """
+    return encode("status", {"code": "200", "capabilities": list(capabilities), "authorized": True})
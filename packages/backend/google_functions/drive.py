@@ -1,116 +1,263 @@
+"""
+Upload of guest list exports to Google Drive \n
+- the authenticated service client is built once and reused
+- exports are filed into a reused folder hierarchy: DRIVE_EXPORT_ROOT / semester / stueble, the folder ids are cached
+- files are uploaded from disk with resumable uploads in chunks of UPLOAD_CHUNK_SIZE, interrupted chunks are retried
+- schedule_export runs the export and the upload in a background worker, off the request path \n
+With DRIVE_BACKEND=fake the in-process fake of fake_drive.py is used instead of Google Drive.
+"""
+
+from collections import OrderedDict
+import datetime
+import os
+import queue
+import threading
+import uuid
+
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaInMemoryUpload
-import datetime
-from zoneinfo import ZoneInfo
+from googleapiclient.http import MediaFileUpload
 
 from packages.backend import export
 from packages.backend.sql_connection import database as db
+from packages.backend.sql_connection.conn_cursor_functions import close_conn_cursor, get_read_conn_cursor
 from packages.backend.google_functions.authentification import authenticate
 
-def upload_file_folder(file_name: str, folder_name: str, content: str, mime_type: str):
+# size of the chunks of resumable uploads, has to be a multiple of 256 KiB
+UPLOAD_CHUNK_SIZE = int(os.getenv("DRIVE_UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+UPLOAD_RETRIES = 5 # retries of a failed chunk, with exponential backoff
+EXPORT_ROOT = os.getenv("DRIVE_EXPORT_ROOT", "stueble exports")
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+MAX_JOBS = 100 # finished jobs kept for status requests
+
+class GoogleDrive:
     """
-    Upload a file to a specific folder in Google Drive.
-    Parameters:
-        file_name (str): The name of the file to be uploaded.
-        folder_name (str): The name of the folder where the file will be uploaded; The folder will be created.
-        content (str): The content of the file.
-        mime_type (str): The MIME type of the file.
-    Returns:
-        dict: A dictionary containing the success status and the file ID or an error message.
+    Drive backend with a lazily built, cached service client
     """
-    creds = authenticate()
 
-    try:
-        # create drive api client
-        service = build("drive", "v3", credentials=creds)
-        folder_metadata = {
-            "name": folder_name,
-            "mimeType": "application/vnd.google-apps.folder",
-        }
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._service = None
+
+    @property
+    def service(self):
+        with self.lock:
+            if self._service is None:
+                self._service = build("drive", "v3", credentials=authenticate(), cache_discovery=False)
+            return self._service
+
+    def find_folder(self, name: str, parent_id: str | None) -> str | None:
+        escaped_name = name.replace("\\", "\\\\").replace("'", "\\'")
+        query = f"name = '{escaped_name}' and mimeType = '{FOLDER_MIME_TYPE}' and trashed = false"
+        if parent_id is not None:
+            query += f" and '{parent_id}' in parents"
+        result = self.service.files().list(q=query, spaces="drive", fields="files(id)", pageSize=1).execute()
+        folders = result.get("files", [])
+        return folders[0]["id"] if len(folders) > 0 else None
+
+    def create_folder(self, name: str, parent_id: str | None) -> str:
+        metadata = {"name": name, "mimeType": FOLDER_MIME_TYPE}
+        if parent_id is not None:
+            metadata["parents"] = [parent_id]
+        return self.service.files().create(body=metadata, fields="id").execute()["id"]
+
+    def upload(self, path: str, name: str, parent_id: str, mime_type: str, chunk_size: int) -> str:
+        media = MediaFileUpload(path, mimetype=mime_type, chunksize=chunk_size, resumable=True)
+        request = self.service.files().create(body={"name": name, "parents": [parent_id]}, media_body=media, fields="id")
+        response = None
+        while response is None:
+            # continues the resumable session, only the current chunk is sent again on errors
+            _, response = request.next_chunk(num_retries=UPLOAD_RETRIES)
+        return response["id"]
 
-        folder = service.files().create(body=folder_metadata, fields="id").execute()
+def semester_name(date: datetime.date) -> str:
+    """
+    returns the semester of a date, summer semester from April to September, e.g. "SoSe 2026" or "WiSe 2025-26"
+    """
+    if 4 <= date.month <= 9:
+        return f"SoSe {date.year}"
+    start_year = date.year if date.month >= 10 else date.year - 1
+    return f"WiSe {start_year}-{str(start_year + 1)[-2:]}"
+
+class ExportUploader:
+    """
+    uploads export files into the folder hierarchy, with a cache of the folder ids and a background worker
+    """
+
+    def __init__(self, backend=None, chunk_size: int = UPLOAD_CHUNK_SIZE, root: str = EXPORT_ROOT):
+        self.backend = backend
+        self.chunk_size = chunk_size
+        self.root = root
+        self.lock = threading.Lock()
+        self.folder_ids: dict[tuple[str | None, str], str] = {} # (parent_id, name) -> folder_id
+        self.jobs: OrderedDict[str, dict] = OrderedDict() # job_id -> {"state", "result"}
+        self.queue = queue.SimpleQueue()
+        self.worker: threading.Thread | None = None
 
-        file_metadata = {
-            "name": file_name,
-            "parents": [folder.get("id")]
-        }
+    def _backend(self):
+        if self.backend is None:
+            if os.getenv("DRIVE_BACKEND", "google") == "fake":
+                from packages.backend.google_functions.fake_drive import FakeDrive
+                self.backend = FakeDrive()
+            else:
+                self.backend = GoogleDrive()
+        return self.backend
 
-        media = MediaInMemoryUpload(content.encode('utf-8'), mimetype=mime_type)
-        file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+    def folder(self, path: list[str]) -> str:
+        """
+        returns the id of the folder path below the root, missing folders are created \n
+        folders are only looked up in Drive the first time, afterwards the cached id is used
+        """
+        backend = self._backend()
+        parent_id = None
+        # one lock for the whole path, so concurrent uploads don't create the same folder twice
+        with self.lock:
+            for name in [self.root] + path:
+                key = (parent_id, name)
+                if key not in self.folder_ids:
+                    folder_id = backend.find_folder(name=name, parent_id=parent_id)
+                    if folder_id is None:
+                        folder_id = backend.create_folder(name=name, parent_id=parent_id)
+                    self.folder_ids[key] = folder_id
+                parent_id = self.folder_ids[key]
+        return parent_id
 
-        return {"success": True, "data": {"folder_id": folder.get("id"), "file_id": file.get("id")}}
+    def upload(self, path: str, file_name: str, folder: list[str], mime_type: str):
+        """
+        Upload a file from disk into a folder of the hierarchy.
+        Parameters:
+            path (str): Path of the file on disk, it is uploaded in chunks.
+            file_name (str): The name of the file in Drive.
+            folder (list[str]): Folder path below the root, e.g. ["SoSe 2026", "stueble_3__1_5_2026"].
+            mime_type (str): The MIME type of the file.
+        Returns:
+            dict: {"success": True, "data": {"folder_id", "file_id"}}, {"success": False, "error": e} if error occurred
+        """
+        try:
+            folder_id = self.folder(folder)
+            file_id = self._backend().upload(path=path, name=file_name, parent_id=folder_id, mime_type=mime_type,
+                                             chunk_size=self.chunk_size)
+        except (HttpError, OSError) as error:
+            # a cached folder may have been deleted in Drive meanwhile
+            with self.lock:
+                self.folder_ids.clear()
+            return {"success": False, "error": error}
+        return {"success": True, "data": {"folder_id": folder_id, "file_id": file_id}}
 
-    except HttpError as error:
-        return {"success": False, "error": error}
+    def schedule(self, job) -> str:
+        """
+        runs job (a function without parameters returning a result dict) in the background worker
 
-def export_stueble_guests(cursor, stueble_id: int):
+        Returns:
+            str: id of the job for status
+        """
+        job_id = str(uuid.uuid4())
+        with self.lock:
+            self.jobs[job_id] = {"state": "queued", "result": None}
+            while len(self.jobs) > MAX_JOBS:
+                oldest_id, oldest = next(iter(self.jobs.items()))
+                if oldest["state"] in ("queued", "running"):
+                    break
+                del self.jobs[oldest_id]
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._run_jobs, name="drive-export", daemon=True)
+                self.worker.start()
+        self.queue.put((job_id, job))
+        return job_id
+
+    def status(self, job_id: str) -> dict | None:
+        """
+        returns {"state": "queued" | "running" | "done" | "failed", "result": dict | None} of a job, None if unknown
+        """
+        with self.lock:
+            job = self.jobs.get(job_id, None)
+            return dict(job) if job is not None else None
+
+    def _run_jobs(self):
+        while True:
+            job_id, job = self.queue.get()
+            with self.lock:
+                self.jobs[job_id]["state"] = "running"
+            try:
+                result = job()
+            except Exception as e:
+                result = {"success": False, "error": e}
+            with self.lock:
+                self.jobs[job_id] = {"state": "done" if result["success"] is True else "failed", "result": result}
+
+uploader = ExportUploader()
+
+def export_stueble_guests(cursor, stueble_id: int, file_format: export.ExportFormat = "csv"):
     """
     Export the guest list for a specific Stueble event.
     Parameters:
         cursor: Database cursor object.
         stueble_id (int): The ID of the Stueble event.
-        date (date): The date of the event.
+        file_format (str): "csv" or "msgpack" (columnar).
     """
-
-    default_tz = ZoneInfo("Europe/Berlin")
-
     result = db.read_table(
         cursor=cursor,
         table_name="stueble_motto",
         keywords=["date_of_time"],
         conditions={"id": stueble_id},
         expect_single_answer=True)
-
     if result["success"] is False:
         return {"success": False, "error": result["error"]}
+    if result["data"] is None:
+        return {"success": False, "error": "no stueble found"}
     date = result["data"][0]
-    if date > (datetime.datetime.now(default_tz).date() - datetime.timedelta(days=1)) or (date == (datetime.datetime.now(default_tz).date() - datetime.timedelta(days=1)) and (datetime.datetime.now(default_tz).hour < 11)):
-        return {"success": False, "error": "Can only export guest lists for past stueble events (e.g. if stueble was on 01.01.2000 then guest list can be exported earliest at 02.01.2000 11:00)."}
-    keywords_events = ["id", "event_type", "submitted"]
-    keywords_users = ["first_name", "last_name", "email", "room", "residence"]
-
-    query = f"""SELECT {', '.join(['events.' + keyword for keyword in keywords_events])}, {', '.join(['users.' + keyword for keyword in keywords_users])}
-                FROM (SELECT * FROM events WHERE stueble_id = %s) AS events
-                LEFT JOIN users ON events.user_id = users.id;
-                """
-
-    result = db.custom_call(
-        connection=None,
-        cursor=cursor,
-        query=query,
-        variables=[stueble_id],
-        type_of_answer=db.ANSWER_TYPE.LIST_ANSWER)
 
+    result = export.export_history(cursor=cursor, file_format=file_format, stueble_id=stueble_id)
     if result["success"] is False:
-        return {"success": False, "error": result["error"]}
-
-    data = result["data"]
-    data = [{key: value for key, value in zip(keywords_events + keywords_users, row)} for row in data]
-    csv = export.export_csv(data)
-    if csv["success"] is False:
-        return {"success": False, "error": csv["message"]}
-
-    csv = csv["data"]
+        return result
+    exported = result["data"]
+    try:
+        if exported["rows"] == 0:
+            return {"success": False, "error": "No data to export."}
+        return uploader.upload(
+            path=exported["path"],
+            file_name=f"guest_list_stueble_{stueble_id}__{date.day}_{date.month}_{date.year}{exported['extension']}",
+            folder=[semester_name(date), f"stueble_{stueble_id}__{date.day}_{date.month}_{date.year}"],
+            mime_type=exported["mime_type"])
+    finally:
+        os.remove(exported["path"])
 
-    result = db.read_table(
-        cursor=cursor,
-        table_name="stueble_motto",
-        keywords=["date_of_time"],
-        conditions={"id": stueble_id},
-        expect_single_answer=True)
+def export_archive(cursor, file_format: export.ExportFormat = "msgpack"):
+    """
+    Export the guest and event history of all past Stueble events in one pass into one file.
+    Parameters:
+        cursor: Database cursor object.
+        file_format (str): "csv" or "msgpack" (columnar).
+    """
+    result = export.export_history(cursor=cursor, file_format=file_format)
     if result["success"] is False:
-        return {"success": False, "error": result["error"]}
-
-    date = result["data"][0]
-    print(date)
-    print(type(date))
-    print(date.day, date.month, date.year)
+        return result
+    exported = result["data"]
+    latest = export.latest_exportable_date()
+    try:
+        if exported["rows"] == 0:
+            return {"success": False, "error": "No data to export."}
+        return uploader.upload(
+            path=exported["path"],
+            file_name=f"guest_history_until_{latest.day}_{latest.month}_{latest.year}{exported['extension']}",
+            folder=["archive"],
+            mime_type=exported["mime_type"])
+    finally:
+        os.remove(exported["path"])
 
-    upload = upload_file_folder(
-        file_name=f"guest_list_stueble_{stueble_id}__{date.day}_{date.month}_{date.year}.csv",
-        folder_name=f"stueble_{stueble_id}__{date.day}_{date.month}_{date.year}",
-        content=csv,
-        mime_type="text/csv")
+def schedule_export(stueble_id: int | None = None, file_format: export.ExportFormat = "csv") -> str:
+    """
+    exports and uploads the guest list of a stueble, or the archive if stueble_id is None, in the background
 
-    return upload
+    Returns:
+        str: id of the job, see uploader.status
+    """
+    def job():
+        conn, cursor = get_read_conn_cursor()
+        try:
+            if stueble_id is None:
+                return export_archive(cursor=cursor, file_format=file_format)
+            return export_stueble_guests(cursor=cursor, stueble_id=stueble_id, file_format=file_format)
+        finally:
+            close_conn_cursor(conn, cursor)
+    return uploader.schedule(job)
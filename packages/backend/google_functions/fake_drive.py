@@ -0,0 +1,82 @@
+"""
+In-process fake of the Drive backend of drive.py for offline tests and benchmarks \n
+Folders and files are kept in dicts, uploads read the file in chunks like a resumable upload and count every request.
+Select it with DRIVE_BACKEND=fake or pass it to drive.ExportUploader.
+"""
+
+import hashlib
+import itertools
+import threading
+import time
+
+class FakeDrive:
+    """
+    thread safe fake with the methods of drive.GoogleDrive
+    """
+
+    def __init__(self, latency: float = 0.0, keep_content: bool = True):
+        """
+        Parameters:
+            latency (float): seconds every request takes, to simulate the round trip to Drive
+            keep_content (bool): whether the content of uploaded files is kept, otherwise only size and sha256
+        """
+        self.latency = latency
+        self.keep_content = keep_content
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.folders: dict[str, dict] = {} # id -> {"name", "parent"}
+        self.files: dict[str, dict] = {} # id -> {"name", "parent", "mime_type", "size", "sha256", "content"}
+        self.requests = 0
+
+    def _request(self):
+        with self.lock:
+            self.requests += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def find_folder(self, name: str, parent_id: str | None) -> str | None:
+        self._request()
+        with self.lock:
+            for folder_id, folder in self.folders.items():
+                if folder["name"] == name and folder["parent"] == parent_id:
+                    return folder_id
+        return None
+
+    def create_folder(self, name: str, parent_id: str | None) -> str:
+        self._request()
+        with self.lock:
+            folder_id = f"folder-{next(self.ids)}"
+            self.folders[folder_id] = {"name": name, "parent": parent_id}
+        return folder_id
+
+    def upload(self, path: str, name: str, parent_id: str, mime_type: str, chunk_size: int) -> str:
+        # one request to start the resumable session, then one per chunk
+        self._request()
+        digest = hashlib.sha256()
+        content = bytearray() if self.keep_content else None
+        size = 0
+        with open(path, "rb") as file:
+            while chunk := file.read(chunk_size):
+                self._request()
+                digest.update(chunk)
+                size += len(chunk)
+                if content is not None:
+                    content.extend(chunk)
+        with self.lock:
+            file_id = f"file-{next(self.ids)}"
+            self.files[file_id] = {"name": name, "parent": parent_id, "mime_type": mime_type, "size": size,
+                                   "sha256": digest.hexdigest(), "content": bytes(content) if content is not None else None}
+        return file_id
+
+    def path_of(self, item_id: str) -> str:
+        """
+        returns the folder path of a file or folder, e.g. "stueble exports/WiSe 2025-26/stueble_3__1_1_2026/guests.csv"
+        """
+        with self.lock:
+            item = self.files.get(item_id, None) or self.folders[item_id]
+            parts = [item["name"]]
+            parent = item["parent"]
+            while parent is not None:
+                parts.append(self.folders[parent]["name"])
+                parent = self.folders[parent]["parent"]
+        return "/".join(reversed(parts))
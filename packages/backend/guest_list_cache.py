@@ -0,0 +1,135 @@
+"""
+Cache of the encoded guest list per stueble for GET /guests \n
+All hosts of a party see the same guest list, so it is queried once and kept as JSON and msgpack bytes with a strong
+ETag (hash of the JSON). An entry is invalidated when the database sends NOTIFY guest_list_changed for its stueble
+(events inserted, see triggers.sql and websocket_runner.py), all entries on users_changed or a verification. As
+fallback, if no listener runs, entries are reloaded after GUEST_LIST_CACHE_MAX_AGE_SECONDS. \n
+Concurrent requests for an outdated entry wait for a single reload instead of querying the database each. The reload
+queries the primary, a replica behind READ_HOST can lag behind the NOTIFY and its outdated list would be cached under
+the new version.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Literal, TypedDict
+
+import msgpack
+from packages.backend.sql_connection import guest_events
+from packages.backend.sql_connection.conn_cursor_functions import close_conn_cursor, get_conn_cursor
+from packages.backend.sql_connection.common_types import GenericFailure, error_to_failure
+
+MAX_AGE_SECONDS = float(os.getenv("GUEST_LIST_CACHE_MAX_AGE_SECONDS", "60"))
+
+class GuestListEntry(TypedDict):
+    json: bytes
+    json_etag: str
+    msgpack: bytes
+    msgpack_etag: str # every representation needs its own strong etag
+
+class GuestListEntrySuccess(TypedDict):
+    success: Literal[True]
+    data: GuestListEntry
+
+class CachedGuestList:
+    """
+    entry of one stueble, version is the invalidation count of the stueble when the guest list was queried
+    """
+
+    def __init__(self, entry: GuestListEntry, version: int):
+        self.entry = entry
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+class GuestListCache:
+    """
+    thread safe cache of the encoded guest lists
+    """
+
+    def __init__(self, max_age: float = MAX_AGE_SECONDS):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.entries: dict[int, CachedGuestList] = {}
+        self.versions: dict[int, int] = {} # stueble_id -> number of invalidations
+        self.generation = 0 # number of invalidations of all stuebles
+        self.load_locks: dict[int, threading.Lock] = {}
+
+    def invalidate(self, stueble_id: int | None = None):
+        """
+        marks the guest list of a stueble, or of all stuebles if stueble_id is None, as outdated
+        """
+        with self.lock:
+            if stueble_id is None:
+                self.generation += 1
+                self.entries.clear()
+                return
+            self.versions[stueble_id] = self.versions.get(stueble_id, 0) + 1
+            self.entries.pop(stueble_id, None)
+
+    def _version(self, stueble_id: int) -> int:
+        return self.generation + self.versions.get(stueble_id, 0)
+
+    def _valid(self, stueble_id: int) -> CachedGuestList | None:
+        cached = self.entries.get(stueble_id, None)
+        if cached is None or cached.version != self._version(stueble_id) or time.monotonic() - cached.loaded_at >= self.max_age:
+            return None
+        return cached
+
+    def get(self, stueble_id: int) -> GuestListEntrySuccess | GenericFailure:
+        """
+        returns the encoded guest list of a stueble, queried on the primary only if the cached one is outdated \n
+        inside a unit of work the connection of the unit is used
+
+        Parameters:
+            stueble_id (int): id of the stueble
+        Returns:
+            dict: {"success": True, "data": {"json", "json_etag", "msgpack", "msgpack_etag"}}, {"success": False, "error": e} if error occurred
+        """
+        with self.lock:
+            cached = self._valid(stueble_id)
+            if cached is not None:
+                return {"success": True, "data": cached.entry}
+            load_lock = self.load_locks.setdefault(stueble_id, threading.Lock())
+
+        with load_lock:
+            # another request may have reloaded it while waiting
+            with self.lock:
+                cached = self._valid(stueble_id)
+                if cached is not None:
+                    return {"success": True, "data": cached.entry}
+                version = self._version(stueble_id)
+
+            conn, cursor = get_conn_cursor()
+            try:
+                result = guest_events.guest_list(cursor=cursor, stueble_id=stueble_id)
+            finally:
+                close_conn_cursor(conn, cursor)
+            if result["success"] is False:
+                return error_to_failure(result)
+            encoded = json.dumps(result["data"]).encode("utf-8")
+            digest = hashlib.sha256(encoded).hexdigest()[:32]
+            entry: GuestListEntry = {
+                "json": encoded,
+                "json_etag": f'"{digest}"',
+                "msgpack": msgpack.packb(result["data"], use_bin_type=True),
+                "msgpack_etag": f'"{digest}-msgpack"'}
+
+            with self.lock:
+                # an invalidation during the query makes the result outdated, it is only returned to this request
+                if version == self._version(stueble_id):
+                    self.entries[stueble_id] = CachedGuestList(entry=entry, version=version)
+        return {"success": True, "data": entry}
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    whether the If-None-Match header of a request contains the etag
+    """
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # the weak comparison of If-None-Match ignores the W/ prefix
+    return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+guest_list_cache = GuestListCache()
@@ -0,0 +1,221 @@
+"""
+Compact guest manifest of the current stueble for door scanners \n
+Hosts download the manifest once (requestGuestManifest) and keep it up to date with the guestAdded, guestRemoved and
+guestModified messages, which carry the manifestVersion after the change. If a version is missed, the client requests
+the deltas since its last version. Together with the public key (requestPublicKey) the qr code signature and the guest
+details can be checked on the device, only the arrive / leave write needs the server. \n
+requestGuestList sends the same guests as column arrays (see columnar) to bootstrap the guest list of a host. \n
+Messages of other stuebles (e.g. a registration for next week) are ignored. Every RECONCILE_SECONDS the websocket
+server reloads the guest list (see websocket.reconcile_guest_manifest), differences to the manifest, e.g. of a lost
+message, are added as a delta, a new current stueble replaces the manifest.
+"""
+
+from collections import deque
+import os
+import threading
+import time
+from typing import Any
+import zlib
+
+import msgpack
+
+from psycopg2.extensions import cursor
+
+from packages.backend.sql_connection import guest_events, motto
+from packages.backend.sql_connection.common_types import error_to_failure
+
+COLUMNS = ("id", "extern", "invitedBy", "verified", "present", "firstName", "lastName", "roomNumber", "residence")
+MANIFEST_EVENTS = ("guestAdded", "guestRemoved", "guestModified")
+MAX_DELTAS = 1000
+RECONCILE_SECONDS = float(os.getenv("GUEST_MANIFEST_RECONCILE_SECONDS", "60"))
+
+# columns of the columnar snapshot, extern, verified and present are packed into flags
+COLUMNAR_COLUMNS = ("id", "firstName", "lastName", "roomNumber", "residence", "invitedBy")
+FLAG_EXTERN = 1
+FLAG_VERIFIED = 2
+FLAG_PRESENT = 4
+
+class GuestManifest:
+    """
+    guest list of one stueble as rows of COLUMNS with a version that increases with every change \n
+    the last MAX_DELTAS changes are kept, so clients can catch up without downloading the whole manifest
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stueble_id: int | None = None
+        self.version = 0
+        self.base_version = 0 # deltas are only valid for versions after the last (re)load
+        self.guests: dict[str, dict[str, Any]] = {}
+        self.deltas: deque[dict[str, Any]] = deque(maxlen=MAX_DELTAS)
+        self.compressed: tuple[int, int | None, bytes] | None = None # (version, stueble_id, zlib payload) of the last compressed snapshot
+        self.loaded_at = 0.0
+        self.load_lock = threading.Lock() # one (re)load at a time
+        # messages applied while the guest list is queried, (stueble_id, event, items), replayed on top of the result
+        self.pending: list[tuple[int | None, str, list]] | None = None
+
+    def load(self, cursor: cursor, force: bool = False) -> dict:
+        """
+        (re)loads the manifest from the guest list if the current stueble changed or it wasn't loaded yet \n
+        the messages applied during the query are replayed on the result, since it may not contain them; for the same
+        stueble the differences to the manifest are added as one delta, so clients can catch up with the deltas
+
+        Parameters:
+            cursor: cursor for the connection
+            force (bool): reload the guest list of an unchanged stueble as well, if it was loaded RECONCILE_SECONDS ago
+        Returns:
+            dict: {"success": True}, {"success": False, "error": e} if error occurred
+        """
+        result = motto.get_motto(cursor=cursor)
+        if result["success"] is False:
+            return result
+        stueble_id = result["data"][2]
+
+        with self.load_lock:
+            with self.lock:
+                # a waiting request may find it loaded by the previous one
+                if stueble_id == self.stueble_id and (not force or time.monotonic() - self.loaded_at < RECONCILE_SECONDS):
+                    return {"success": True}
+                self.pending = []
+
+            result = guest_events.guest_list(cursor=cursor, stueble_id=stueble_id)
+
+            with self.lock:
+                pending, self.pending = self.pending, None
+                if result["success"] is False:
+                    return error_to_failure(result)
+                guests = {guest["id"]: {column: guest.get(column, None) for column in COLUMNS} for guest in result["data"]}
+                for message_stueble_id, event, items in pending:
+                    if message_stueble_id is None or message_stueble_id == stueble_id:
+                        self._change(guests, event, items)
+                self.loaded_at = time.monotonic()
+
+                if stueble_id != self.stueble_id:
+                    self.stueble_id = stueble_id
+                    self.version += 1
+                    self.base_version = self.version
+                    self.guests = guests
+                    self.deltas.clear()
+                    return {"success": True}
+
+                upserts = [[row[column] for column in COLUMNS] for user_uuid, row in guests.items() if self.guests.get(user_uuid, None) != row]
+                removals = [user_uuid for user_uuid in self.guests if user_uuid not in guests]
+                self.guests = guests
+                if len(upserts) > 0 or len(removals) > 0:
+                    self.version += 1
+                    self.deltas.append({"version": self.version, "upserts": upserts, "removals": removals})
+        return {"success": True}
+
+    def reconcile_due(self) -> bool:
+        return self.stueble_id is not None and time.monotonic() - self.loaded_at >= RECONCILE_SECONDS
+
+    def invalidate(self):
+        """
+        reconciles the manifest with the next check, e.g. after notifications were missed
+        """
+        self.loaded_at = 0.0
+
+    @staticmethod
+    def _change(guests: dict[str, dict[str, Any]], event: str, items: list) -> tuple[list, list]:
+        """
+        applies the items of a message to guests
+
+        Returns:
+            tuple: (upserted rows, removed uuids)
+        """
+        upserts = []
+        removals = []
+        for item in items:
+            user_uuid = item if isinstance(item, str) else item.get("id", None) if isinstance(item, dict) else None
+            if user_uuid is None:
+                continue
+            if event == "guestRemoved":
+                if guests.pop(user_uuid, None) is not None:
+                    removals.append(user_uuid)
+                continue
+            if not isinstance(item, dict):
+                continue
+            row = guests.setdefault(user_uuid, dict.fromkeys(COLUMNS))
+            row.update({key: value for key, value in item.items() if key in COLUMNS})
+            upserts.append([row[column] for column in COLUMNS])
+        return upserts, removals
+
+    def apply(self, event: str, data: Any, stueble_id: int | None = None) -> int | None:
+        """
+        applies a guest list message to the manifest
+
+        Parameters:
+            event (str): guestAdded, guestRemoved or guestModified
+            data: data of the message, a guest, a list of guests or (for guestRemoved) the uuid of the guest
+            stueble_id (int | None): stueble of the change, None for changes of the current stueble or of the user
+                                     (e.g. a verification)
+        Returns:
+            int | None: version after the change, None if the manifest isn't loaded, is of another stueble or nothing changed
+        """
+        if event not in MANIFEST_EVENTS:
+            return None
+        items = data if isinstance(data, list) else [data]
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append((stueble_id, event, items))
+            if self.stueble_id is None or (stueble_id is not None and stueble_id != self.stueble_id):
+                return None
+            upserts, removals = self._change(self.guests, event, items)
+            if len(upserts) == 0 and len(removals) == 0:
+                return None
+            self.version += 1
+            self.deltas.append({"version": self.version, "upserts": upserts, "removals": removals})
+            return self.version
+
+    def snapshot(self, since: int | None = None) -> dict:
+        """
+        returns the deltas after version since, or the whole manifest if they aren't available any more
+
+        Parameters:
+            since (int | None): last version known by the client
+        Returns:
+            dict: {"stuebleId", "version", "columns", "rows"} or {"stuebleId", "version", "deltas": [{"version", "upserts", "removals"}]}
+        """
+        with self.lock:
+            if since is not None and self.base_version <= since <= self.version \
+                    and (since == self.version or (len(self.deltas) > 0 and self.deltas[0]["version"] <= since + 1)):
+                return {"stuebleId": self.stueble_id,
+                        "version": self.version,
+                        "deltas": [delta for delta in self.deltas if delta["version"] > since]}
+            return {"stuebleId": self.stueble_id,
+                    "version": self.version,
+                    "columns": list(COLUMNS),
+                    "rows": [[guest[column] for column in COLUMNS] for guest in self.guests.values()]}
+
+    def columnar(self, compress: bool = False) -> dict:
+        """
+        returns the manifest as column arrays, e.g. {"id": [...], "firstName": [...], ..., "flags": [...]} with the
+        flags FLAG_EXTERN, FLAG_VERIFIED and FLAG_PRESENT per guest \n
+        compressed, the columns are msgpack encoded and zlib compressed into payload, the payload of the last version
+        is reused
+
+        Parameters:
+            compress (bool): whether the columns are sent as zlib payload
+        Returns:
+            dict: {"stuebleId", "version", "count", "columns"} or {"stuebleId", "version", "count", "encoding": "zlib", "payload": bytes}
+        """
+        with self.lock:
+            snapshot = {"stuebleId": self.stueble_id, "version": self.version, "count": len(self.guests)}
+            cached = self.compressed
+            if compress and cached is not None and cached[:2] == (self.version, self.stueble_id):
+                return {**snapshot, "encoding": "zlib", "payload": cached[2]}
+            # rows are changed in place by apply, so the columns are copied under the lock
+            guests = self.guests.values()
+            columns = {column: [guest[column] for guest in guests] for column in COLUMNAR_COLUMNS}
+            columns["flags"] = [(FLAG_EXTERN if guest["extern"] else 0)
+                                | (FLAG_VERIFIED if guest["verified"] else 0)
+                                | (FLAG_PRESENT if guest["present"] else 0) for guest in guests]
+        if not compress:
+            return {**snapshot, "columns": columns}
+
+        payload = zlib.compress(msgpack.packb(columns, use_bin_type=True))
+        with self.lock:
+            self.compressed = (snapshot["version"], snapshot["stuebleId"], payload)
+        return {**snapshot, "encoding": "zlib", "payload": payload}
+
+guest_manifest = GuestManifest()
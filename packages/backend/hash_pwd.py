@@ -1,9 +1,12 @@
 import base64
+import binascii
+from functools import lru_cache
 import json
 import os
 from typing import Any, Literal, TypedDict, cast
 
 import bcrypt
+from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import padding
@@ -22,6 +25,16 @@ def hash_pwd(password: str) -> str:
 def match_pwd(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode(), hashed.encode())
 
+@lru_cache(maxsize=1)
+def load_private_key(private_key: str) -> Ed25519PrivateKey:
+    """
+    parses the PEM private key once instead of on every signature
+    """
+    return cast(Ed25519PrivateKey, serialization.load_pem_private_key(
+        private_key.encode('utf-8'),
+        password=None,
+    ))
+
 def create_signature(message: str | dict[str, Any]) -> CreateSignatureSuccess | GenericFailure:
     """
     Create a digital signature for a given message using Ed25519 private key.
@@ -40,10 +53,31 @@ def create_signature(message: str | dict[str, Any]) -> CreateSignatureSuccess |
     if not private_key:
         return {"success": False, "error": "Private key not found in environment variables."}
 
-    private_key = cast(Ed25519PrivateKey, serialization.load_pem_private_key(
-        private_key.encode('utf-8'),
-        password=None,
-    ))
+    private_key = load_private_key(private_key)
 
     signature = private_key.sign(message.encode())
-    return {"success": True, "data": base64.b64encode(signature).decode()}
\ No newline at end of file
+    return {"success": True, "data": base64.b64encode(signature).decode()}
+
+def verify_signature(message: str | dict[str, Any], signature: str) -> bool:
+    """
+    Verify a signature created by create_signature (e.g. of a scanned qr code).
+
+    Parameters:
+        message (str | dict): The signed message.
+        signature (str): The base64 encoded signature.
+    Returns:
+        bool: True if the signature is valid, False otherwise (also if the private key is missing)
+    """
+
+    if isinstance(message, dict):
+        message = json.dumps(message, separators=(',', ':'), sort_keys=True)
+
+    private_key = os.getenv("PRIVATE_KEY")
+    if not private_key:
+        return False
+
+    try:
+        load_private_key(private_key).public_key().verify(base64.b64decode(signature, validate=True), message.encode())
+    except (InvalidSignature, binascii.Error, ValueError, TypeError):
+        return False
+    return True
\ No newline at end of file
@@ -0,0 +1,23 @@
+import sys
+
+from packages.backend.sql_connection import database as db, statistics
+
+# rebuilds the statistics of all past stuebles, one stueble per transaction
+# usage: python -m packages.backend.initialization.backfill_statistics [batch_size]
+
+batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+conn, cursor = db.connect()
+total = 0
+while True:
+    result = statistics.backfill(cursor=cursor, batch_size=batch_size)
+    if result["success"] is False:
+        raise Exception(result["error"])
+    if len(result["data"]) == 0:
+        break
+    total += len(result["data"])
+    print(f"Rebuilt statistics of stuebles {result['data']}")
+
+cursor.close()
+conn.close()
+print(f"Statistics of {total} stuebles backfilled.")
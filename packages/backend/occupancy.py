@@ -0,0 +1,130 @@
+"""
+Live occupancy (present and registered guests) per stueble for the door and bar screens \n
+The counts are kept in memory and updated from NOTIFY occupancy_changed, which count_guests (add / remove) and
+collect_stats (arrive / leave) send with the new count after every guest event (see triggers.sql and
+websocket_runner.py). Every RECONCILE_SECONDS the counts and the capacity are reloaded from the counters in the
+database, in case a notification was lost. \n
+Changes are collected and pushed by the websocket server as occupancy frame every PUSH_INTERVAL_SECONDS at most, see
+websocket.push_occupancy.
+"""
+
+import os
+import threading
+import time
+from typing import TypedDict
+
+from psycopg2.extensions import cursor
+
+from packages.backend.sql_connection import motto, statistics
+from packages.backend.sql_connection.common_types import GenericFailure, GenericSuccess
+
+PUSH_INTERVAL_SECONDS = float(os.getenv("OCCUPANCY_PUSH_INTERVAL_SECONDS", "0.25"))
+RECONCILE_SECONDS = float(os.getenv("OCCUPANCY_RECONCILE_SECONDS", "30"))
+
+class OccupancyFrame(TypedDict):
+    stuebleId: int
+    present: int
+    registered: int
+    capacity: int | None
+
+class OccupancyTracker:
+    """
+    thread safe counts of all tracked stuebles, written by the db listener and the reconciliation, read by the websocket
+    server
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stuebles: dict[int, OccupancyFrame] = {}
+        self.dirty: set[int] = set()
+        self.loaded: set[int] = set() # stuebles with all counts, a notification only carries one of them
+        self.reconciled_at = 0.0
+
+    def update(self, stueble_id: int, present: int | None = None, registered: int | None = None):
+        """
+        sets the counts of a stueble, missing counts stay unchanged
+
+        Parameters:
+            stueble_id (int): id of the stueble
+            present (int | None): number of present guests
+            registered (int | None): number of registered guests
+        """
+        with self.lock:
+            if stueble_id not in self.stuebles:
+                # load the other counts with the next reconciliation
+                self.reconciled_at = 0.0
+            frame = self.stuebles.setdefault(stueble_id, {"stuebleId": stueble_id, "present": 0, "registered": 0, "capacity": None})
+            changed = False
+            for key, value in (("present", present), ("registered", registered)):
+                if value is not None and frame[key] != value:
+                    frame[key] = value
+                    changed = True
+            if changed:
+                self.dirty.add(stueble_id)
+
+    def invalidate(self):
+        """
+        reconciles the counts with the next push, e.g. after notifications were missed
+        """
+        self.reconciled_at = 0.0
+
+    def reconcile_due(self) -> bool:
+        return time.monotonic() - self.reconciled_at >= RECONCILE_SECONDS
+
+    def reconcile(self, cursor: cursor, force: bool = False) -> GenericSuccess | GenericFailure:
+        """
+        reloads the counts of the current stueble if the last reconciliation is older than RECONCILE_SECONDS, other
+        stuebles aren't tracked anymore until their next change
+
+        Parameters:
+            cursor: cursor for the connection
+            force (bool): reload regardless of the age
+        Returns:
+            dict: {"success": True}, {"success": False, "error": e} if error occurred
+        """
+        if not force and not self.reconcile_due():
+            return {"success": True}
+        self.reconciled_at = time.monotonic()
+
+        result = motto.get_motto(cursor=cursor)
+        if result["success"] is False:
+            return result
+        stueble_id = result["data"][2]
+        with self.lock:
+            for tracked_id in [i for i in self.stuebles if i != stueble_id]:
+                del self.stuebles[tracked_id]
+                self.dirty.discard(tracked_id)
+                self.loaded.discard(tracked_id)
+
+        result = statistics.get_occupancy(cursor=cursor, stueble_id=stueble_id)
+        if result["success"] is False:
+            return result
+        self.update(stueble_id=stueble_id, present=result["data"]["present"], registered=result["data"]["registered"])
+        with self.lock:
+            frame = self.stuebles[stueble_id]
+            if frame["capacity"] != result["data"]["capacity"]:
+                frame["capacity"] = result["data"]["capacity"]
+                self.dirty.add(stueble_id)
+            self.loaded.add(stueble_id)
+        return {"success": True}
+
+    def get(self, stueble_id: int) -> OccupancyFrame | None:
+        """
+        returns the counts of a stueble, None if they aren't loaded
+        """
+        with self.lock:
+            if stueble_id not in self.loaded:
+                return None
+            return dict(self.stuebles[stueble_id])
+
+    def changes(self) -> list[OccupancyFrame]:
+        """
+        returns the loaded stuebles that changed since the last call, several changes in between are merged into one
+        frame
+        """
+        with self.lock:
+            changed = self.dirty & self.loaded
+            self.dirty -= changed
+            return [dict(self.stuebles[stueble_id]) for stueble_id in changed]
+
+occupancy = OccupancyTracker()
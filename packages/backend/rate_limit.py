@@ -0,0 +1,138 @@
+"""
+Token bucket rate limits for the websocket events and the HTTP routes, so a client in a loop can't take the connection
+pool from everyone else \n
+Every budget has a bucket per session and a bucket per address, a request takes one token from each and is rejected
+if one of them is empty. The address bucket gets IP_FACTOR times the budget, since many clients can share an address
+(the dorm network, a proxy). The websocket events are only limited per session, the connection was authenticated
+during the handshake, which itself is limited per address. \n
+Behind the reverse proxy every peer address is the proxy, the address of the client is taken from X-Forwarded-For of
+the TRUSTED_PROXIES (see client_address). \n
+The buckets are kept in memory, full buckets are dropped every PRUNE_SECONDS.
+"""
+
+import os
+import threading
+import time
+from typing import NamedTuple, TypedDict
+
+class Budget(NamedTuple):
+    rate: float # tokens per second
+    burst: float # size of the bucket
+
+BUDGETS = {
+    "handshake": Budget(rate=1, burst=10),
+    "ping": Budget(rate=1, burst=10),
+    "heartbeat": Budget(rate=1, burst=10),
+    "requestMotto": Budget(rate=0.5, burst=5),
+    "requestQRCode": Budget(rate=0.2, burst=5), # signs with Ed25519
+    "acknowledgement": Budget(rate=50, burst=200),
+    "search": Budget(rate=5, burst=20), # typeahead sends a request per keystroke
+}
+DEFAULT_BUDGET = Budget(rate=float(os.getenv("RATE_LIMIT_DEFAULT_RATE", "10")), burst=float(os.getenv("RATE_LIMIT_DEFAULT_BURST", "30")))
+IP_FACTOR = float(os.getenv("RATE_LIMIT_IP_FACTOR", "50"))
+PRUNE_SECONDS = 60.0
+# peers whose X-Forwarded-For is trusted, comma separated
+TRUSTED_PROXIES = frozenset(proxy.strip() for proxy in os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "127.0.0.1,::1").split(",") if proxy.strip())
+
+class RateLimitMetrics(TypedDict):
+    buckets: int
+    allowed: dict[str, int]
+    rejected: dict[str, int]
+
+class RateLimiter:
+    """
+    thread safe token buckets, used by the websocket server and the waitress threads of the api
+    """
+
+    def __init__(self, budgets: dict[str, Budget], default_budget: Budget, ip_factor: float):
+        self.budgets = budgets
+        self.default_budget = default_budget
+        self.ip_factor = ip_factor
+        self.lock = threading.Lock()
+        # (budget name, "session" / "ip", key) -> [tokens, updated, rate, burst]
+        self.buckets: dict[tuple[str, str, str], list[float]] = {}
+        self.allowed: dict[str, int] = {}
+        self.rejected: dict[str, int] = {}
+        self.pruned_at = time.monotonic()
+
+    def bucket(self, key: tuple[str, str, str], budget: Budget, now: float) -> list[float]:
+        """
+        returns the refilled bucket of a key, a new bucket is full
+        """
+        bucket = self.buckets.get(key, None)
+        if bucket is None:
+            bucket = self.buckets[key] = [budget.burst, now, budget.rate, budget.burst]
+        else:
+            bucket[0] = min(bucket[3], bucket[0] + (now - bucket[1]) * bucket[2])
+            bucket[1] = now
+        return bucket
+
+    def prune(self, now: float):
+        """
+        drops the buckets, that are full again, they are the same as a new bucket
+        """
+        self.buckets = {key: bucket for key, bucket in self.buckets.items()
+                        if bucket[0] + (now - bucket[1]) * bucket[2] < bucket[3]}
+        self.pruned_at = now
+
+    def take(self, name: str, session_id: str | None = None, ip: str | None = None) -> float:
+        """
+        takes a token of the budget from the bucket of the session and the bucket of the address
+
+        Parameters:
+            name (str): name of the budget (BUDGETS), e.g. the websocket event, DEFAULT_BUDGET if unknown
+            session_id (str | None): session id of the client, not limited per session if None
+            ip (str | None): address of the client, not limited per address if None
+        Returns:
+            float: 0.0 if allowed, else the seconds until a token is available again
+        """
+        budget = self.budgets.get(name, self.default_budget)
+        now = time.monotonic()
+        with self.lock:
+            if now - self.pruned_at > PRUNE_SECONDS:
+                self.prune(now)
+
+            buckets = []
+            if session_id is not None:
+                buckets.append(self.bucket((name, "session", session_id), budget, now))
+            if ip is not None:
+                buckets.append(self.bucket((name, "ip", ip), Budget(budget.rate * self.ip_factor, budget.burst * self.ip_factor), now))
+
+            retry_after = max([(1 - bucket[0]) / bucket[2] for bucket in buckets if bucket[0] < 1], default=0.0)
+            if retry_after > 0:
+                self.rejected[name] = self.rejected.get(name, 0) + 1
+                return retry_after
+            for bucket in buckets:
+                bucket[0] -= 1
+            self.allowed[name] = self.allowed.get(name, 0) + 1
+            return 0.0
+
+    def metrics(self) -> RateLimitMetrics:
+        """
+        returns the number of buckets and the allowed and rejected requests per budget
+        """
+        with self.lock:
+            return {"buckets": len(self.buckets), "allowed": dict(self.allowed), "rejected": dict(self.rejected)}
+
+def client_address(peer: str | None, forwarded_for: str | None) -> str | None:
+    """
+    returns the address of the client for the address buckets \n
+    for a trusted proxy it is the last hop of X-Forwarded-For, that isn't a trusted proxy itself (the hops before can
+    be set by the client), None if the proxy didn't send one, so the requests of all clients don't share the bucket
+    of the proxy
+
+    Parameters:
+        peer (str | None): address of the peer of the connection
+        forwarded_for (str | None): value of the X-Forwarded-For header
+    Returns:
+        str | None: address of the client, None if unknown
+    """
+    if peer not in TRUSTED_PROXIES:
+        return peer
+    hops = [hop.strip() for hop in (forwarded_for or "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if hop not in TRUSTED_PROXIES:
+            return hop
+    return None
+
+rate_limiter = RateLimiter(budgets=BUDGETS, default_budget=DEFAULT_BUDGET, ip_factor=IP_FACTOR)
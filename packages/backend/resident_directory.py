@@ -0,0 +1,194 @@
+"""
+In-process directory of all residents (users except extern) for host searches \n
+The directory is loaded with a single query and rebuilt after the database sends NOTIFY users_changed (see triggers.sql
+and websocket_runner.py), or after RESIDENT_DIRECTORY_MAX_AGE_SECONDS as fallback if no listener runs. \n
+The rows are stored column wise, the indexes only hold row numbers:
+- sorted prefix indexes on lower(first_name), lower(last_name) and lower(user_name), searched with bisect
+- (residence, room) -> rows
+- exact maps for user_name, email and user_uuid
+"""
+
+from array import array
+from bisect import bisect_left
+import os
+import threading
+import time
+
+from psycopg2.extensions import cursor
+
+from packages.backend.sql_connection import database as db
+from packages.backend.sql_connection.common_types import GenericFailure, GenericSuccess, error_to_failure
+from packages.backend.sql_connection.search import SearchUser
+
+MAX_AGE_SECONDS = float(os.getenv("RESIDENT_DIRECTORY_MAX_AGE_SECONDS", "300"))
+
+class PrefixIndex:
+    """
+    sorted keys with the row of each key, prefix lookups are two binary searches
+    """
+
+    def __init__(self, keys: list[str | None]):
+        pairs = sorted((key, row) for row, key in enumerate(keys) if key is not None)
+        self.keys = [key for key, _ in pairs]
+        self.rows = array("I", [row for _, row in pairs])
+
+    def lookup(self, prefix: str) -> array:
+        """
+        returns the rows of all keys starting with prefix, in key order
+        """
+        start = bisect_left(self.keys, prefix)
+        # "\U0010ffff" sorts after every character that can follow the prefix
+        end = bisect_left(self.keys, prefix + "\U0010ffff", lo=start)
+        return self.rows[start:end]
+
+class DirectorySnapshot:
+    """
+    immutable state of the directory, replaced as a whole on reload so readers never need a lock
+    """
+
+    def __init__(self, rows: list[tuple]):
+        # columns: user_uuid, first_name, last_name, room, residence, user_name, email
+        self.size = len(rows)
+        self.user_uuids = tuple(str(row[0]) for row in rows)
+        self.first_names = tuple(row[1] for row in rows)
+        self.last_names = tuple(row[2] for row in rows)
+        self.rooms = array("i", [row[3] if row[3] is not None else 0 for row in rows]) # rooms start at 1, 0 is no room
+        self.residences = tuple(row[4] for row in rows)
+        self.user_names = tuple(row[5] for row in rows)
+        self.emails = tuple(row[6] for row in rows)
+
+        self.first_name_index = PrefixIndex([name.lower() for name in self.first_names])
+        self.last_name_index = PrefixIndex([name.lower() for name in self.last_names])
+        self.user_name_index = PrefixIndex([row[5].lower() if row[5] is not None else None for row in rows])
+
+        self.room_index: dict[tuple[str, int], list[int]] = {}
+        for i, row in enumerate(rows):
+            if row[3] is not None and row[4] is not None:
+                self.room_index.setdefault((row[4], row[3]), []).append(i)
+        # user names aren't unique in the table
+        self.user_name_rows: dict[str, list[int]] = {}
+        for i, user_name in enumerate(self.user_names):
+            if user_name is not None:
+                self.user_name_rows.setdefault(user_name, []).append(i)
+        self.email_rows = {email: i for i, email in enumerate(self.emails) if email is not None}
+        self.uuid_rows = {user_uuid: i for i, user_uuid in enumerate(self.user_uuids)}
+
+    def user(self, row: int) -> SearchUser:
+        return {"firstName": self.first_names[row],
+                "lastName": self.last_names[row],
+                "id": self.user_uuids[row],
+                "residence": self.residences[row]}
+
+    def sort_key(self, row: int) -> tuple[str, str]:
+        return self.first_names[row].lower(), self.last_names[row].lower()
+
+class ResidentDirectory:
+    """
+    thread safe, lazily (re)loaded resident directory
+    """
+
+    def __init__(self, max_age: float = MAX_AGE_SECONDS):
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.snapshot: DirectorySnapshot | None = None
+        self.loaded_at = 0.0
+        self.stale = True
+
+    def invalidate(self):
+        """
+        marks the directory as outdated, it is reloaded on the next access
+        """
+        self.stale = True
+
+    def ensure_loaded(self, cursor: cursor) -> GenericSuccess | GenericFailure:
+        """
+        reloads the directory if it is outdated, only one thread loads at a time
+
+        Parameters:
+            cursor: cursor for the connection
+        Returns:
+            dict: {"success": True}, {"success": False, "error": e} if error occurred
+        """
+        if not self.stale and time.monotonic() - self.loaded_at < self.max_age:
+            return {"success": True}
+        with self.lock:
+            # another thread may have reloaded it while waiting for the lock
+            if not self.stale and time.monotonic() - self.loaded_at < self.max_age:
+                return {"success": True}
+            # reset before the query, so a NOTIFY arriving during the load triggers another reload
+            self.stale = False
+            result = db.custom_call(
+                cursor=cursor,
+                query="""SELECT user_uuid, first_name, last_name, room, residence, user_name, email
+                FROM users WHERE user_role != 'extern'""",
+                type_of_answer=db.ANSWER_TYPE.LIST_ANSWER,
+                read_only=True)
+            if result["success"] is False:
+                self.stale = True
+                return error_to_failure(result)
+            self.snapshot = DirectorySnapshot(result["data"])
+            self.loaded_at = time.monotonic()
+        return {"success": True}
+
+    def typeahead(self, prefix: str, limit: int) -> list[SearchUser]:
+        """
+        suggestions for typed text, one word is matched against first name, last name and user name, with two or more
+        words the first one is matched against the first name and the last one against the last name
+        """
+        snapshot = self.snapshot
+        words = prefix.lower().split()
+        if snapshot is None or len(words) == 0:
+            return []
+        if len(words) > 1:
+            rows = [row for row in snapshot.first_name_index.lookup(words[0])
+                    if snapshot.last_names[row].lower().startswith(words[-1])]
+        else:
+            rows = set(snapshot.first_name_index.lookup(words[0]))
+            rows.update(snapshot.last_name_index.lookup(words[0]))
+            rows.update(snapshot.user_name_index.lookup(words[0]))
+        return [snapshot.user(row) for row in sorted(rows, key=snapshot.sort_key)[:limit]]
+
+    def find(self, limit: int, first_name: str | None = None, last_name: str | None = None, room: int | None = None,
+             residence: str | None = None, email: str | None = None, user_name: str | None = None,
+             user_uuid: str | None = None) -> list[SearchUser]:
+        """
+        residents matching all given fields, names match by case insensitive prefix, everything else exactly
+        """
+        snapshot = self.snapshot
+        if snapshot is None:
+            return []
+        if user_name is not None:
+            candidates = snapshot.user_name_rows.get(user_name, [])
+        elif email is not None:
+            candidates = [snapshot.email_rows[email]] if email in snapshot.email_rows else []
+        elif user_uuid is not None:
+            candidates = [snapshot.uuid_rows[user_uuid]] if user_uuid in snapshot.uuid_rows else []
+        elif room is not None and residence is not None:
+            candidates = snapshot.room_index.get((residence, room), [])
+        elif first_name is not None:
+            candidates = snapshot.first_name_index.lookup(first_name.lower())
+        elif last_name is not None:
+            candidates = snapshot.last_name_index.lookup(last_name.lower())
+        else:
+            candidates = range(snapshot.size)
+
+        users = []
+        for row in candidates:
+            if first_name is not None and not snapshot.first_names[row].lower().startswith(first_name.lower()):
+                continue
+            if last_name is not None and not snapshot.last_names[row].lower().startswith(last_name.lower()):
+                continue
+            if residence is not None and snapshot.residences[row] != residence:
+                continue
+            if room is not None and snapshot.rooms[row] != room:
+                continue
+            if email is not None and snapshot.emails[row] != email:
+                continue
+            if user_uuid is not None and snapshot.user_uuids[row] != user_uuid:
+                continue
+            users.append(snapshot.user(row))
+            if len(users) >= limit:
+                break
+        return users
+
+resident_directory = ResidentDirectory()
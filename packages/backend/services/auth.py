@@ -0,0 +1,109 @@
+"""
+Sessions and the data of the logged in user
+"""
+
+from typing import Any
+
+from psycopg2.extensions import cursor
+
+from packages.backend import hash_pwd as hp
+from packages.backend.data_types import Email
+from packages.backend.services.common import ServiceSuccess, failure
+from packages.backend.sql_connection import sessions, users
+from packages.backend.sql_connection.common_types import FailureWithStatus
+
+def login(cursor: cursor, user: str | None, password: str | None) -> ServiceSuccess | FailureWithStatus:
+    """
+    checks the password of a user and creates a new session
+
+    Parameters:
+        cursor: cursor for the connection
+        user (str | None): email or username of the user
+        password (str | None): password of the user
+    Returns:
+        dict: {"success": True, "data": {"session_id", "expiration_date"}, "notifications": []},
+              {"success": False, "error": e, "status": int} if error occurred
+    """
+    # password can't be empty
+    if password == "":
+        return failure("password cannot be empty", 401)
+    if user is None:
+        return failure("specify user", 400)
+
+    user_email: Email | None = None
+    user_name: str | None = None
+    if "@" in user:
+        try:
+            user_email = Email(email=user)
+        except ValueError:
+            return failure("Invalid email format", 400)
+    else:
+        user_name = user
+
+    if password is None:
+        return failure("specify password", 400)
+
+    result = users.get_user(cursor=cursor, keywords=["id", "password_hash", "user_role"], user_email=user_email, user_name=user_name)
+    if result["success"] is False:
+        return failure(result["error"])
+    if result["data"] is None:
+        return failure("Failed to find user")
+    user_id, password_hash, _ = result["data"]
+
+    if password_hash is None:
+        return failure("account was deleted, can be reactivated by signup", 401)
+    if not hp.match_pwd(password, password_hash):
+        return failure("invalid password", 401)
+
+    result = sessions.create_session(cursor=cursor, user_id=user_id)
+    if result["success"] is False:
+        return failure(result["error"])
+    session_id, expiration_date = result["data"]
+    return {"success": True, "data": {"session_id": session_id, "expiration_date": expiration_date}, "notifications": []}
+
+def logout(cursor: cursor, session_id: str | None) -> ServiceSuccess | FailureWithStatus:
+    """
+    removes the session
+
+    Parameters:
+        cursor: cursor for the connection
+        session_id (str | None): session id of the user
+    Returns:
+        dict: {"success": True, "data": None, "notifications": []}, {"success": False, "error": e, "status": int} if error occurred
+    """
+    if session_id is None:
+        return failure("The session id must be specified", 401)
+
+    result = sessions.remove_session(cursor=cursor, session_id=session_id)
+    if result["success"] is False:
+        return failure(result["error"], 401)
+    return {"success": True, "data": None, "notifications": []}
+
+def current_user(cursor: cursor, session_id: str | None) -> ServiceSuccess | FailureWithStatus:
+    """
+    returns the data of the logged in user
+
+    Parameters:
+        cursor: cursor for the connection
+        session_id (str | None): session id of the user
+    Returns:
+        dict: {"success": True, "data": {"firstName", "lastName", "roomNumber", "residence", "email", "id", "username"}, "notifications": []},
+              {"success": False, "error": e, "status": int} if error occurred
+    """
+    if session_id is None:
+        return failure("The session id must be specified", 401)
+
+    result = sessions.get_user(cursor=cursor, session_id=session_id, keywords=("id", "user_role", "user_uuid", "room", "residence", "first_name", "last_name", "email", "user_name"))
+    if result["success"] is False:
+        return failure(result["error"], 401)
+    data = result["data"]
+
+    user: dict[str, Any] = {
+        "firstName": data[5],
+        "lastName": data[6],
+        "roomNumber": data[3],
+        "residence": data[4],
+        "email": data[7],
+        "id": data[0],
+        "username": data[8]}
+    return {"success": True, "data": user, "notifications": []}
@@ -0,0 +1,68 @@
+"""
+Types and helpers shared by the services \n
+A service function gets a cursor, the session id of the caller and the parameters of the operation, it returns
+{"success": True, "data": ..., "notifications": [...]} or a FailureWithStatus. data is plain (json / msgpack
+serializable) and encoded once by the transport, notifications are the websocket messages and mails the operation causes
+and are sent by websocket.notify after the transaction was committed.
+"""
+
+from typing import Any, Literal, TypedDict
+
+from psycopg2.extensions import cursor
+
+from packages.backend.data_types import Email, UserRole
+from packages.backend.sql_connection.common_functions import check_permissions
+from packages.backend.sql_connection.common_types import FailureWithStatus
+
+class Notification(TypedDict, total=False):
+    event: str # broadcast event, "stuebleStatus", "status", "rooms" or "mail"
+    data: Any
+    skip_sid: str # broadcast: session that doesn't get the message
+    stueble_id: int # broadcast: stueble of a guest list change, the current stueble if missing
+    session_id: str # stuebleStatus: session of the user, data holds date, registered and present
+    user_uuid: str # status: user whose capabilities changed
+    session_ids: list[str] # rooms: sessions that join / leave the host room, data is "add" or "remove"
+    recipient: Email # mail: recipient, data holds subject, body and images (see google_functions/email.py)
+
+class ServiceSuccess(TypedDict):
+    success: Literal[True]
+    data: Any
+    notifications: list[Notification]
+
+class PermittedUser(TypedDict):
+    user_id: int
+    user_role: UserRole
+    user_uuid: str
+    first_name: str
+    last_name: str
+
+class PermittedUserSuccess(TypedDict):
+    success: Literal[True]
+    data: PermittedUser
+
+def require_role(cursor: cursor, session_id: str | None, required_role: UserRole) -> PermittedUserSuccess | FailureWithStatus:
+    """
+    checks the role of the session
+
+    Parameters:
+        cursor: cursor for the connection
+        session_id (str | None): session id of the user
+        required_role (UserRole): required role of the user
+    Returns:
+        dict: {"success": True, "data": {"user_id", "user_role", "user_uuid", "first_name", "last_name"}},
+              {"success": False, "error": e, "status": 401 | 403} otherwise
+    """
+    if session_id is None:
+        return {"success": False, "error": "The session id must be specified", "status": 401}
+    result = check_permissions(cursor=cursor, session_id=session_id, required_role=required_role)
+    if result["success"] is False:
+        return {"success": False, "error": str(result["error"]), "status": 401}
+    if result["data"]["allowed"] is False:
+        return {"success": False, "error": f"invalid permissions, need role {required_role.value} or above", "status": 403}
+    return {"success": True, "data": {key: value for key, value in result["data"].items() if key != "allowed"}}
+
+def failure(error: Any, status: int = 500) -> FailureWithStatus:
+    """
+    returns a failure with the message of error
+    """
+    return {"success": False, "error": str(error), "status": status}
@@ -0,0 +1,73 @@
+"""
+Configuration values of the table configurations, only for admins
+"""
+
+from typing import Any
+
+from psycopg2.extensions import cursor
+
+from packages.backend.basic_functions import camel_to_snake_case, snake_to_camel_case
+from packages.backend.data_types import UserRole
+from packages.backend.services.common import ServiceSuccess, failure, require_role
+from packages.backend.sql_connection import configs, database as db
+from packages.backend.sql_connection.common_types import FailureWithStatus
+
+def configurations(cursor: cursor) -> ServiceSuccess | FailureWithStatus:
+    """
+    returns all configuration values with camelCase keys, without permission check
+    """
+    result = configs.get_all_configurations(cursor=cursor)
+    if result["success"] is False:
+        return failure(result["error"])
+    return {"success": True, "data": {snake_to_camel_case(key): value for key, value in result["data"].items()}, "notifications": []}
+
+def get_config(cursor: cursor, session_id: str | None) -> ServiceSuccess | FailureWithStatus:
+    """
+    returns all configuration values with camelCase keys
+
+    Parameters:
+        cursor: cursor for the connection
+        session_id (str | None): session id of the user
+    Returns:
+        dict: {"success": True, "data": {key: value}, "notifications": []}, {"success": False, "error": e, "status": int} if error occurred
+    """
+    result = require_role(cursor=cursor, session_id=session_id, required_role=UserRole.ADMIN)
+    if result["success"] is False:
+        return result
+    return configurations(cursor=cursor)
+
+def update_config(cursor: cursor, session_id: str | None, values: dict[str, Any] | None) -> ServiceSuccess | FailureWithStatus:
+    """
+    updates configuration values and returns all of them
+
+    Parameters:
+        cursor: cursor for the connection
+        session_id (str | None): session id of the user
+        values (dict | None): {camelCase key: value} of the values to change
+    Returns:
+        dict: {"success": True, "data": {key: value}, "notifications": []}, {"success": False, "error": e, "status": int} if error occurred
+    """
+    if not isinstance(values, dict) or len(values) == 0:
+        return failure("values must be specified", 400)
+
+    result = require_role(cursor=cursor, session_id=session_id, required_role=UserRole.ADMIN)
+    if result["success"] is False:
+        return result
+
+    case_statements = '\n'.join(["WHEN %s THEN %s" for _ in range(len(values))])
+    keys = tuple(camel_to_snake_case(key) for key in values.keys())
+    params = [elem for i in zip(keys, values.values()) for elem in i] + [keys]
+
+    query = f"""UPDATE configurations
+    SET value = CASE key
+    {case_statements}
+    END
+    WHERE key IN %s"""
+    result = db.custom_call(cursor=cursor,
+                            query=query,
+                            type_of_answer=db.ANSWER_TYPE.NO_ANSWER,
+                            variables=params)
+    if result["success"] is False:
+        return failure(result["error"])
+
+    return configurations(cursor=cursor)
@@ -0,0 +1,213 @@
+"""
+Guest changes of hosts at the door: check-in, buffered door scans, verification and force-add \n
+The changed guest is returned in the format of guestAdded / guestModified, the hosts and the sessions of the guest are
+notified (see services/common.py).
+"""
+
+from typing import Any
+
+from psycopg2.extensions import cursor
+
+from packages.backend.data_types import UserRole, VerificationMethod, valid_verification_method
+from packages.backend.services.common import Notification, ServiceSuccess, failure, require_role
+from packages.backend.sql_connection import database as db, guest_events, motto, sessions, users
+from packages.backend.sql_connection.common_types import FailureWithStatus
+
+def guest_notifications(event: str, guests: dict[str, Any] | list[dict[str, Any]],
+                        session_ids: dict[str, list[str]]) -> list[Notification]:
+    """
+    returns the broadcast of changed guests and the stueble status for the sessions of the guests
+
+    Parameters:
+        event (str): guestAdded or guestModified
+        guests (dict | list): a guest or a list of guests in the format of guestModified
+        session_ids (dict): user_uuid -> session_ids of the guest
+    """
+    notifications: list[Notification] = [{"event": event, "data": guests}] # don't skip_sid for guestModified
+    for guest in guests if isinstance(guests, list) else [guests]:
+        for sess_id in session_ids.get(guest["id"], []):
+            notifications.append({"event": "stuebleStatus", "session_id": sess_id,
+                                  "data": {"registered": True, "present": guest["present"]}})
+    return notifications
+
+def guest_data(cursor: cursor, user_id: int, present: bool | None = None) -> ServiceSuccess | FailureWithStatus:
+    """
+    returns a guest in the format of guestModified, notifications are left empty
+
+    Parameters:
+        cursor: cursor for the connection
+        user_id (int): id of the guest
+        present (bool | None): whether the guest is present, read from the events if None
+    Returns:
+        dict: {"success": True, "data": guest, "notifications": []}, {"success": False, "error": e, "status": int} if error occurred
+    """
+    keywords = ["user_uuid", "first_name", "last_name", "user_role", "room", "residence", "verified"]
+    result = users.get_user(cursor=cursor, user_id=user_id, keywords=keywords)
+    if result["success"] is False:
+        return failure(result["error"])
+    user_info = dict(zip(keywords, result["data"]))
+
+    if present is None:
+        result = users.check_user_present(cursor=cursor, user_id=user_id)
+        if result["success"] is False:
+            return failure(result["error"])
+        present = result["data"]
+
+    guest = {
+        "id": str(user_info["user_uuid"]),
+        "present": present,
+        "firstName": user_info["first_name"],
+        "lastName": user_info["last_name"],
+        "extern": user_info["user_role"] == UserRole.EXTERN.value}
+    if guest["extern"] is False:
+        guest["roomNumber"] = user_info["room"]
+        guest["residence"] = user_info["residence"]
+        guest["verified"] = user_info["verified"] is True
+    return {"success": True, "data": guest, "notifications": []}
+
+def check_in(cursor: cursor, session_id: str | None, user_uuid: str | None, present: bool | None) -> ServiceSuccess | FailureWithStatus:
+    """
+    marks a guest as arrived / left, the permissions of the host are checked by the database (see check_in_guest)
+
+    Parameters:
+        cursor: cursor for the connection
+        session_id (str | None): session id of the host
+        user_uuid (str | None): uuid of the guest
+        present (bool | None): True if the guest arrives, False if the guest leaves
+    Returns:
+        dict: {"success": True, "data": guest, "notifications": [...]}, {"success": False, "error": e, "status": int} if error occurred
+    """
+    if session_id is None or user_uuid is None or not isinstance(present, bool):
+        return failure("The session id, uuid, present must be specified", 401 if session_id is None else 400)
+
+    result = guest_events.check_in(cursor=cursor, session_id=session_id, user_uuid=user_uuid, present=present)
+    if result["success"] is False:
+        message = str(result["error"])
+        if all(i in message for i in ["Inviter of user", "is not registered for stueble"]):
+            return failure("Inviter not registered to stueble any more", 400)
+        if "is not registered for stueble" in message:
+            return failure("User not registered to stueble", 400)
+        return failure(*guest_events.split_error_code(message))
+
+    guest = result["data"]
+    user_data = {
+        "id": user_uuid,
+        "present": present,
+        "firstName": guest["first_name"],
+        "lastName": guest["last_name"],
+        "extern": guest["extern"]}
+    if guest["extern"] is False:
+        user_data["roomNumber"] = guest["room"]
+        user_data["residence"] = guest["residence"]
+        user_data["verified"] = True
+    return {"success": True, "data": user_data,
+            "notifications": guest_notifications("guestModified", user_data, {user_uuid: list(guest["session_ids"] or [])})}
+
+def check_in_batch(cursor: cursor, session_id: str | None, scans: list[dict[str, Any]] | None) -> ServiceSuccess | FailureWithStatus:
+    """
+    applies buffered door scans of a host in one transaction (see guest_events.check_in_batch), all changed guests are
+    sent in one guestModified message
+
+    Parameters:
+        cursor: cursor for the connection
+        session_id (str | None): session id of the host
+        scans (list[dict] | None): [{"id": user_uuid, "present": bool, "scannedAt": timestamp, "qrCode": {"data": dict, "signature": str}}]
+    Returns:
+        dict: {"success": True, "data": [{"id", "scannedAt", "code", "message"}], "notifications": [...]},
+              {"success": False, "error": e, "status": int} if error occurred
+    """
+    if not isinstance(scans, list):
+        return failure("The session id, scans must be specified", 401 if session_id is None else 400)
+
+    result = require_role(cursor=cursor, session_id=session_id, required_role=UserRole.HOST)
+    if result["success"] is False:
+        return result
+
+    result = guest_events.check_in_batch(cursor=cursor, scans=scans)
+    if result["success"] is False:
+        return failure(result["error"])
+
+    guests = result["data"]["guests"]
+    notifications = guest_notifications("guestModified", guests, result["data"]["session_ids"]) if len(guests) > 0 else []
+    return {"success": True, "data": result["data"]["results"], "notifications": notifications}
+
+def verify_guest(cursor: cursor, session_id: str | None, user_uuid: str | None, method: str | None = None) -> ServiceSuccess | FailureWithStatus:
+    """
+    sets a guest verified, only for hosts and above
+
+    Parameters:
+        cursor: cursor for the connection
+        session_id (str | None): session id of the host
+        user_uuid (str | None): uuid of the guest
+        method (str | None): how the guest was verified, "idCard" or "roomKey"
+    Returns:
+        dict: {"success": True, "data": guest, "notifications": [...]}, {"success": False, "error": e, "status": int} if error occurred
+    """
+    if user_uuid is None:
+        return failure("id must be specified", 400)
+    if method is not None and (not valid_verification_method(method) or VerificationMethod(method) in (VerificationMethod.KOLPING, VerificationMethod.NONE)):
+        return failure("invalid verification method", 400)
+
+    result = require_role(cursor=cursor, session_id=session_id, required_role=UserRole.HOST)
+    if result["success"] is False:
+        return result
+
+    result = users.update_user(cursor=cursor, user_uuid_key=user_uuid, verified=True)
+    if result["success"] is False:
+        return failure(result["error"], 404 if result["error"] == "User doesn't exist." else 500)
+
+    result = guest_data(cursor=cursor, user_id=result["data"])
+    if result["success"] is False:
+        return result
+    result["notifications"] = [{"event": "guestModified", "data": result["data"]}]
+    return result
+
+def force_add_guest(cursor: cursor, session_id: str | None, user_uuid: str | None) -> ServiceSuccess | FailureWithStatus:
+    """
+    adds a guest to the current stueble as present, skipping the checks of event_guest_change (e.g. capacity),
+    only for hosts and above
+
+    Parameters:
+        cursor: cursor for the connection
+        session_id (str | None): session id of the host
+        user_uuid (str | None): uuid of the guest
+    Returns:
+        dict: {"success": True, "data": guest, "notifications": [...]}, {"success": False, "error": e, "status": int} if error occurred
+    """
+    if user_uuid is None:
+        return failure("The user_uuid must be specified", 400)
+
+    result = require_role(cursor=cursor, session_id=session_id, required_role=UserRole.HOST)
+    if result["success"] is False:
+        return result
+
+    result = users.get_user(cursor=cursor, user_uuid=user_uuid, keywords=["id"])
+    if result["success"] is False:
+        return failure(result["error"], 404 if result["error"] == "No matching user found" else 500)
+    user_id = result["data"][0]
+
+    result = motto.get_motto(cursor=cursor)
+    if result["success"] is False:
+        return failure("no stueble party found", 404)
+    stueble_id = result["data"][2]
+
+    query = """SET additional.skip_triggers = 'on';
+INSERT INTO events (user_id, stueble_id, event_type) VALUES (%s, %s, %s), (%s, %s, %s);  -- Triggers will be skipped
+RESET additional.skip_triggers;"""
+    result = db.custom_call(cursor=cursor,
+                            query=query,
+                            type_of_answer=db.ANSWER_TYPE.NO_ANSWER,
+                            variables=[user_id, stueble_id, 'add', user_id, stueble_id, 'arrive'],
+                            read_only=False)
+    if result["success"] is False:
+        return failure(result["error"])
+
+    result = guest_data(cursor=cursor, user_id=user_id, present=True)
+    if result["success"] is False:
+        return result
+    guest = result["data"]
+
+    # a guest without sessions just doesn't get a stuebleStatus
+    result = sessions.get_session_ids(cursor=cursor, user_id=user_id, uuid=True)
+    session_ids = [str(i) for i in result["data"]] if result["success"] is True else []
+    return {"success": True, "data": guest, "notifications": guest_notifications("guestAdded", guest, {guest["id"]: session_ids})}
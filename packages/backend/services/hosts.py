@@ -0,0 +1,213 @@
+"""
+Hosts of a stueble and tutors \n
+Changing a role moves the sessions of the users into / out of the host room of the websocket server and sends them
+their new capabilities (see services/common.py).
+"""
+
+from typing import Literal
+
+from psycopg2.extensions import cursor
+
+from packages.backend.data_types import UserRole
+from packages.backend.services.common import Notification, ServiceSuccess, failure, require_role
+from packages.backend.sql_connection import database as db, motto, users
+from packages.backend.sql_connection.common_types import FailureWithStatus
+
+def session_ids_of(cursor: cursor, user_ids: list[int]) -> ServiceSuccess | FailureWithStatus:
+    """
+    returns the session ids (uuids) of users, for the room changes of the websocket server
+    """
+    if len(user_ids) == 0:
+        return {"success": True, "data": [], "notifications": []}
+    result = db.custom_call(
+        cursor=cursor,
+        query="SELECT session_id FROM sessions WHERE user_id IN %s",
+        type_of_answer=db.ANSWER_TYPE.LIST_ANSWER,
+        variables=(tuple(user_ids),))
+    if result["success"] is False:
+        return failure(result["error"])
+    return {"success": True, "data": [str(i[0]) for i in result["data"]], "notifications": []}
+
+def list_hosts(cursor: cursor, session_id: str | None, date: str | None = None) -> ServiceSuccess | FailureWithStatus:
+    """
+    returns the hosts of a stueble, only for hosts and above
+
+    Parameters:
+        cursor: cursor for the connection
+        session_id (str | None): session id of the user
+        date (str | None): date of the stueble, the next stueble if None
+    Returns:
+        dict: {"success": True, "data": [{"id", "firstName", "lastName", "residence"}], "notifications": []},
+              {"success": False, "error": e, "status": int} if error occurred
+    """
+    result = require_role(cursor=cursor, session_id=session_id, required_role=UserRole.HOST)
+    if result["success"] is False:
+        return result
+
+    result = motto.get_motto(cursor=cursor, date=date)
+    if result["success"] is False:
+        return failure("no stueble party found", 404) if result["error"] == "no motto found" else failure(result["error"])
+    stueble_id = result["data"][2]
+
+    result = motto.get_hosts(cursor=cursor, stueble_id=stueble_id)
+    if result["success"] is False:
+        return failure(result["error"])
+    hosts = [{"id": i["user_uuid"], "firstName": i["first_name"], "lastName": i["last_name"], "residence": i["residence"]} for i in result["data"]]
+    return {"success": True, "data": hosts, "notifications": []}
+
+def list_tutors(cursor: cursor, session_id: str | None) -> ServiceSuccess | FailureWithStatus:
+    """
+    returns all tutors, only for hosts and above
+
+    Parameters:
+        cursor: cursor for the connection
+        session_id (str | None): session id of the user
+    Returns:
+        dict: {"success": True, "data": [{"id", "firstName", "lastName", "residence"}], "notifications": []},
+              {"success": False, "error": e, "status": int} if error occurred
+    """
+    result = require_role(cursor=cursor, session_id=session_id, required_role=UserRole.HOST)
+    if result["success"] is False:
+        return result
+
+    query = """SELECT user_uuid, first_name, last_name, residence FROM users WHERE user_role = 'tutor'"""
+    result = db.stream_query(cursor=cursor, query=query)
+    if result["success"] is False:
+        return failure(result["error"])
+    tutors = [{"id": i[0], "firstName": i[1], "lastName": i[2], "residence": i[3]} for i in result["data"]]
+    return {"success": True, "data": tutors, "notifications": []}
+
+def change_hosts(cursor: cursor, session_id: str | None, method: Literal["add", "remove"], user_uuids: list[str] | None,
+                 date: str | None = None) -> ServiceSuccess | FailureWithStatus:
+    """
+    makes users hosts of a stueble or removes them, only for tutors and above
+
+    Parameters:
+        cursor: cursor for the connection
+        session_id (str | None): session id of the user
+        method (str): "add" or "remove"
+        user_uuids (list[str] | None): uuids of the users
+        date (str | None): date of the stueble, the next stueble if None
+    Returns:
+        dict: {"success": True, "data": [{"id", "firstName", "lastName", "residence"}], "notifications": [...]},
+              {"success": False, "error": e, "status": int} if error occurred
+    """
+    if session_id is None:
+        return failure("The session id must be specified", 401)
+    if not user_uuids:
+        return failure("hosts must be specified", 403)
+
+    result = require_role(cursor=cursor, session_id=session_id, required_role=UserRole.TUTOR)
+    if result["success"] is False:
+        return result
+
+    result = motto.get_motto(cursor=cursor, date=date)
+    if result["success"] is False:
+        return failure("no stueble party found", 404) if result["error"] == "no motto found" else failure(result["error"])
+    stueble_id = result["data"][2]
+
+    result = users.get_users(cursor=cursor, user_uuids=user_uuids, keywords=["user_uuid", "first_name", "last_name", "residence", "user_role"])
+    if result["success"] is False:
+        return failure(result["error"])
+    hosts_data = [{"id": i[0], "firstName": i[1], "lastName": i[2], "residence": i[3]} for i in result["data"]
+                  if i[4] == ('user' if method == "add" else 'host')]
+    if len(hosts_data) != len(user_uuids):
+        return failure("Tutoren und Admins können nicht zu Hosts gemacht werden", 404)
+
+    result = motto.update_hosts(cursor=cursor, stueble_id=stueble_id, method=method, user_uuids=user_uuids)
+    if result["success"] is False:
+        return failure(result["error"])
+    user_ids = result["data"]
+
+    # stueble_id is the id of the current stueble, therefore also change the role of the users
+    if method == "remove":
+        query = "UPDATE users SET user_role = 'user' WHERE id IN %s AND user_role = 'host'"
+    else:
+        query = "UPDATE users SET user_role = 'host' WHERE id IN %s AND user_role = 'user'"
+    result = db.custom_call(cursor=cursor, query=query, type_of_answer=db.ANSWER_TYPE.NO_ANSWER, variables=(tuple(user_ids),))
+    if result["success"] is False:
+        return failure(result["error"])
+
+    result = session_ids_of(cursor=cursor, user_ids=user_ids)
+    if result["success"] is False:
+        return result
+
+    notifications: list[Notification] = [{"event": "rooms", "data": method, "session_ids": result["data"]}]
+    for user in hosts_data:
+        notifications.append({"event": "hostAdded" if method == "add" else "hostRemoved",
+                              "data": user if method == "add" else user["id"], "skip_sid": session_id})
+        notifications.append({"event": "status", "user_uuid": user["id"]})
+    return {"success": True, "data": hosts_data, "notifications": notifications}
+
+def change_tutors(cursor: cursor, session_id: str | None, method: Literal["add", "remove"], user_uuids: list[str] | None) -> ServiceSuccess | FailureWithStatus:
+    """
+    makes users or hosts tutors or tutors users again, only for admins
+
+    Parameters:
+        cursor: cursor for the connection
+        session_id (str | None): session id of the user
+        method (str): "add" or "remove"
+        user_uuids (list[str] | None): uuids of the users
+    Returns:
+        dict: {"success": True, "data": [{"id", "firstName", "lastName", "residence"}], "notifications": [...]},
+              {"success": False, "error": e, "status": int} if error occurred
+    """
+    if session_id is None:
+        return failure("The session id must be specified", 401)
+    if not user_uuids:
+        return failure("tutors must be specified", 403)
+
+    result = require_role(cursor=cursor, session_id=session_id, required_role=UserRole.ADMIN)
+    if result["success"] is False:
+        return result
+
+    result = users.get_users(cursor=cursor, user_uuids=user_uuids, keywords=["user_uuid", "first_name", "last_name", "residence", "user_role"])
+    if result["success"] is False:
+        return failure(result["error"])
+    tutors_data = [{"id": i[0], "firstName": i[1], "lastName": i[2], "residence": i[3], "user_role": UserRole(i[4])} for i in result["data"]]
+
+    # check, whether all users were found
+    if len(tutors_data) != len(user_uuids):
+        return failure("Not all users found", 404)
+    if any(i["user_role"] >= UserRole.ADMIN for i in tutors_data):
+        return failure("Can only remove tutors or make admins to tutors", 403)
+
+    hosts_removed = []
+    if method == "remove":
+        new_role = UserRole.USER
+        allowed_roles = (UserRole.TUTOR,)
+    else:
+        if any(i["user_role"] == UserRole.EXTERN for i in tutors_data):
+            return failure("Can't promote extern users to tutors", 403)
+        hosts_removed = [i["id"] for i in tutors_data if i["user_role"] == UserRole.HOST]
+        new_role = UserRole.TUTOR
+        allowed_roles = (UserRole.USER, UserRole.HOST)
+    tutors_data = [{key: value for key, value in i.items() if key != "user_role"} for i in tutors_data if i["user_role"] in allowed_roles]
+    if len(tutors_data) != len(user_uuids):
+        return failure("Some users can't be promoted to tutors", 403)
+
+    result = db.custom_call(cursor=cursor,
+                            query="UPDATE users SET user_role = %s WHERE user_uuid IN %s RETURNING id",
+                            type_of_answer=db.ANSWER_TYPE.LIST_ANSWER,
+                            variables=[new_role.value, tuple(i["id"] for i in tutors_data)],
+                            read_only=False)
+    if result["success"] is False:
+        return failure(result["error"])
+    user_ids = [i[0] for i in result["data"]]
+
+    # NOTE: unneccessary due to trigger
+    result = db.custom_call(cursor=cursor, query="DELETE FROM hosts WHERE user_id IN %s", type_of_answer=db.ANSWER_TYPE.NO_ANSWER, variables=(tuple(user_ids),))
+    if result["success"] is False:
+        return failure(result["error"])
+
+    result = session_ids_of(cursor=cursor, user_ids=user_ids)
+    if result["success"] is False:
+        return result
+
+    notifications: list[Notification] = [{"event": "rooms", "data": method, "session_ids": result["data"]}]
+    for user in tutors_data:
+        notifications.append({"event": "tutorAdded" if method == "add" else "tutorRemoved",
+                              "data": user if method == "add" else user["id"], "skip_sid": session_id})
+        notifications.append({"event": "status", "user_uuid": user["id"]})
+    notifications += [{"event": "hostRemoved", "data": host} for host in hosts_removed]
+    return {"success": True, "data": tutors_data, "notifications": notifications}
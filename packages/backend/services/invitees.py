@@ -0,0 +1,171 @@
+"""
+Extern guests invited by residents (PUT / DELETE /guests/invitee) \n
+NOTE: an extern guest can be multiple times in the table users, since only first_name and last_name are specified,
+which are not unique
+"""
+
+import datetime
+import json
+from typing import Literal
+
+from psycopg2.extensions import cursor
+
+from packages.backend import hash_pwd as hp, qr_code as qr
+from packages.backend.data_types import Email, UserRole
+from packages.backend.mail_assets import templates
+from packages.backend.services.common import ServiceSuccess, failure, require_role
+from packages.backend.sql_connection import database as db, events, guest_events, motto, sessions, users
+from packages.backend.sql_connection.common_types import FailureWithStatus
+
+def find_invitee(cursor: cursor, inviter_id: int, stueble_id: int, first_name: str, last_name: str) -> ServiceSuccess | FailureWithStatus:
+    """
+    finds the extern guest with the name, that was invited by the inviter to the stueble
+
+    Returns:
+        dict: {"success": True, "data": (invitee_id, invitee_uuid), "notifications": []}, {"success": False, "error": e, "status": int} if error occurred
+    """
+    result = users.get_user(
+        cursor=cursor,
+        keywords=["id", "user_uuid"],
+        conditions={"first_name": first_name, "last_name": last_name, "user_role": UserRole.EXTERN.value},
+        expect_single_answer=False)
+    if result["success"] is False:
+        return failure(result["error"], 404 if result["error"] == "No matching user found" else 500)
+
+    query = """
+    SELECT user_id FROM events
+    WHERE user_id = %s AND stueble_id = %s AND event_type = 'add' AND invited_by = %s
+    ORDER BY submitted DESC LIMIT 1"""
+    invitees = []
+    for possible_id, possible_uuid in result["data"]:
+        result = db.custom_call(cursor=cursor,
+                                query=query,
+                                type_of_answer=db.ANSWER_TYPE.SINGLE_ANSWER,
+                                variables=[possible_id, stueble_id, inviter_id])
+        if result["success"] is False:
+            return failure(result["error"])
+        if result["data"] is not None:
+            invitees.append((possible_id, possible_uuid))
+
+    if len(invitees) == 0:
+        return failure("No such user found", 404)
+    if len(invitees) > 1:
+        return failure("Multiple users found, please contact an admin", 409)
+    return {"success": True, "data": invitees[0], "notifications": []}
+
+def change_invitee(cursor: cursor, session_id: str | None, method: Literal["add", "remove"], first_name: str | None,
+                   last_name: str | None, email: str | None = None, date: str | None = None) -> ServiceSuccess | FailureWithStatus:
+    """
+    invites an extern guest to a stueble or removes the invitation, the invitee gets the qr code by mail (sent as
+    notification after the commit)
+
+    Parameters:
+        cursor: cursor for the connection
+        session_id (str | None): session id of the inviting user
+        method (str): "add" or "remove"
+        first_name (str | None): first name of the invitee
+        last_name (str | None): last name of the invitee
+        email (str | None): email of the invitee, the qr code is sent to it
+        date (str | None): date of the stueble, the next stueble if None
+    Returns:
+        dict: {"success": True, "data": guest, "notifications": [...]}, {"success": False, "error": e, "status": int} if error occurred
+    """
+    if email is not None:
+        try:
+            email = Email(email)
+        except ValueError:
+            return failure("Invalid email format", 400)
+
+    if any(i is None for i in [session_id, first_name, last_name, email]):
+        return failure("session_id, date, invitee_first_name, invitee_last_name, invitee_email must be specified", 401)
+
+    # check permissions, since only users can add guests
+    result = require_role(cursor=cursor, session_id=session_id, required_role=UserRole.USER)
+    if result["success"] is False:
+        return result
+    inviter = result["data"]
+    user_id = inviter["user_id"]
+
+    if inviter["user_role"] < UserRole.HOST:
+        result = users.check_user_guest_list(cursor=cursor, user_id=user_id)
+        if result["success"] is False:
+            return failure(result["error"])
+        if result["data"] is False:
+            return failure("You need to be on the guest list to invite someone", 403)
+
+        # check, whether user is present
+        result = users.check_user_present(cursor=cursor, user_id=user_id)
+        if result["success"] is False:
+            return failure(result["error"])
+        present = result["data"]
+    else:
+        present = False
+
+    # get all sessions for user
+    result = sessions.get_session_ids(cursor=cursor, user_id=user_id, uuid=True)
+    if result["success"] is False:
+        return failure(result["error"])
+    inviter_session_ids = result["data"]
+
+    result = motto.get_info(cursor=cursor, date=date)
+    if result["success"] is False:
+        return failure(result["error"])
+    stueble_id, motto_name, stueble_date = result["data"][0], result["data"][1], result["data"][2]
+
+    if method == "add":
+        # add user to table
+        result = users.add_user(
+            cursor=cursor,
+            user_role=UserRole.EXTERN,
+            first_name=first_name,
+            last_name=last_name,
+            returning_column="id, user_uuid") # id, user_uuid on purpose like that
+    else:
+        result = find_invitee(cursor=cursor, inviter_id=user_id, stueble_id=stueble_id, first_name=first_name, last_name=last_name)
+    if result["success"] is False:
+        return result if "status" in result else failure(result["error"])
+    invitee_id, invitee_uuid = result["data"][0], result["data"][1]
+
+    if method == "add":
+        result = events.add_guest(cursor=cursor, user_id=invitee_id, stueble_id=stueble_id, invited_by=user_id)
+    else:
+        result = events.remove_guest(cursor=cursor, user_id=invitee_id, stueble_id=stueble_id)
+    if result["success"] is False:
+        # the extern user was already inserted, it must not outlive the rejected registration
+        db.abort(cursor)
+        return failure(*guest_events.split_error_code(result["error"]))
+
+    invitee_data = {
+        "id": invitee_uuid,
+        "present": False,
+        "firstName": first_name,
+        "lastName": last_name,
+        "extern": True,
+        "invitedBy": inviter["user_uuid"]}
+
+    if method == "add":
+        information = {"id": invitee_uuid, "timestamp": int(datetime.datetime.now().timestamp()), "extern": True}
+        result = hp.create_signature(message=information)
+        if result["success"] is False:
+            db.abort(cursor)
+            return failure(result["error"])
+
+        qr_code = qr.generate(json.dumps({"data": information, "signature": result["data"]}), size=400, rounded_edges=30)
+        result = templates.stueble_guest(invitee_first_name=first_name,
+                                         invitee_last_name=last_name,
+                                         first_name=inviter["first_name"],
+                                         last_name=inviter["last_name"],
+                                         stueble_date=stueble_date.strftime("%d.%m.%Y"),
+                                         motto_name=motto_name,
+                                         qr_code=qr_code)
+        invitation = result
+
+    # the hosts see the changed guest list, the inviter the stueble status
+    notifications = [{"event": "guestAdded" if method == "add" else "guestRemoved", "data": invitee_data, "stueble_id": stueble_id}]
+    notifications += [{"event": "stuebleStatus", "session_id": sess_id, "data": {"date": date, "registered": True, "present": present}}
+                      for sess_id in inviter_session_ids]
+    # the qr code is only mailed once the invitation is committed
+    if method == "add":
+        notifications.append({"event": "mail", "recipient": email, "data": {"subject": invitation["subject"],
+                              "body": invitation["body"], "images": invitation["images"]}})
+    return {"success": True, "data": invitee_data, "notifications": notifications}
@@ -1,5 +1,6 @@
 
 
+from collections.abc import Iterator
 from typing import Any, Literal, TypeGuard, TypedDict
 
 class GenericSuccess(TypedDict):
@@ -13,6 +14,11 @@ class GenericError(TypedDict):
     success: Literal[False]
     error: Exception
 
+class FailureWithStatus(TypedDict):
+    success: Literal[False]
+    error: str
+    status: int
+
 # Database
 
 class SingleSuccess(TypedDict):
@@ -31,6 +37,10 @@ class MultipleTupleSuccess(TypedDict):
     success: Literal[True]
     data: list[tuple[Any, ...]]
 
+class StreamSuccess(TypedDict):
+    success: Literal[True]
+    data: Iterator[tuple[Any, ...]]
+
 # Type checking
 
 def is_single_success(result: GenericSuccess | SingleSuccess | GenericFailure) -> TypeGuard[SingleSuccess]:
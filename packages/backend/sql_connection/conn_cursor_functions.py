@@ -1,18 +1,150 @@
+import threading
+from contextlib import ContextDecorator
+
 from psycopg2.extensions import connection, cursor
 
-from packages.backend.sql_connection.pool import pool
+from packages.backend.sql_connection import database as db
+from packages.backend.sql_connection.pool import pool, read_pool, register_internal_file
+
+register_internal_file(__file__)
+
+# stack of the active units of work of every thread
+_scope = threading.local()
+
+def _active_units() -> list["UnitOfWork"]:
+    if not hasattr(_scope, "units"):
+        _scope.units = []
+    return _scope.units
+
+class UnitOfWork(ContextDecorator):
+    """
+    scope in which every get_conn_cursor call shares one pooled connection and one transaction \n
+    - the connection is checked out lazily on the first get_conn_cursor call
+    - the helpers in database.py don't commit inside the scope, a failing helper is rolled back to its savepoint, so
+      the request can go on with the same transaction, the unit is only marked as failed if the transaction is aborted
+    - the transaction is committed once (or rolled back if anything failed or close_conn_cursor was called with
+      failed, i.e. the request answers with an error) when the outermost close_conn_cursor is called or the scope
+      ends, the connection is always returned to the pool
+    - read only connections taken inside the scope are returned when the scope ends as well
+    """
+
+    def __init__(self):
+        self.connection: connection | None = None
+        self.borrowers = 0
+        self.read_connections: list[connection] = []
+
+    def __enter__(self):
+        _active_units().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            while self.read_connections:
+                read_pool.putconn(self.read_connections.pop())
+            if self.connection is not None:
+                self._finish(failed=exc_type is not None)
+        finally:
+            _active_units().remove(self)
+        return False
+
+    def borrow(self) -> tuple[connection, cursor]:
+        """
+        returns the connection of the unit (checks it out if needed) and a new cursor
+        """
+        if self.connection is None:
+            self.connection = pool.getconn()
+            db.managed_connections[id(self.connection)] = False
+        self.borrowers += 1
+        return self.connection, self.connection.cursor()
+
+    def release(self):
+        """
+        ends the transaction once every borrower released the connection
+        """
+        self.borrowers -= 1
+        if self.borrowers <= 0:
+            self._finish(failed=False)
+
+    def _finish(self, failed: bool):
+        """
+        commits or rolls back the transaction and returns the connection to the pool
+        """
+        conn = self.connection
+        self.connection = None
+        self.borrowers = 0
+        failed = db.managed_connections.pop(id(conn), False) or failed
+        try:
+            if not conn.closed:
+                if failed:
+                    conn.rollback()
+                else:
+                    conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn)
+
+def unit_of_work() -> UnitOfWork:
+    """
+    creates a unit of work, usable as decorator or with statement \n
+    example: \n
+    @app.route(...) \n
+    @unit_of_work() \n
+    def route(): ...
+    """
+    return UnitOfWork()
 
 def get_conn_cursor() -> tuple[connection, cursor]:
     """
-    gets a connection and a cursor from the connection pool
+    gets a connection and a cursor from the connection pool \n
+    inside a unit of work the connection of the unit is returned \n
+    blocks until a connection is free, raises PoolError after the pool timeout
     """
+    units = _active_units()
+    if units:
+        return units[-1].borrow()
     conn = pool.getconn()
     cursor = conn.cursor()
     return conn, cursor
 
-def close_conn_cursor(connection: connection, cursor: cursor):
+def get_read_conn_cursor() -> tuple[connection, cursor]:
+    """
+    gets a read only autocommit connection and a cursor from the read pool \n
+    only for queries that don't modify data, no commit or rollback is sent for them
+    """
+    conn = read_pool.getconn()
+    units = _active_units()
+    if units:
+        units[-1].read_connections.append(conn)
+    return conn, conn.cursor()
+
+def close_conn_cursor(connection: connection, cursor: cursor, failed: bool = False):
+    """
+    closes the cursor and returns the connection to the pool \n
+    inside a unit of work the transaction of the unit is committed instead, or rolled back if failed (the request
+    answers with an error, so none of its writes are kept) \n
+    calling it twice for the same connection is safe
+    """
+    if not cursor.closed:
+        if failed and not connection.closed:
+            db.abort(cursor)
+        cursor.close()
+    if read_pool.owns(connection):
+        for unit in _active_units():
+            if connection in unit.read_connections:
+                unit.read_connections.remove(connection)
+        read_pool.putconn(connection)
+        return
+    for unit in reversed(_active_units()):
+        if unit.connection is connection:
+            unit.release()
+            return
+    pool.putconn(connection)
+
+def get_pool_metrics() -> dict:
     """
-    closes the cursor and returns the connection to the pool
+    returns the metrics of the connection pools
     """
-    cursor.close()
-    pool.putconn(connection)
\ No newline at end of file
+    return {"pool": pool.metrics(), "read_pool": read_pool.metrics()}
@@ -1,11 +1,13 @@
-from collections.abc import Callable
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
 from enum import Enum
 import os
+import uuid
 from typing import Any, Literal, overload
 
 from dotenv import load_dotenv
 import psycopg2 as pg
-from psycopg2.extensions import connection, cursor
+from psycopg2.extensions import TRANSACTION_STATUS_INERROR, connection, cursor
 
 from packages.backend.sql_connection.common_types import (
     GenericError,
@@ -13,6 +15,7 @@ from packages.backend.sql_connection.common_types import (
     MultipleSuccess,
     MultipleTupleSuccess,
     SingleSuccess,
+    StreamSuccess,
 )
 
 load_dotenv()
@@ -22,6 +25,7 @@ PASSWORD = os.getenv("PASSWORD")
 HOST = os.getenv("HOST") # localhost
 PORT = os.getenv("PORT") # 5432
 DBNAME = os.getenv("DBNAME") # stueble_data
+STREAM_ITERSIZE = int(os.getenv("STREAM_ITERSIZE", "2000")) # rows fetched per round trip by stream_query
 
 class ANSWER_TYPE(Enum):
     NO_ANSWER = -1
@@ -31,6 +35,88 @@ class ANSWER_TYPE(Enum):
 def is_valid_answer_type(value):
     return value in ANSWER_TYPE._value2member_map_
 
+# connections whose transaction is controlled by a unit of work (see conn_cursor_functions.unit_of_work)
+# id(connection) -> whether the transaction was aborted, in which case the whole unit is rolled back
+managed_connections: dict[int, bool] = {}
+
+@contextmanager
+def savepoint(cursor: cursor):
+    """
+    runs the statements of a helper inside a savepoint if the connection belongs to a unit of work \n
+    a failing statement only rolls back to the savepoint, so the transaction stays usable for the rest of the request
+    and its earlier writes are kept, the exception is raised again
+
+    Parameters:
+        cursor (cursor): cursor to interact with db
+    """
+    if id(cursor.connection) not in managed_connections:
+        yield
+        return
+    cursor.execute("SAVEPOINT helper_statement")
+    try:
+        yield
+    except Exception:
+        cursor.execute("ROLLBACK TO SAVEPOINT helper_statement")
+        raise
+    cursor.execute("RELEASE SAVEPOINT helper_statement")
+
+def commit(cursor: cursor):
+    """
+    commits the current transaction \n
+    inside a unit of work or on an autocommit connection nothing happens, the unit commits once when it ends
+
+    Parameters:
+        cursor (cursor): cursor to interact with db
+    """
+    if id(cursor.connection) in managed_connections or cursor.connection.autocommit:
+        return
+    cursor.connection.commit()
+
+def rollback(cursor: cursor):
+    """
+    rolls back the current transaction \n
+    inside a unit of work the failed statement was already rolled back to its savepoint, only if the transaction is
+    aborted anyway (a statement outside of a savepoint failed) the unit is marked as failed and rolled back as a whole
+
+    Parameters:
+        cursor (cursor): cursor to interact with db
+    """
+    if id(cursor.connection) in managed_connections:
+        if cursor.connection.info.transaction_status == TRANSACTION_STATUS_INERROR:
+            managed_connections[id(cursor.connection)] = True
+        return
+    if cursor.connection.autocommit:
+        return
+    cursor.connection.rollback()
+
+def abort(cursor: cursor):
+    """
+    discards the writes of the current transaction, e.g. when an operation fails after some of its statements succeeded \n
+    inside a unit of work the unit is marked as failed and rolled back as a whole when it ends
+
+    Parameters:
+        cursor (cursor): cursor to interact with db
+    """
+    if id(cursor.connection) in managed_connections:
+        managed_connections[id(cursor.connection)] = True
+        return
+    if cursor.connection.autocommit:
+        return
+    cursor.connection.rollback()
+
+def is_read_only_query(query: str) -> bool:
+    """
+    returns whether a query only reads data, leading whitespace and parentheses are ignored \n
+    queries starting with WITH are not considered read only, since a CTE can modify data
+
+    Parameters:
+        query (str): query to check
+    Returns:
+        bool: True if the query starts with SELECT, SHOW or VALUES
+    """
+    statement = query.lstrip().lstrip("(").lstrip().split(None, 1)
+    return len(statement) > 0 and statement[0].upper() in ("SELECT", "SHOW", "VALUES")
+
 def full_pack(func: Callable[..., Any]):
     """
     full_pack \n
@@ -131,12 +217,13 @@ def read_table(cursor: cursor, table_name: str, expect_single_answer: bool = Fal
         query += f" WHERE {' AND '.join([f'{key} {'!' if value_data['negated'] is True else ''}= %s' for key, value_data in all_conditions.items()])}"
         if order_by is not None:
             query += f" ORDER BY {order_by[0]} {'ASC' if order_by[1] == 1 else 'DESC'}"
-        cursor.execute(query, tuple([i["value"] for i in all_conditions.values()]))
-        if expect_single_answer:
-            data = cursor.fetchone()
-            return {"success": True, "data": data}
+        with savepoint(cursor):
+            cursor.execute(query, tuple([i["value"] for i in all_conditions.values()]))
+            if expect_single_answer:
+                data = cursor.fetchone()
+                return {"success": True, "data": data}
 
-        return {"success": True, "data": [list(i) for i in cursor.fetchall()]}
+            return {"success": True, "data": [list(i) for i in cursor.fetchall()]}
 
     if select_max_of_key != "":
         query += f" WHERE {select_max_of_key} = (SELECT MAX({select_max_of_key}) FROM {table_name}) LIMIT 1"
@@ -147,16 +234,17 @@ def read_table(cursor: cursor, table_name: str, expect_single_answer: bool = Fal
         if order_by is not None:
             query += f" ORDER BY {order_by[0]} {'ASC' if order_by[1] == 1 else 'DESC'}"
 
-    if variables is None:
-        cursor.execute(query)
-    else:
-        cursor.execute(query, variables)
+    with savepoint(cursor):
+        if variables is None:
+            cursor.execute(query)
+        else:
+            cursor.execute(query, variables)
 
-    if expect_single_answer:
-        data = cursor.fetchone()
-        return {"success": True, "data": data}
+        if expect_single_answer:
+            data = cursor.fetchone()
+            return {"success": True, "data": data}
 
-    return {"success": True, "data": [list(i) for i in cursor.fetchall()]}
+        return {"success": True, "data": [list(i) for i in cursor.fetchall()]}
 
 @overload
 def insert_table(cursor: cursor, table_name: str, returning_column: None = None,
@@ -204,15 +292,16 @@ def insert_table(cursor: cursor, table_name: str, returning_column: str | None =
         if returning_column != None:
             query += f" RETURNING {returning_column}"
 
-        cursor.execute(query, vals)
-        cursor.connection.commit()
+        with savepoint(cursor):
+            cursor.execute(query, vals)
+            data = cursor.fetchone() if returning_column != None else None
+        commit(cursor)
 
         if returning_column != None:
-            data = cursor.fetchone()
             return {"success": True, "data": data}
         return {"success": True}
     except Exception as e:
-        cursor.connection.rollback()
+        rollback(cursor)
         return {"success": False, "error": e}
 
 @overload
@@ -263,14 +352,15 @@ def update_table(cursor: cursor, table_name: str, returning_column: str | None =
             query += f""" WHERE {' AND '.join(key + " = %s" for _, key in enumerate(conditions))}"""
         if returning_column != None:
             query += f" RETURNING {returning_column}"
-        cursor.execute(query, list(arguments.values()) + list(conditions.values()))
-        cursor.connection.commit()
+        with savepoint(cursor):
+            cursor.execute(query, list(arguments.values()) + list(conditions.values()))
+            data = cursor.fetchone() if returning_column != None else None
+        commit(cursor)
         if returning_column != None:
-            data = cursor.fetchone()
             return {"success": True, "data": data}
         return {"success": True}
     except Exception as e:
-        cursor.connection.rollback()
+        rollback(cursor)
         return {"success": False, "error": e}
 
 @overload
@@ -305,30 +395,31 @@ def remove_table(cursor: cursor, table_name: str, conditions: dict[str, Any],
                     WHERE {' AND '.join(key + " = %s" for _, key in enumerate(conditions))}"""
         if returning_column != None:
             query += f" RETURNING {returning_column}"
-        cursor.execute(query, list(conditions.values()))
-        cursor.connection.commit()
+        with savepoint(cursor):
+            cursor.execute(query, list(conditions.values()))
+            data = cursor.fetchone() if returning_column != None else None
+        commit(cursor)
         if returning_column != None:
-            data = cursor.fetchone()
             return {"success": True, "data": data}
         return {"success": True}
     except Exception as e:
-        cursor.connection.rollback()
+        rollback(cursor)
         return {"success": False, "error": e}
 
 @overload
 def custom_call(cursor: cursor, query: str, type_of_answer: Literal[ANSWER_TYPE.NO_ANSWER],
-                variables: list[Any] | tuple[Any] | None = None) -> GenericSuccess | GenericError: ...
+                variables: list[Any] | tuple[Any] | None = None, read_only: bool | None = None) -> GenericSuccess | GenericError: ...
 
 @overload
 def custom_call(cursor: cursor, query: str, type_of_answer: Literal[ANSWER_TYPE.SINGLE_ANSWER],
-                variables: list[Any] | tuple[Any] | None = None) -> SingleSuccess | GenericError: ...
+                variables: list[Any] | tuple[Any] | None = None, read_only: bool | None = None) -> SingleSuccess | GenericError: ...
 
 @overload
 def custom_call(cursor: cursor, query: str, type_of_answer: Literal[ANSWER_TYPE.LIST_ANSWER],
-                variables: list[Any] | tuple[Any] | None = None) -> MultipleTupleSuccess | GenericError: ...
+                variables: list[Any] | tuple[Any] | None = None, read_only: bool | None = None) -> MultipleTupleSuccess | GenericError: ...
 
 def custom_call(cursor: cursor, query: str, type_of_answer: ANSWER_TYPE, 
-                variables: list[Any] | tuple[Any] | None = None) -> GenericSuccess | SingleSuccess | MultipleTupleSuccess | GenericError:
+                variables: list[Any] | tuple[Any] | None = None, read_only: bool | None = None) -> GenericSuccess | SingleSuccess | MultipleTupleSuccess | GenericError:
     """
     send a custom query to the database
 
@@ -337,29 +428,102 @@ def custom_call(cursor: cursor, query: str, type_of_answer: ANSWER_TYPE,
         query (str):
         type_of_answer (ANSWER_TYPE): what answer to expect
         variables (list | None): list of variables that should be passed into the query
+        read_only (bool | None): whether the query only reads data and doesn't need a commit, detected from the query if None
     Returns:
         dict
     """
+    if read_only is None:
+        read_only = is_read_only_query(query)
     try:
-        cursor.execute(query, variables)
+        with savepoint(cursor):
+            cursor.execute(query, variables)
+            if type_of_answer == ANSWER_TYPE.SINGLE_ANSWER:
+                data = cursor.fetchone()
+            elif type_of_answer == ANSWER_TYPE.LIST_ANSWER:
+                data = cursor.fetchall()
 
-        # Always commit (TODO: Filter SELECT statements)
-        if query.startswith("SELECT") is False:
-            cursor.connection.commit()
+        if read_only is False:
+            commit(cursor)
 
         if type_of_answer == ANSWER_TYPE.NO_ANSWER:
             return {"success": True}
-        elif type_of_answer == ANSWER_TYPE.SINGLE_ANSWER:
-            return {"success": True, "data": cursor.fetchone()}
-        elif type_of_answer == ANSWER_TYPE.LIST_ANSWER:
-            return {"success": True, "data": cursor.fetchall()}
+        elif type_of_answer in (ANSWER_TYPE.SINGLE_ANSWER, ANSWER_TYPE.LIST_ANSWER):
+            return {"success": True, "data": data}
         else:
             # would usually be better to check at the beginning, but since code is used backend, function is mostly used correctly. Therefore, it is more effective to check at the end if no other case matches
             return {"success": False, "error": "parameter type_of_answer of the function must be of enum type ANSWER_TYPE"}
     except Exception as e:
-        cursor.connection.rollback()
+        rollback(cursor)
         return {"success": False, "error": e}
 
+def _iterate_named_cursor(named_cursor: cursor) -> Iterator[tuple]:
+    """
+    yields the rows of a named cursor, itersize rows are fetched per round trip \n
+    the cursor is closed once the generator is exhausted or discarded
+    """
+    try:
+        for row in named_cursor:
+            yield row
+    finally:
+        if not named_cursor.closed:
+            named_cursor.close()
+
+def stream_query(cursor: cursor, query: str, variables: list[Any] | tuple[Any] | None = None,
+                 itersize: int = STREAM_ITERSIZE) -> StreamSuccess | GenericError:
+    """
+    runs a read query with a server side (named) cursor, rows are only fetched while iterating \n
+    on autocommit connections the cursor is declared WITH HOLD, so the result is kept server side after the implicit commit \n
+    the rows must be consumed before the connection is returned to the pool
+
+    Parameters:
+        cursor (cursor): cursor to interact with db, only its connection is used
+        query (str): query to run
+        variables (list | None): list of variables that should be passed into the query
+        itersize (int): number of rows fetched per round trip
+    Returns:
+        dict: {"success": True, "data": generator of tuples}, {"success": False, "error": e} if error occurred
+    """
+    connection = cursor.connection
+    named_cursor = connection.cursor(name=f"stream_{uuid.uuid4().hex}", withhold=connection.autocommit)
+    named_cursor.itersize = itersize
+    try:
+        with savepoint(cursor):
+            named_cursor.execute(query, variables)
+    except Exception as e:
+        if not named_cursor.closed:
+            try:
+                named_cursor.close()
+            except Exception:
+                pass
+        rollback(cursor)
+        return {"success": False, "error": e}
+    return {"success": True, "data": _iterate_named_cursor(named_cursor)}
+
+def stream_table(cursor: cursor, table_name: str, keywords: tuple[str] | list[str] = ("*",),
+                 conditions: dict[str, Any] | None = None, order_by: tuple[str, Literal[0, 1]] | None = None,
+                 itersize: int = STREAM_ITERSIZE) -> StreamSuccess | GenericError:
+    """
+    stream_table \n
+    like read_table with expect_single_answer=False, but returns a generator of tuples instead of a list
+
+    Parameters:
+        cursor (cursor): cursor to interact with db
+        table_name (str): table to read from
+        keywords (tuple[str] | list[str]): columns, that should be selected
+        conditions (dict): under which conditions (key: column, value: value) values should be selected, if empty, no conditions
+        order_by (tuple | None): (key to order by, 0: descending / 1: ascending) by default no ordering
+        itersize (int): number of rows fetched per round trip
+    Returns:
+        dict: {"success": True, "data": generator of tuples}, {"success": False, "error": e} if error occurred
+    """
+    conditions = {} if conditions is None else conditions
+    query = f"""SELECT {', '.join(keywords)} FROM {table_name}"""
+    if len(conditions) > 0:
+        query += " WHERE " + " AND ".join(key + " = %s" for key in conditions)
+    if order_by is not None:
+        query += f" ORDER BY {order_by[0]} {'ASC' if order_by[1] == 1 else 'DESC'}"
+    return stream_query(cursor=cursor, query=query, variables=tuple(conditions.values()), itersize=itersize)
+
 # TODO can only return success True right now
 # @catch_exception
 def get_time(cursor: cursor) -> SingleSuccess:
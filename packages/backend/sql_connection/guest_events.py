@@ -1,9 +1,12 @@
-from datetime import datetime
-from typing import Annotated, Literal, TypedDict
+from datetime import datetime, timezone
+from typing import Annotated, Any, Literal, TypedDict
 import uuid
 
+from psycopg2 import DatabaseError
 from psycopg2.extensions import cursor
+from psycopg2.extras import execute_values
 
+from packages.backend import hash_pwd as hp
 from packages.backend.data_types import EventType
 from packages.backend.data_types import FrontendUserRole
 from packages.backend.sql_connection import database as db
@@ -32,6 +35,35 @@ class GuestListSuccess(TypedDict):
     success: Literal[True]
     data: list[GuestListData]
 
+class CheckInData(TypedDict):
+    first_name: str
+    last_name: str
+    room: int | None
+    residence: str | None
+    extern: bool
+    session_ids: list[str]
+
+class CheckInSuccess(TypedDict):
+    success: Literal[True]
+    data: CheckInData
+
+class ScanResult(TypedDict, total=False):
+    id: str
+    scannedAt: Any
+    code: int
+    message: str
+
+class CheckInBatchData(TypedDict):
+    results: list[ScanResult]
+    guests: list[dict[str, Any]]
+    session_ids: dict[str, list[str]]
+
+class CheckInBatchSuccess(TypedDict):
+    success: Literal[True]
+    data: CheckInBatchData
+
+MAX_BATCH_SCANS = 500
+
 def change_guest(cursor: cursor, event_type: EventType, user_uuid: Annotated[uuid.UUID | None, "Explicit with user_id"] = None,
                  user_id: Annotated[int | None, "Explicit with user_uuid"] = None) -> SingleSuccess | GenericFailure:
     """
@@ -92,6 +124,212 @@ def change_guest(cursor: cursor, event_type: EventType, user_uuid: Annotated[uui
 
     return result
 
+def check_in(cursor: cursor, session_id: str, user_uuid: str, present: bool) -> CheckInSuccess | GenericFailure:
+    """
+    marks a guest as arrived / left in a single round trip (see check_in_guest in procedures.sql) \n
+    checks the permissions of the host, verifies the guest on arrival and inserts the event
+    Parameters:
+        cursor: cursor from connection
+        session_id (str): session id of the host
+        user_uuid (str): uuid of guest
+        present (bool): True if the guest arrives, False if the guest leaves
+    Returns:
+        dict: {"success": True, "data": {"first_name", "last_name", "room", "residence", "extern", "session_ids"}}, {"success": False, "error": e} if error occurred
+    """
+    result = db.custom_call(
+        cursor=cursor,
+        query="SELECT first_name, last_name, room, residence, extern, session_ids FROM check_in_guest(%s, %s, %s)",
+        type_of_answer=db.ANSWER_TYPE.SINGLE_ANSWER,
+        variables=[session_id, str(user_uuid), present],
+        read_only=False)
+    if result["success"] is False:
+        return error_to_failure(result)
+    if result["data"] is None:
+        return {"success": False, "error": "error occurred"}
+    keys = ["first_name", "last_name", "room", "residence", "extern", "session_ids"]
+    return {"success": True, "data": dict(zip(keys, result["data"]))}
+
+def split_error_code(error: Exception | str, default_code: int = 500) -> tuple[str, int]:
+    """
+    splits the message of an exception raised by the triggers ("message; code: 400") into message and status code
+    Parameters:
+        error (Exception | str): error to split
+        default_code (int): status code if the message doesn't contain one
+    Returns:
+        tuple: (message, status code)
+    """
+    message = str(error)
+    if "; code: " not in message:
+        return message, default_code
+    message, status_code = message.split("; code: ", 1)
+    return message, int(status_code.split("\n")[0])
+
+def check_in_batch(cursor: cursor, scans: list[dict[str, Any]]) -> CheckInBatchSuccess | GenericFailure:
+    """
+    applies an ordered list of buffered door scans in one transaction \n
+    the qr code signatures of arrivals are validated, all events are inserted with one multi-row insert (the checks of
+    event_guest_change still run for every row); if any row is rejected, the scans are applied one by one inside savepoints
+    so that every scan gets its own result \n
+    the events are recorded at the time of the scan, clamped to the day of the stueble and the current time; the times
+    are kept strictly increasing in the order of the scans and after the last event of the guest, since the triggers
+    order the events by them
+    Parameters:
+        cursor: cursor from connection
+        scans (list[dict]): [{"id": user_uuid, "present": bool, "scannedAt": unix timestamp, "qrCode": {"data": dict, "signature": str}}],
+                            qrCode is required for arrivals, scans without scannedAt are recorded at the upload
+    Returns:
+        dict: {"success": True, "data": {"results": [{"id", "scannedAt", "code", "message"}], "guests": [guest], "session_ids": {user_uuid: [session_id]}}},
+              {"success": False, "error": e} if error occurred
+    """
+    if len(scans) > MAX_BATCH_SCANS:
+        return {"success": False, "error": f"at most {MAX_BATCH_SCANS} scans can be sent at once"}
+
+    results: list[ScanResult] = []
+    valid = []
+    for index, scan in enumerate(scans):
+        if not isinstance(scan, dict):
+            results.append({"code": 400, "message": "scan must be an object"})
+            continue
+        user_uuid = scan.get("id", None)
+        present = scan.get("present", None)
+        scanned_at = scan.get("scannedAt", None)
+        results.append({"id": user_uuid, "scannedAt": scanned_at})
+        if not isinstance(user_uuid, str) or not isinstance(present, bool):
+            results[index] |= {"code": 400, "message": "id and present must be specified"}
+            continue
+        try:
+            uuid.UUID(user_uuid)
+        except ValueError:
+            results[index] |= {"code": 400, "message": "invalid id"}
+            continue
+        if scanned_at is not None:
+            try:
+                if isinstance(scanned_at, bool) or not isinstance(scanned_at, (int, float)):
+                    raise TypeError
+                scanned_at = datetime.fromtimestamp(scanned_at, tz=timezone.utc)
+            except (TypeError, ValueError, OverflowError, OSError):
+                results[index] |= {"code": 400, "message": "scannedAt must be a unix timestamp"}
+                continue
+        if present is True:
+            qr_code = scan.get("qrCode", None)
+            if (not isinstance(qr_code, dict) or not isinstance(qr_code.get("data", None), dict)
+                    or qr_code["data"].get("id", None) != user_uuid
+                    or hp.verify_signature(message=qr_code["data"], signature=qr_code.get("signature", "")) is False):
+                results[index] |= {"code": 403, "message": "invalid qr code signature"}
+                continue
+        valid.append((index, user_uuid, present, scanned_at))
+
+    if len(valid) == 0:
+        return {"success": True, "data": {"results": results, "guests": [], "session_ids": {}}}
+
+    # get stueble_id
+    result = db.read_table(
+        cursor=cursor,
+        keywords=["id", "date_of_time"],
+        table_name="stueble_motto",
+        expect_single_answer=True,
+        specific_where="date_of_time = CURRENT_DATE OR (CURRENT_TIME < '06:00:00' AND date_of_time = (CURRENT_DATE - INTERVAL '1 day' ))")
+    if result["success"] is False:
+        return error_to_failure(result)
+    if result["data"] is None:
+        return {"success": False, "error": "no stueble party found for today or yesterday"}
+    stueble_id, stueble_date = result["data"]
+
+    # get all scanned users at once
+    result = db.custom_call(
+        cursor=cursor,
+        query="""SELECT user_uuid::text, id, first_name, last_name, room, residence, user_role = 'extern'
+                 FROM users WHERE user_uuid = ANY(%s::uuid[])""",
+        type_of_answer=db.ANSWER_TYPE.LIST_ANSWER,
+        variables=[list({i[1] for i in valid})])
+    if result["success"] is False:
+        return error_to_failure(result)
+    found_users = {row[0]: row[1:] for row in result["data"]}
+
+    rows = []
+    latest_scan = None
+    for index, user_uuid, present, scanned_at in valid:
+        if user_uuid not in found_users:
+            results[index] |= {"code": 404, "message": "no user found"}
+            continue
+        # a scanner clock running backwards doesn't reorder the scans
+        if scanned_at is not None:
+            if latest_scan is not None and scanned_at < latest_scan:
+                scanned_at = latest_scan
+            latest_scan = scanned_at
+        rows.append((index, found_users[user_uuid][0], present, scanned_at))
+
+    # the scan time is clamped to [day of the stueble, now] and placed after the last event of the guest, every step
+    # keeps the order of the scans, the ordinal makes the timestamps strictly increasing
+    query = "INSERT INTO events (user_id, event_type, stueble_id, submitted) VALUES %s"
+    template = """(%s, %s::EVENT_TYPE, %s,
+                   GREATEST(LEAST(COALESCE(%s::TIMESTAMPTZ, clock_timestamp()), clock_timestamp()),
+                            %s::DATE::TIMESTAMPTZ,
+                            (SELECT MAX(submitted) FROM events WHERE stueble_id = %s AND user_id = %s) + INTERVAL '1 microsecond')
+                   + %s * INTERVAL '1 microsecond')"""
+    values = [(user_id, "arrive" if present else "leave", stueble_id, scanned_at, stueble_date, stueble_id, user_id, ordinal)
+              for ordinal, (_, user_id, present, scanned_at) in enumerate(rows)]
+    applied = []
+    try:
+        cursor.execute("SAVEPOINT check_in_batch")
+        try:
+            if len(values) > 0:
+                execute_values(cursor, query, values, template=template, page_size=len(values))
+            cursor.execute("RELEASE SAVEPOINT check_in_batch")
+            applied = rows
+        except DatabaseError:
+            # find the rejected scans
+            cursor.execute("ROLLBACK TO SAVEPOINT check_in_batch")
+            for row, value in zip(rows, values):
+                cursor.execute("SAVEPOINT check_in_scan")
+                try:
+                    execute_values(cursor, query, [value], template=template)
+                    cursor.execute("RELEASE SAVEPOINT check_in_scan")
+                    applied.append(row)
+                except DatabaseError as e:
+                    cursor.execute("ROLLBACK TO SAVEPOINT check_in_scan")
+                    message, status_code = split_error_code(e, default_code=400)
+                    results[row[0]] |= {"code": status_code, "message": message}
+
+        # verify arrived guests
+        arrived_ids = list({user_id for _, user_id, present, _ in applied if present})
+        if len(arrived_ids) > 0:
+            cursor.execute("UPDATE users SET verified = TRUE WHERE id = ANY(%s) AND verified IS NOT TRUE", (arrived_ids,))
+
+        # get the sessions of the changed guests for their stueble status
+        applied_ids = list({user_id for _, user_id, _, _ in applied})
+        session_ids: dict[str, list[str]] = {}
+        if len(applied_ids) > 0:
+            cursor.execute("""SELECT u.user_uuid::text, s.session_id::text
+                              FROM sessions s JOIN users u ON s.user_id = u.id
+                              WHERE u.id = ANY(%s)""", (applied_ids,))
+            for user_uuid, session_id in cursor.fetchall():
+                session_ids.setdefault(user_uuid, []).append(session_id)
+        db.commit(cursor)
+    except DatabaseError as e:
+        db.rollback(cursor)
+        return {"success": False, "error": str(e)}
+
+    # last state of every changed guest
+    guests = {}
+    for index, _, present, _ in applied:
+        user_uuid = scans[index]["id"]
+        _, first_name, last_name, room, residence, extern = found_users[user_uuid]
+        results[index] |= {"code": 200}
+        guest = {"id": user_uuid,
+                 "present": present,
+                 "firstName": first_name,
+                 "lastName": last_name,
+                 "extern": extern}
+        if extern is False:
+            guest["roomNumber"] = room
+            guest["residence"] = residence
+            guest["verified"] = True
+        guests.pop(user_uuid, None)
+        guests[user_uuid] = guest
+
+    return {"success": True, "data": {"results": results, "guests": list(guests.values()), "session_ids": session_ids}}
+
 def guest_list_present(cursor: cursor, stueble_id: int | None = None) -> GuestListPresentSuccess | GenericFailure:
     """
     returns list of all guests that are currently present
@@ -153,38 +391,31 @@ def guest_list(cursor: cursor, stueble_id: int | None = None) -> GuestListSucces
         stueble_info = "%s"
         parameters["variables"] = [stueble_id]
 
+    # one pass over the events of the stueble: the last add / remove (with its inviter) and the last presence event per user
     query = f"""
-SELECT 
-    first_name, 
-    last_name, 
-    user_role = 'extern' AS extern, 
-    user_uuid, 
-    verified, 
-    room, 
-    residence, 
-    COALESCE((SELECT event_type FROM events WHERE user_id = users_user_id AND event_type IN ('arrive', 'leave', 'remove') ORDER BY submitted DESC LIMIT 1), 'leave') = 'arrive' AS present, 
-    (SELECT user_uuid FROM users WHERE users.id = invited_by) AS invited_by
+SELECT
+    u.first_name,
+    u.last_name,
+    u.user_role = 'extern' AS extern,
+    u.user_uuid,
+    u.verified,
+    u.room,
+    u.residence,
+    COALESCE(last_events.presence_event, 'leave') = 'arrive' AS present,
+    inviter.user_uuid AS invited_by
 FROM (
     SELECT
-        u.id AS users_user_id,
-        u.first_name,
-        u.last_name,
-        u.user_role,
-        u.user_uuid,
-        u.verified,
-        u.room,
-        u.residence,
-        e.event_type,
-        e.submitted,
-        e.invited_by,
-        ROW_NUMBER() OVER (PARTITION BY e.user_id ORDER BY e.submitted DESC) as rn
-    FROM events e
-    LEFT JOIN users u ON e.user_id = u.id
-    WHERE e.stueble_id = {stueble_info}
-      AND e.event_type IN ('add', 'remove')
-) AS all_events
-WHERE rn = 1
-  AND event_type = 'add';
+        user_id,
+        (ARRAY_AGG(event_type ORDER BY submitted DESC, id DESC) FILTER (WHERE event_type IN ('add', 'remove')))[1] AS registration_event,
+        (ARRAY_AGG(invited_by ORDER BY submitted DESC, id DESC) FILTER (WHERE event_type IN ('add', 'remove')))[1] AS invited_by,
+        (ARRAY_AGG(event_type ORDER BY submitted DESC, id DESC) FILTER (WHERE event_type IN ('arrive', 'leave', 'remove')))[1] AS presence_event
+    FROM events
+    WHERE stueble_id = {stueble_info}
+    GROUP BY user_id
+) AS last_events
+JOIN users u ON u.id = last_events.user_id
+LEFT JOIN users inviter ON inviter.id = last_events.invited_by
+WHERE last_events.registration_event = 'add';
     """
 
     result = db.custom_call(
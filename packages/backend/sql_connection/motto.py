@@ -223,10 +223,11 @@ def update_hosts(cursor: cursor, stueble_id: str, method: Literal["add", "remove
         rows = [tuple((user_id, stueble_id) for user_id in user_ids)]
         query = """DELETE FROM hosts WHERE (user_id, stueble_id) IN %s"""
     try:
-        execute_values(cursor, query, rows)
-        cursor.connection.commit()
+        with db.savepoint(cursor):
+            execute_values(cursor, query, rows)
+        db.commit(cursor)
     except DatabaseError as e:
-        cursor.connection.rollback()
+        db.rollback(cursor)
         return {"success": False, "error": str(e)}
     return {"success": True, "data": user_ids}
 
@@ -242,10 +243,7 @@ def get_hosts(cursor: cursor, stueble_id: int) -> GetHostsSuccess | GenericFailu
     params = ["user_uuid", "first_name", "last_name", "residence"]
 
     query = f"""SELECT {', '.join(['u.' + i for i in params])} FROM hosts h JOIN users u ON u.id = h.user_id WHERE h.stueble_id = %s"""
-    result = db.custom_call(cursor=cursor, 
-                   query=query, 
-                   type_of_answer=db.ANSWER_TYPE.LIST_ANSWER, 
-                   variables=[stueble_id])
+    result = db.stream_query(cursor=cursor, query=query, variables=[stueble_id])
     if result["success"] is False:
         return error_to_failure(result)
     hosts = [dict(zip(params, host)) for host in result["data"]]
@@ -1,7 +1,13 @@
 import os
+import sys
+import threading
+import time
+import warnings
+from typing import Any, TypedDict
 
 from dotenv import load_dotenv
-from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extensions import connection
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 
 load_dotenv()
 
@@ -11,29 +17,286 @@ HOST = os.getenv("HOST") # localhost
 PORT = os.getenv("PORT") # 5432
 DBNAME = os.getenv("DBNAME") # stueble_data
 
-def create_pool(max_connections: int = 100, min_connections: int=20):
+MIN_CONNECTIONS = int(os.getenv("POOL_MIN_CONNECTIONS", "20"))
+MAX_CONNECTIONS = int(os.getenv("POOL_MAX_CONNECTIONS", "100"))
+CHECKOUT_TIMEOUT = float(os.getenv("POOL_CHECKOUT_TIMEOUT_SECONDS", "10")) # how long getconn blocks before giving up
+LONG_HOLD_SECONDS = float(os.getenv("POOL_LONG_HOLD_SECONDS", "5")) # connections held longer than this are flagged
+
+# read only pool, can be pointed at a replica
+READ_HOST = os.getenv("READ_HOST", HOST)
+READ_PORT = os.getenv("READ_PORT", PORT)
+READ_MIN_CONNECTIONS = int(os.getenv("POOL_READ_MIN_CONNECTIONS", "5"))
+READ_MAX_CONNECTIONS = int(os.getenv("POOL_READ_MAX_CONNECTIONS", "50"))
+
+# files that only pass connections through, skipped when looking for the acquiring call site
+_internal_files = {os.path.abspath(__file__)}
+
+def register_internal_file(file_name: str):
+    """
+    marks a module as connection plumbing, so that the call site of a checkout points to the caller of that module
+
+    Parameters:
+        file_name (str): __file__ of the module
+    """
+    _internal_files.add(os.path.abspath(file_name))
+
+def _call_site() -> str:
+    """
+    returns "file:line in function" of the first frame outside of the connection plumbing
+    """
+    frame = sys._getframe(1)
+    while frame is not None and os.path.abspath(frame.f_code.co_filename) in _internal_files:
+        frame = frame.f_back
+    if frame is None:
+        return "unknown"
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} in {frame.f_code.co_name}"
+
+class PooledConnection(connection):
+    """
+    connection of an InstrumentedPool, remembers whether on_connect ran for it \n
+    the flag lives on the connection itself, ThreadedConnectionPool closes surplus connections in putconn and ids of
+    closed connections are reused
+    """
+    initialized = False
+
+class HeldConnection(TypedDict):
+    call_site: str
+    held_seconds: float
+
+class PoolMetrics(TypedDict):
+    name: str
+    min_connections: int
+    max_connections: int
+    in_use: int
+    checkouts: int
+    timeouts: int
+    long_holds: int
+    wait_seconds_total: float
+    wait_seconds_max: float
+    hold_seconds_total: float
+    hold_seconds_max: float
+    held_too_long: list[HeldConnection]
+
+class InstrumentedPool:
+    """
+    wrapper around psycopg2's ThreadedConnectionPool \n
+    - getconn blocks up to timeout seconds instead of raising once the pool is exhausted
+    - records wait time and checkout duration for every connection
+    - connections held longer than long_hold_seconds are flagged together with the call site that acquired them
+    - the underlying pool is created on the first checkout, min_connections are opened in a background thread
+    """
+
+    def __init__(self, name: str, min_connections: int, max_connections: int, timeout: float,
+                 long_hold_seconds: float, on_connect=None, **connection_kwargs: Any):
+        """
+        Parameters:
+            name (str): name of the pool, used in warnings and metrics
+            min_connections (int): number of idle connections that are kept open
+            max_connections (int): maximum number of connections
+            timeout (float): seconds getconn waits for a free connection before raising PoolError
+            long_hold_seconds (float): checkouts longer than this are reported
+            on_connect (callable | None): called once with every newly opened connection (e.g. to set session parameters)
+            connection_kwargs: user, password, host, port, database, connection_factory (a PooledConnection subclass)
+        """
+        self.name = name
+        self.min_connections = min(min_connections, max_connections)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.long_hold_seconds = long_hold_seconds
+        self.on_connect = on_connect
+        self.connection_kwargs = connection_kwargs
+
+        self._pool: ThreadedConnectionPool | None = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._metrics_lock = threading.Lock()
+
+        # id(conn) -> (checkout time, call site)
+        self._checked_out: dict[int, tuple[float, str]] = {}
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._long_holds = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._hold_total = 0.0
+        self._hold_max = 0.0
+
+    def _get_pool(self) -> ThreadedConnectionPool:
+        """
+        creates the underlying pool on first use, without opening any connection synchronously
+        """
+        if self._pool is not None:
+            return self._pool
+        with self._pool_lock:
+            if self._pool is None:
+                connection_pool = ThreadedConnectionPool(minconn=0, maxconn=self.max_connections, **self.connection_kwargs)
+                if not connection_pool:
+                    raise Exception("Creation of connection pool failed")
+                # idle connections up to minconn are kept when returned
+                connection_pool.minconn = self.min_connections
+                self._pool = connection_pool
+                threading.Thread(target=self._warm_up, name=f"{self.name}-pool-warm-up", daemon=True).start()
+        return self._pool
+
+    def _warm_up(self):
+        """
+        opens min_connections in the background, stops early if requests already need the slots
+        """
+        connections = []
+        try:
+            for _ in range(self.min_connections):
+                if not self._slots.acquire(blocking=False):
+                    break
+                try:
+                    connections.append(self._open(self._pool))
+                except Exception as e:
+                    self._slots.release()
+                    warnings.warn(f"Warm-up of connection pool {self.name} failed: {e}")
+                    break
+        finally:
+            for conn in connections:
+                self._pool.putconn(conn)
+                self._slots.release()
+
+    def _open(self, connection_pool: ThreadedConnectionPool) -> connection:
+        """
+        gets a connection from the underlying pool and initializes it if it is new
+        """
+        conn = connection_pool.getconn()
+        if not conn.initialized:
+            if self.on_connect is not None:
+                self.on_connect(conn)
+            conn.initialized = True
+        return conn
+
+    def getconn(self) -> connection:
+        """
+        checks out a connection, blocks up to self.timeout seconds if all connections are in use
+
+        Returns:
+            connection: connection to the database
+        """
+        connection_pool = self._get_pool()
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._metrics_lock:
+                self._timeouts += 1
+            raise PoolError(f"connection pool {self.name} exhausted, waited {self.timeout}s for a free connection")
+        try:
+            conn = self._open(connection_pool)
+        except Exception:
+            self._slots.release()
+            raise
+        now = time.monotonic()
+        waited = now - start
+        with self._metrics_lock:
+            self._checked_out[id(conn)] = (now, _call_site())
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def putconn(self, conn: connection, close: bool = False):
+        """
+        returns a connection to the pool, returning an already returned connection is a no-op
+
+        Parameters:
+            conn (connection): connection to return
+            close (bool): whether to close the connection instead of keeping it
+        """
+        with self._metrics_lock:
+            checkout = self._checked_out.pop(id(conn), None)
+            if checkout is None:
+                return
+            held = time.monotonic() - checkout[0]
+            self._hold_total += held
+            self._hold_max = max(self._hold_max, held)
+            if held > self.long_hold_seconds:
+                self._long_holds += 1
+        try:
+            self._get_pool().putconn(conn, close=close)
+        finally:
+            self._slots.release()
+        if held > self.long_hold_seconds:
+            warnings.warn(f"Connection of pool {self.name} was held for {held:.2f}s, acquired at {checkout[1]}")
+
+    def owns(self, conn: connection) -> bool:
+        """
+        returns whether the connection is currently checked out from this pool
+        """
+        return id(conn) in self._checked_out
+
+    def held_too_long(self) -> list[HeldConnection]:
+        """
+        returns all connections that are currently held longer than long_hold_seconds
+
+        Returns:
+            list: [{"call_site": str, "held_seconds": float}]
+        """
+        now = time.monotonic()
+        with self._metrics_lock:
+            checked_out = list(self._checked_out.values())
+        return [{"call_site": call_site, "held_seconds": round(now - start, 3)}
+                for start, call_site in checked_out if now - start > self.long_hold_seconds]
+
+    def metrics(self) -> PoolMetrics:
+        """
+        returns the collected metrics of the pool
+        """
+        with self._metrics_lock:
+            metrics = {
+                "name": self.name,
+                "min_connections": self.min_connections,
+                "max_connections": self.max_connections,
+                "in_use": len(self._checked_out),
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "long_holds": self._long_holds,
+                "wait_seconds_total": round(self._wait_total, 6),
+                "wait_seconds_max": round(self._wait_max, 6),
+                "hold_seconds_total": round(self._hold_total, 6),
+                "hold_seconds_max": round(self._hold_max, 6)}
+        metrics["held_too_long"] = self.held_too_long()
+        return metrics
+
+    def closeall(self):
+        """
+        closes all connections of the pool
+        """
+        if self._pool is not None:
+            self._pool.closeall()
+
+def create_pool(max_connections: int = MAX_CONNECTIONS, min_connections: int = MIN_CONNECTIONS, name: str = "primary", **kwargs) -> InstrumentedPool:
     """
     create_pool \n
-    creates a thread pool safely
+    creates a thread pool safely, no connection is opened until the first checkout
 
     Parameters:
-    max_connections (int): maximum number of connections
-    min_connections (int): minimum number of connections
+        max_connections (int): maximum number of connections
+        min_connections (int): minimum number of connections
+        name (str): name of the pool
+        kwargs: overrides for InstrumentedPool (timeout, long_hold_seconds, on_connect) and the connection parameters
     Returns:
         connection_pool:connection_pool
     """
-    connection_pool = ThreadedConnectionPool(
-        minconn=min_connections,
-        maxconn=max_connections,
-        user=USER,
-        password=PASSWORD,
-        host=HOST,
-        port=PORT,
-        database=DBNAME
-    )
-
-    if not connection_pool:
-        raise Exception("Creation of connection pool failed")
-    return connection_pool
-
-pool = create_pool()
\ No newline at end of file
+    parameters = {
+        "timeout": CHECKOUT_TIMEOUT,
+        "long_hold_seconds": LONG_HOLD_SECONDS,
+        "user": USER,
+        "password": PASSWORD,
+        "host": HOST,
+        "port": PORT,
+        "database": DBNAME,
+        "connection_factory": PooledConnection} | kwargs
+    return InstrumentedPool(name=name, min_connections=min_connections, max_connections=max_connections, **parameters)
+
+def _set_read_only(conn: connection):
+    """
+    read only connections don't open transactions, so no commit or rollback is ever sent
+    """
+    conn.set_session(readonly=True, autocommit=True)
+
+pool = create_pool()
+read_pool = create_pool(max_connections=READ_MAX_CONNECTIONS, min_connections=READ_MIN_CONNECTIONS, name="read",
+                        host=READ_HOST, port=READ_PORT, on_connect=_set_read_only)
@@ -0,0 +1,133 @@
+import base64
+import binascii
+import json
+import re
+from typing import Literal, TypedDict
+
+from psycopg2.extensions import cursor
+
+from packages.backend.sql_connection import database as db
+from packages.backend.sql_connection.common_types import GenericFailure, error_to_failure
+
+# hard cap of returned users per page, no matter what the client requests
+MAX_RESULTS = 50
+DEFAULT_RESULTS = 20
+TYPEAHEAD_RESULTS = 10 # suggestions of the resident directory
+
+# the expressions have to match the indexes in create_tables.sql, otherwise they can't be used
+FULL_NAME = "lower(first_name || ' ' || last_name)"
+SEARCH_VECTOR = "to_tsvector('simple', first_name || ' ' || last_name || ' ' || COALESCE(user_name, ''))"
+
+class SearchUser(TypedDict):
+    firstName: str
+    lastName: str
+    id: str
+    residence: str | None
+
+class SearchPage(TypedDict):
+    users: list[SearchUser]
+    nextCursor: str | None
+
+class SearchSuccess(TypedDict):
+    success: Literal[True]
+    data: SearchPage
+
+def clamp_limit(limit: int | None, default: int = DEFAULT_RESULTS) -> int:
+    """
+    returns the page size, at least 1 and at most MAX_RESULTS
+    """
+    if limit is None:
+        return default
+    return max(1, min(limit, MAX_RESULTS))
+
+def encode_cursor(rank: float, user_uuid: str) -> str:
+    """
+    encodes the position of the last user of a page as opaque cursor
+    """
+    return base64.urlsafe_b64encode(json.dumps([rank, str(user_uuid)]).encode("utf-8")).decode("ascii")
+
+def decode_cursor(page_cursor: str) -> tuple[float, str] | None:
+    """
+    decodes a cursor of encode_cursor, returns None if it is invalid
+    """
+    try:
+        rank, user_uuid = json.loads(base64.urlsafe_b64decode(page_cursor.encode("ascii")))
+    except (ValueError, TypeError, binascii.Error):
+        return None
+    if not isinstance(rank, (int, float)) or not isinstance(user_uuid, str):
+        return None
+    return float(rank), user_uuid
+
+def to_search_user(row: tuple) -> SearchUser:
+    return {"firstName": row[0], "lastName": row[1], "id": row[2], "residence": row[3]}
+
+def search_users(cursor: cursor, query: str, limit: int | None = None, page_cursor: str | None = None) -> SearchSuccess | GenericFailure:
+    """
+    ranked search over names and user names of all residents (not extern) \n
+    matches by trigram word similarity (typos, partial names) and by word prefixes, exact word matches are ranked first \n
+    pages are continued with keyset pagination, nextCursor is None on the last page
+
+    Parameters:
+        cursor: cursor for the connection
+        query (str): search text
+        limit (int | None): page size, capped at MAX_RESULTS
+        page_cursor (str | None): nextCursor of the previous page
+    Returns:
+        dict: {"success": True, "data": {"users": [...], "nextCursor": str | None}}, {"success": False, "error": e} if error occurred
+    """
+    text = " ".join(query.lower().split())
+    if text == "":
+        return {"success": False, "error": "the search query must not be empty"}
+    limit = clamp_limit(limit)
+
+    # prefix query of every word, e.g. "max mu" -> "max:* & mu:*"
+    words = re.findall(r"\w+", text)
+    ts_query = " & ".join(f"{word}:*" for word in words)
+
+    rank = f"GREATEST(word_similarity(%s, {FULL_NAME}), word_similarity(%s, lower(COALESCE(user_name, ''))))"
+    rank_variables = [text, text]
+    match = f"(%s <% {FULL_NAME} OR %s <% lower(user_name)"
+    match_variables = [text, text]
+    if ts_query != "":
+        rank = f"{rank} + CASE WHEN {SEARCH_VECTOR} @@ to_tsquery('simple', %s) THEN 1 ELSE 0 END"
+        rank_variables.append(ts_query)
+        match = f"{match} OR {SEARCH_VECTOR} @@ to_tsquery('simple', %s)"
+        match_variables.append(ts_query)
+    match = f"{match})"
+
+    keyset = ""
+    keyset_variables = []
+    if page_cursor is not None:
+        position = decode_cursor(page_cursor)
+        if position is None:
+            return {"success": False, "error": "invalid cursor"}
+        keyset = "WHERE (rank, user_uuid) < (%s, %s::uuid)"
+        keyset_variables = list(position)
+
+    # % of the pg_trgm operators has to be escaped for psycopg2
+    sql = f"""
+    SELECT first_name, last_name, user_uuid, residence, rank FROM (
+        SELECT first_name, last_name, user_uuid, residence, ({rank})::float8 AS rank
+        FROM users
+        WHERE user_role != 'extern' AND {match.replace('<%', '<%%')}
+    ) AS matches
+    {keyset}
+    ORDER BY rank DESC, user_uuid DESC
+    LIMIT %s
+    """
+    result = db.custom_call(
+        cursor=cursor,
+        query=sql,
+        type_of_answer=db.ANSWER_TYPE.LIST_ANSWER,
+        variables=rank_variables + match_variables + keyset_variables + [limit + 1],
+        read_only=True)
+    if result["success"] is False:
+        return error_to_failure(result)
+
+    rows = result["data"]
+    next_cursor = None
+    # one more row than requested tells whether there is another page
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rank=rows[-1][4], user_uuid=rows[-1][2])
+    return {"success": True, "data": {"users": [to_search_user(row) for row in rows], "nextCursor": next_cursor}}
@@ -23,6 +23,10 @@ class GetSessionSuccess(TypedDict):
     success: Literal[True]
     data: tuple[str, datetime]
 
+class GetSessionUserSuccess(TypedDict):
+    success: Literal[True]
+    data: tuple[int, str, str, datetime]
+
 class GetUserSuccess(TypedDict):
     success: Literal[True]
     data: tuple[int, UserRole, str]
@@ -100,6 +104,31 @@ def get_session(cursor: cursor, session_id: str) -> GetSessionSuccess | GenericF
 
     return cast(GetSessionSuccess, cast(object, result))
 
+def get_session_user(cursor: cursor, session_id: str) -> GetSessionUserSuccess | GenericFailure:
+    """
+    gets the user of a session, that didn't expire yet, together with the expiration date in one query
+    Parameters:
+        cursor: cursor for the connection
+        session_id (str): id of the session
+    Returns:
+        dict: {"success": bool, "data": (user_id, user_uuid, user_role, expiration_date)}, {"success": False, "error": e} if error occurred
+    """
+
+    result = db.read_table(
+        cursor=cursor,
+        keywords=["u.id", "u.user_uuid", "u.user_role", "s.expiration_date"],
+        table_name="sessions s JOIN users u ON s.user_id = u.id",
+        expect_single_answer=True,
+        specific_where="s.session_id = %s AND s.expiration_date > NOW()",
+        variables=[session_id]
+        )
+    if result["success"] is False:
+        return error_to_failure(result)
+    if result["data"] is None:
+        return {"success": False, "error": "no session found"}
+
+    return cast(GetSessionUserSuccess, cast(object, result))
+
 def remove_session(cursor: cursor, session_id: str) -> GenericSuccess | GenericFailure:
     """
     removes a session from the table sessions
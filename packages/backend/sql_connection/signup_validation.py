@@ -4,12 +4,7 @@ from psycopg2.extensions import cursor
 
 from packages.backend.data_types import Email, Residence, UserRole
 from packages.backend.sql_connection import database as db
-from packages.backend.sql_connection.common_types import error_to_failure
-
-class FailureWithStatus(TypedDict):
-    success: Literal[False]
-    error: str
-    status: int
+from packages.backend.sql_connection.common_types import FailureWithStatus, error_to_failure
 
 class SuccessWithStatus(TypedDict):
     success: Literal[True]
@@ -58,7 +53,9 @@ def validate_user_data(cursor: cursor,
     if not isinstance(email, Email):
         return {"success": False, "error": "Invalid email format, must be of type Email", "status": 400}
 
-    query = """SELECT email, user_name, room, residence FROM users WHERE email = %s OR user_name = %s OR (room = %s AND residence = %s);"""
+    # queried in the transaction of the signup, since user_name and (room, residence) have no unique constraint,
+    # the resident directory could miss a signup of the last seconds
+    query = """SELECT email, user_name, room, residence, password_hash IS NOT NULL FROM users WHERE email = %s OR user_name = %s OR (room = %s AND residence = %s);"""
     result = db.custom_call(
         cursor=cursor,
         query=query,
@@ -67,23 +64,15 @@ def validate_user_data(cursor: cursor,
 
     if result["success"] is False:
         return {**error_to_failure(result), "status": 500}
+    conflicts = result["data"]
 
-    email_list = [row[0] for row in result["data"]]
-    user_name_list = [row[1] for row in result["data"]]
-    room_residence_list = [(row[2], row[3]) for row in result["data"]]
+    email_list = [row[0] for row in conflicts]
+    user_name_list = [row[1] for row in conflicts]
+    room_residence_list = [(row[2], row[3]) for row in conflicts]
 
-    if len(result["data"]) != 0:
-        query = """SELECT email, user_name, room, residence FROM users WHERE (email = %s OR user_name = %s OR (room = %s AND residence = %s)) AND password_hash IS NOT NULL"""
-        result = db.custom_call(
-            cursor=cursor,
-            query=query,
-            variables=[email.email, user_name, room, residence.value],
-            type_of_answer=db.ANSWER_TYPE.LIST_ANSWER)
-        
-        if result["success"] is False:
-            return {**error_to_failure(result), "status": 500}
-        
-        if len(result["data"]) == 0:
+    if len(conflicts) != 0:
+        # only deleted accounts (without password) match
+        if not any(row[4] for row in conflicts):
             return {"success": True, "status": 200, "warning": "An account was already created, but deleted."}
 
         if (room, residence.value) in room_residence_list:
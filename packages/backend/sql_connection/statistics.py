@@ -0,0 +1,186 @@
+from datetime import datetime
+from typing import Literal, TypedDict
+
+from psycopg2.extensions import cursor
+
+from packages.backend.sql_connection import database as db
+from packages.backend.sql_connection.common_types import GenericFailure, error_to_failure
+
+# the rollups are maintained by collect_stats (triggers.sql) and rebuilt by rebuild_stueble_stats (procedures.sql)
+
+class RegisteredData(TypedDict):
+    intern: int
+    extern: int
+
+class PeakData(TypedDict):
+    present: int
+    at: str | None
+
+class TutorInvitesData(TypedDict):
+    id: str
+    firstName: str
+    lastName: str
+    invitees: int
+
+class BucketData(TypedDict):
+    start: str
+    arrivals: int
+    departures: int
+    maxPresent: int
+    present: int
+
+class StatsData(TypedDict):
+    stuebleId: int
+    registered: RegisteredData
+    present: int
+    peak: PeakData
+    arrivedGuests: int
+    noShowRate: float | None
+    invitesPerTutor: list[TutorInvitesData]
+    timeline: list[BucketData]
+
+class StatsSuccess(TypedDict):
+    success: Literal[True]
+    data: StatsData
+
+class OccupancyData(TypedDict):
+    stuebleId: int
+    present: int
+    registered: int
+    capacity: int | None
+
+class OccupancySuccess(TypedDict):
+    success: Literal[True]
+    data: OccupancyData
+
+class BackfillSuccess(TypedDict):
+    success: Literal[True]
+    data: list[int]
+
+def to_iso(value: datetime | None) -> str | None:
+    return value.isoformat() if value is not None else None
+
+def get_stats(cursor: cursor, stueble_id: int) -> StatsSuccess | GenericFailure:
+    """
+    returns the statistics of a stueble from its rollups \n
+    the no show rate is the share of registered guests that never arrived, None if nobody is registered
+
+    Parameters:
+        cursor: cursor for the connection
+        stueble_id (int): id of the stueble
+    Returns:
+        dict: {"success": True, "data": {...}}, {"success": False, "error": e} if error occurred
+    """
+    result = db.custom_call(
+        cursor=cursor,
+        query="""SELECT registered_intern, registered_extern, present, peak_present, peak_at, arrived_guests
+        FROM stueble_stats WHERE stueble_id = %s""",
+        type_of_answer=db.ANSWER_TYPE.SINGLE_ANSWER,
+        variables=[stueble_id],
+        read_only=True)
+    if result["success"] is False:
+        return error_to_failure(result)
+    # no row yet means no guest event for this stueble
+    registered_intern, registered_extern, present, peak_present, peak_at, arrived_guests = result["data"] or (0, 0, 0, 0, None, 0)
+
+    tutors = db.custom_call(
+        cursor=cursor,
+        query="""SELECT u.user_uuid, u.first_name, u.last_name, i.invitees
+        FROM stueble_invites i JOIN users u ON u.id = i.inviter_id
+        WHERE i.stueble_id = %s AND u.user_role = 'tutor'
+        ORDER BY i.invitees DESC, u.last_name, u.first_name""",
+        type_of_answer=db.ANSWER_TYPE.LIST_ANSWER,
+        variables=[stueble_id],
+        read_only=True)
+    if tutors["success"] is False:
+        return error_to_failure(tutors)
+
+    buckets = db.custom_call(
+        cursor=cursor,
+        query="""SELECT bucket_start, arrivals, departures, max_present, present
+        FROM stueble_stats_buckets WHERE stueble_id = %s ORDER BY bucket_start""",
+        type_of_answer=db.ANSWER_TYPE.LIST_ANSWER,
+        variables=[stueble_id],
+        read_only=True)
+    if buckets["success"] is False:
+        return error_to_failure(buckets)
+
+    registered = registered_intern + registered_extern
+    no_show_rate = None
+    if registered > 0:
+        no_show_rate = round(max(registered - arrived_guests, 0) / registered, 4)
+
+    return {"success": True,
+            "data": {
+                "stuebleId": stueble_id,
+                "registered": {"intern": registered_intern, "extern": registered_extern},
+                "present": present,
+                "peak": {"present": peak_present, "at": to_iso(peak_at)},
+                "arrivedGuests": arrived_guests,
+                "noShowRate": no_show_rate,
+                "invitesPerTutor": [{"id": str(row[0]), "firstName": row[1], "lastName": row[2], "invitees": row[3]}
+                                    for row in tutors["data"]],
+                "timeline": [{"start": to_iso(row[0]), "arrivals": row[1], "departures": row[2], "maxPresent": row[3], "present": row[4]}
+                             for row in buckets["data"]]}}
+
+def get_occupancy(cursor: cursor, stueble_id: int) -> OccupancySuccess | GenericFailure:
+    """
+    returns the live occupancy of a stueble from the counters, without reading the guest list
+
+    Parameters:
+        cursor: cursor for the connection
+        stueble_id (int): id of the stueble
+    Returns:
+        dict: {"success": True, "data": {"stuebleId", "present", "registered", "capacity"}}, {"success": False, "error": e} if error occurred
+    """
+    result = db.custom_call(
+        cursor=cursor,
+        query="""SELECT COALESCE(s.present, 0), COALESCE(c.registered_guests, 0),
+        (SELECT CAST(value AS INTEGER) FROM configurations WHERE key = 'maximum_guests')
+        FROM stueble_motto m LEFT JOIN stueble_stats s ON s.stueble_id = m.id
+        LEFT JOIN stueble_counters c ON c.stueble_id = m.id
+        WHERE m.id = %s""",
+        type_of_answer=db.ANSWER_TYPE.SINGLE_ANSWER,
+        variables=[stueble_id],
+        read_only=True)
+    if result["success"] is False:
+        return error_to_failure(result)
+    if result["data"] is None:
+        return {"success": False, "error": "no stueble found"}
+    present, registered, capacity = result["data"]
+    return {"success": True, "data": {"stuebleId": stueble_id, "present": present, "registered": registered, "capacity": capacity}}
+
+def backfill(cursor: cursor, batch_size: int = 10) -> BackfillSuccess | GenericFailure:
+    """
+    rebuilds the rollups of the next batch_size stuebles in stueble_stats_backfill (stuebles with events from before
+    collect_stats) \n
+    every stueble is rebuilt and committed on its own, so events are only blocked for one stueble at a time
+
+    Parameters:
+        cursor: cursor for the connection
+        batch_size (int): maximum number of stuebles to rebuild
+    Returns:
+        dict: {"success": True, "data": [stueble_id, ...]} with the rebuilt stuebles (empty if done), {"success": False, "error": e} if error occurred
+    """
+    result = db.custom_call(
+        cursor=cursor,
+        query="""SELECT b.stueble_id FROM stueble_stats_backfill b JOIN stueble_motto m ON m.id = b.stueble_id
+        ORDER BY m.date_of_time DESC
+        LIMIT %s""",
+        type_of_answer=db.ANSWER_TYPE.LIST_ANSWER,
+        variables=[batch_size],
+        read_only=True)
+    if result["success"] is False:
+        return error_to_failure(result)
+
+    stueble_ids = [row[0] for row in result["data"]]
+    for stueble_id in stueble_ids:
+        rebuilt = db.custom_call(
+            cursor=cursor,
+            query="SELECT rebuild_stueble_stats(%s)",
+            type_of_answer=db.ANSWER_TYPE.NO_ANSWER,
+            variables=[stueble_id],
+            read_only=False)
+        if rebuilt["success"] is False:
+            return error_to_failure(rebuilt)
+    return {"success": True, "data": stueble_ids}
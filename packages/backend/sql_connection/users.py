@@ -543,7 +543,7 @@ def check_user_present(cursor: cursor, user_id: int) -> SingleSuccessCleaned | G
     query = """SELECT COALESCE(
             (SELECT event_type
              FROM events
-             WHERE user_id = 1
+             WHERE user_id = %s
                AND stueble_id = (SELECT id
                                  FROM stueble_motto
                                  WHERE date_of_time >= CURRENT_DATE
@@ -0,0 +1,89 @@
+"""
+Benchmark of the door check-in: scans per second of the old sequence of helper calls compared to guest_events.check_in \n
+Needs a development database with a stueble party today, a host session and guests on the guest list. \n
+Every scan is rolled back unless --commit is passed, so the guest list doesn't change.
+
+python -m packages.backend.testing.benchmark_check_in --session-id <SID of a host> --scans 500
+"""
+
+import argparse
+import time
+
+from packages.backend.data_types import EventType, UserRole
+from packages.backend.sql_connection import database as db, guest_events, sessions, users
+from packages.backend.sql_connection.common_functions import check_permissions
+from packages.backend.sql_connection.conn_cursor_functions import close_conn_cursor, get_conn_cursor
+
+def legacy_check_in(cursor, session_id: str, user_uuid: str, present: bool) -> dict:
+    """
+    the check-in as done by /guest before the check_in_guest function existed
+    """
+    result = check_permissions(cursor=cursor, session_id=session_id, required_role=UserRole.HOST)
+    if result["success"] is False or result["data"]["allowed"] is False:
+        return {"success": False, "error": "invalid permissions"}
+    result = users.get_user(cursor=cursor, user_uuid=user_uuid,
+                            keywords=["first_name", "last_name", "room", "residence", "verified", "user_role", "id"],
+                            expect_single_answer=True)
+    if result["success"] is False:
+        return result
+    guest_user_id = result["data"][-1]
+    if present and result["data"][4] is False:
+        result = users.update_user(cursor=cursor, user_uuid_key=user_uuid, verified=True)
+        if result["success"] is False:
+            return result
+    result = guest_events.change_guest(cursor=cursor, user_uuid=user_uuid,
+                                       event_type=EventType.ARRIVE if present else EventType.LEAVE)
+    if result["success"] is False:
+        return result
+    return sessions.get_session_ids(cursor=cursor, user_id=guest_user_id, uuid=True)
+
+def run(name: str, check_in, session_id: str, guests: list[tuple[str, bool]], scans: int, commit: bool):
+    """
+    runs scans check-ins round robin over the guests and prints the throughput
+    """
+    conn, cursor = get_conn_cursor()
+    failures = 0
+    start = time.perf_counter()
+    try:
+        for i in range(scans):
+            # the helpers don't commit on managed connections, so every scan is one transaction like in a request
+            db.managed_connections[id(conn)] = False
+            user_uuid, present = guests[i % len(guests)]
+            result = check_in(cursor, session_id, user_uuid, not present)
+            if result["success"] is False:
+                failures += 1
+            if commit and result["success"] is True:
+                conn.commit()
+                guests[i % len(guests)] = (user_uuid, not present)
+            else:
+                conn.rollback()
+        elapsed = time.perf_counter() - start
+    finally:
+        db.managed_connections.pop(id(conn), None)
+        close_conn_cursor(conn, cursor)
+    print(f"{name:>10}: {scans / elapsed:8.1f} scans/s, {elapsed / scans * 1000:6.2f} ms/scan, {failures} failed")
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark of the door check-in")
+    parser.add_argument("--session-id", required=True, help="session id of a host")
+    parser.add_argument("--scans", type=int, default=500)
+    parser.add_argument("--commit", action="store_true", help="commit every scan instead of rolling it back")
+    args = parser.parse_args()
+
+    conn, cursor = get_conn_cursor()
+    result = guest_events.guest_list(cursor=cursor)
+    close_conn_cursor(conn, cursor)
+    if result["success"] is False:
+        raise SystemExit(f"could not load the guest list: {result['error']}")
+    guests = [(guest["id"], guest["present"]) for guest in result["data"]]
+    if len(guests) == 0:
+        raise SystemExit("the guest list of the current stueble is empty")
+
+    def check_in(cursor, session_id, user_uuid, present):
+        return guest_events.check_in(cursor=cursor, session_id=session_id, user_uuid=user_uuid, present=present)
+
+    run("legacy", legacy_check_in, args.session_id, guests, args.scans, args.commit)
+    run("check_in", check_in, args.session_id, guests, args.scans, args.commit)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark of the Drive export of large archives, runs offline against the fake Drive backend (fake_drive.py) \n
+Writes a synthetic guest history with the export writers and uploads it with different chunk sizes. Prints the
+throughput, the number of Drive requests and the peak memory of the upload, compared to reading the whole file into
+memory like MediaInMemoryUpload did. Finally the folder requests of repeated uploads are compared with and without
+the folder id cache.
+
+python -m packages.backend.testing.benchmark_drive_export --rows 1000000 --format csv --latency 0.002
+"""
+
+import argparse
+import datetime
+import os
+import tempfile
+import time
+import tracemalloc
+
+from packages.backend import export
+from packages.backend.google_functions.drive import ExportUploader, semester_name
+from packages.backend.google_functions.fake_drive import FakeDrive
+
+def synthetic_history(rows: int):
+    """
+    yields rows of export.HISTORY_COLUMNS, about 60 guests per stueble with four events each
+    """
+    start = datetime.datetime(2020, 1, 1, 20, 0, tzinfo=datetime.timezone.utc)
+    event_types = ("add", "arrive", "leave", "remove")
+    for i in range(rows):
+        stueble_id = i // 240
+        guest = (i // 4) % 60
+        submitted = start + datetime.timedelta(days=7 * stueble_id, minutes=guest + 30 * (i % 4))
+        yield (stueble_id, submitted.date(), i, event_types[i % 4], submitted,
+               f"First{guest}", f"Last, {guest}", f"guest{guest}@example.org", guest % 300 + 1, "altbau", "user")
+
+def write_archive(rows: int, file_format: str, directory: str) -> str:
+    mime_type, extension = export.FORMATS[file_format]
+    path = os.path.join(directory, f"archive{extension}")
+    start = time.perf_counter()
+    if file_format == "csv":
+        with open(path, "w", newline="", encoding="utf-8") as file:
+            export.write_csv(rows=synthetic_history(rows), columns=export.HISTORY_COLUMNS, file=file)
+    else:
+        with open(path, "wb") as file:
+            export.write_msgpack(rows=synthetic_history(rows), columns=export.HISTORY_COLUMNS, file=file)
+    elapsed = time.perf_counter() - start
+    size = os.path.getsize(path)
+    print(f"{'export':>12}: {rows / elapsed:10.0f} rows/s, {size / 1024 / 1024:8.1f} MiB {file_format}")
+    return path
+
+def run_upload(name: str, path: str, mime_type: str, chunk_size: int, latency: float, in_memory: bool = False):
+    backend = FakeDrive(latency=latency, keep_content=False)
+    uploader = ExportUploader(backend=backend, chunk_size=chunk_size)
+    size = os.path.getsize(path)
+    tracemalloc.start()
+    start = time.perf_counter()
+    content = None
+    if in_memory:
+        # what MediaInMemoryUpload needs: the whole file as one bytes object, held during the upload
+        with open(path, "rb") as file:
+            content = file.read()
+    result = uploader.upload(path=path, file_name=os.path.basename(path), folder=["archive"], mime_type=mime_type)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if result["success"] is False:
+        raise SystemExit(f"upload failed: {result['error']}")
+    if content is not None and len(content) != size:
+        raise SystemExit(f"read {len(content)} of {size} bytes")
+    print(f"{name:>12}: {size / 1024 / 1024 / elapsed:8.1f} MiB/s, {backend.requests:5d} requests, "
+          f"peak memory {peak / 1024 / 1024:8.1f} MiB")
+
+def run_folders(uploads: int, path: str, mime_type: str, latency: float):
+    dates = [datetime.date(2024, 1, 1) + datetime.timedelta(days=7 * i) for i in range(uploads)]
+
+    backend = FakeDrive(latency=latency, keep_content=False)
+    uploader = ExportUploader(backend=backend, chunk_size=64 * 1024 * 1024)
+    for i, date in enumerate(dates):
+        uploader.upload(path=path, file_name=f"guests_{i}", folder=[semester_name(date), f"stueble_{i}"], mime_type=mime_type)
+    cached = backend.requests
+
+    backend = FakeDrive(latency=latency, keep_content=False)
+    for i, date in enumerate(dates):
+        # a new uploader per upload has to look up every folder again
+        ExportUploader(backend=backend, chunk_size=64 * 1024 * 1024).upload(
+            path=path, file_name=f"guests_{i}", folder=[semester_name(date), f"stueble_{i}"], mime_type=mime_type)
+    uncached = backend.requests
+    print(f"{'folders':>12}: {uploads} uploads, {cached} requests with folder cache, {uncached} without")
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark of the Drive export of large archives")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--format", choices=list(export.FORMATS), default="csv")
+    parser.add_argument("--latency", type=float, default=0.002, help="seconds per simulated Drive request")
+    parser.add_argument("--uploads", type=int, default=50, help="uploads of the folder cache comparison")
+    args = parser.parse_args()
+
+    mime_type, _ = export.FORMATS[args.format]
+    with tempfile.TemporaryDirectory() as directory:
+        path = write_archive(args.rows, args.format, directory)
+        run_upload("in memory", path, mime_type, chunk_size=64 * 1024 * 1024, latency=args.latency, in_memory=True)
+        for chunk_size in (256 * 1024, 1024 * 1024, 8 * 1024 * 1024):
+            run_upload(f"{chunk_size // 1024} KiB", path, mime_type, chunk_size=chunk_size, latency=args.latency)
+
+        small_path = os.path.join(directory, "small.csv")
+        with open(small_path, "w", encoding="utf-8") as file:
+            file.write("stueble_id\n1\n")
+        run_folders(args.uploads, small_path, "text/csv", args.latency)
+
+if __name__ == "__main__":
+    main()
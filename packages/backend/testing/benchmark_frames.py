@@ -0,0 +1,79 @@
+"""
+Benchmark of the ping / heartbeat path of the websocket server: frames per second of the old send (msgpack.packb per
+message behind the message log wrapper with inspect.stack) compared to the handlers with frames.py \n
+The frames are sent to a websocket that drops them, so only the server side of the path is measured. No database is
+needed.
+
+python -m packages.backend.testing.benchmark_frames --frames 100000
+"""
+
+import argparse
+import asyncio
+import inspect
+import time
+from functools import wraps
+
+import msgpack
+
+from packages.backend import frames, websocket as ws
+
+class NullWebsocket:
+    """
+    websocket that drops every frame
+    """
+    async def send(self, message):
+        pass
+
+def legacy_log(func):
+    """
+    the caller lookup of add_to_message_log before frames.py, ping and heartbeat were excluded by their name
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        caller_name = inspect.stack()[1].function
+        excluded_functions = [name.lower() for name in ws.allowed_events] + ["handle_ws"]
+        if caller_name in excluded_functions:
+            return func(*args, **kwargs)
+        return func(*args, resId=0, **kwargs)
+    return wrapper
+
+@legacy_log
+async def legacy_send(websocket, event: str, data=None, **kwargs):
+    """
+    send before frames.py
+    """
+    await websocket.send(msgpack.packb({"event": event, **kwargs, "data": data}, use_bin_type=True))
+
+async def ping(websocket, req_id):
+    await legacy_send(websocket=websocket, event="pong", reqId=req_id, data=True)
+
+async def heartbeat(websocket):
+    await legacy_send(websocket=websocket, event="heartbeat")
+
+async def run(name: str, handler, count: int):
+    """
+    calls handler count times and prints the throughput
+    """
+    websocket = NullWebsocket()
+    start = time.perf_counter()
+    for i in range(count):
+        await handler(websocket, i)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>20}: {count / elapsed:10.0f} frames/s, {elapsed / count * 1e6:6.2f} µs/frame")
+
+async def benchmark(count: int):
+    await run("legacy ping", lambda websocket, i: ping(websocket, i), count)
+    await run("ping", lambda websocket, i: ws.ping(websocket, i), count)
+    await run("legacy heartbeat", lambda websocket, i: heartbeat(websocket), count)
+    await run("heartbeat", lambda websocket, i: ws.heartbeat(websocket), count)
+    await run("packb pong", lambda websocket, i: websocket.send(msgpack.packb({"event": "pong", "reqId": i, "data": True}, use_bin_type=True)), count)
+    await run("template pong", lambda websocket, i: websocket.send(frames.encode("pong", True, reqId=i)), count)
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark of the ping / heartbeat path of the websocket server")
+    parser.add_argument("--frames", type=int, default=100000)
+    args = parser.parse_args()
+    asyncio.run(benchmark(args.frames))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Benchmark of the memory of the websocket server: bytes per idle connection in the registries and bytes per entry of the
+message log, the old layout (room sets, websockets_info dicts, params dicts) compared to the Connection and
+LoggedMessage records \n
+Only the state of the server is measured, the buffers of the websockets library come on top. No database is needed.
+
+python -m packages.backend.testing.benchmark_ws_memory --connections 2000 --hosts 30 --messages 1000
+"""
+
+import argparse
+import datetime
+import gc
+import tracemalloc
+import uuid
+
+import msgpack
+
+from packages.backend import websocket as ws
+from packages.backend.data_types import UserRole, get_leq_roles
+
+class IdleWebsocket:
+    """
+    stand-in for a connection of the websockets library, not part of the measurement
+    """
+    __slots__ = ("context", "__weakref__")
+
+def measure(setup) -> int:
+    """
+    returns the bytes allocated by setup that are still alive after it returned
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    keep = setup()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del keep
+    return size
+
+def sessions_of(count: int, hosts: int) -> list[tuple]:
+    """
+    returns (websocket, ConnectionContext) of count connections, the first hosts of them are hosts \n
+    the contexts are created by the handshake for both layouts, so they aren't measured
+    """
+    expiration_date = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=1)
+    sessions = []
+    for i in range(count):
+        role = UserRole.HOST if i < hosts else UserRole.USER
+        capabilities = tuple(r.value for r in get_leq_roles(role) if r.value in ["user", "host", "tutor", "admin"])
+        context = ws.ConnectionContext(session_id=str(uuid.uuid4()), user_id=i, user_uuid=str(uuid.uuid4()), user_role=role,
+                                       capabilities=capabilities, expiration_date=expiration_date)
+        sessions.append((IdleWebsocket(), context))
+    return sessions
+
+def legacy_registry(sessions: list[tuple]):
+    """
+    the registries as kept by handle_ws before the Connection records
+    """
+    host_upwards_room, admins_room, connections, sid_to_websocket, websockets_info = set(), set(), set(), {}, {}
+    for websocket, context in sessions:
+        websocket.context = context
+        websockets_info[id(websocket)] = {"session_id": context.session_id}
+        sid_to_websocket[context.session_id] = websocket
+        connections.add(websocket)
+        if context.user_role >= UserRole.HOST:
+            host_upwards_room.add(websocket)
+        if context.user_role == UserRole.ADMIN:
+            admins_room.add(websocket)
+        ws.schedule_expiry(context)
+    return host_upwards_room, admins_room, connections, sid_to_websocket, websockets_info
+
+def record_registry(sessions: list[tuple]):
+    """
+    the registries of websocket.register_websocket
+    """
+    for websocket, context in sessions:
+        websocket.context = context
+        ws.register_websocket(websocket, context)
+    return ws.connections
+
+def guest(i: int) -> dict:
+    """
+    returns a guestModified payload
+    """
+    return {"id": str(uuid.uuid4()), "present": True, "firstName": f"Vorname{i}", "lastName": f"Nachname{i}",
+            "extern": False, "roomNumber": 100 + i, "residence": "altbau", "verified": True}
+
+def legacy_log(count: int, session_ids: list[str]):
+    """
+    the message log as kept by add_to_message_log before the LoggedMessage records, the payload stays referenced
+    """
+    message_log = {}
+    for i in range(count):
+        params = {"event": "guestModified", "data": guest(i), "skip_sid": None, "kwargs": {"manifestVersion": i}}
+        message_log[i] = {"params": params, "session_ids": list(session_ids)}
+    return message_log
+
+def record_log(count: int, session_ids: list[str]):
+    """
+    the message log of LoggedMessage records, only the encoded frame, that was sent anyway, stays referenced
+    """
+    message_log = {}
+    for i in range(count):
+        frame = msgpack.packb({"event": "guestModified", "manifestVersion": i, "resId": i, "data": guest(i)}, use_bin_type=True)
+        entry = ws.LoggedMessage(session_ids=list(session_ids))
+        entry.frame = frame
+        message_log[i] = entry
+    return message_log
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark of the memory of the websocket server")
+    parser.add_argument("--connections", type=int, default=2000, help="idle connections")
+    parser.add_argument("--hosts", type=int, default=30, help="connections of hosts, receivers of the logged messages")
+    parser.add_argument("--messages", type=int, default=1000, help="unacknowledged messages in the message log")
+    args = parser.parse_args()
+
+    for name, registry in [("legacy", legacy_registry), ("records", record_registry)]:
+        sessions = sessions_of(args.connections, args.hosts)
+        size = measure(lambda: registry(sessions))
+        print(f"{name:>10}: {size / args.connections:8.1f} bytes/connection, {size / 1024:8.1f} KiB for {args.connections} connections")
+
+    session_ids = [context.session_id for _, context in sessions[:args.hosts]]
+    for name, log in [("legacy", legacy_log), ("records", record_log)]:
+        size = measure(lambda: log(args.messages, session_ids))
+        print(f"{name:>10}: {size / args.messages:8.1f} bytes/message, {size / 1024:8.1f} KiB for {args.messages} messages to {args.hosts} hosts")
+
+if __name__ == "__main__":
+    main()
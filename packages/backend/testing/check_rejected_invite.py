@@ -0,0 +1,60 @@
+"""
+Checks that a rejected invitation leaves no extern user behind: the invitee is inserted into users before the
+registration is rejected by event_guest_change, the unit of work has to roll both back, also if the caller doesn't
+pass failed to close_conn_cursor (change_invitee aborts the transaction itself). \n
+Needs a development database with a stueble party and the session of a user on its guest list, who has already used
+all invites (maximum_invites_per_user is 1, so invite one guest first).
+
+python -m packages.backend.testing.check_rejected_invite --session-id <SID of the inviter>
+"""
+
+import argparse
+import uuid
+
+from packages.backend.services import invitees
+from packages.backend.sql_connection import database as db
+from packages.backend.sql_connection.conn_cursor_functions import close_conn_cursor, get_conn_cursor, unit_of_work
+
+def count_users(first_name: str, last_name: str) -> int:
+    """
+    returns the number of users with the name
+    """
+    conn, cursor = get_conn_cursor()
+    result = db.custom_call(cursor=cursor,
+                            query="SELECT COUNT(*) FROM users WHERE first_name = %s AND last_name = %s",
+                            type_of_answer=db.ANSWER_TYPE.SINGLE_ANSWER,
+                            variables=[first_name, last_name])
+    close_conn_cursor(conn, cursor)
+    if result["success"] is False:
+        raise SystemExit(f"could not count the users: {result['error']}")
+    return result["data"][0]
+
+def main():
+    parser = argparse.ArgumentParser(description="checks that a rejected invitation leaves no extern user behind")
+    parser.add_argument("--session-id", required=True, help="session id of a user that has used all invites")
+    parser.add_argument("--email", default="invitee@example.com", help="email of the invitee, no mail is sent")
+    args = parser.parse_args()
+
+    for pass_failed in (True, False):
+        # a unique name, so only the invitee of this run is counted
+        first_name, last_name = "Rejected", f"Invitee {uuid.uuid4().hex[:12]}"
+
+        # the same sequence as PUT /guests/invitee
+        with unit_of_work():
+            conn, cursor = get_conn_cursor()
+            result = invitees.change_invitee(cursor=cursor, session_id=args.session_id, method="add",
+                                             first_name=first_name, last_name=last_name, email=args.email)
+            close_conn_cursor(conn, cursor, failed=pass_failed and result["success"] is False)
+
+        if result["success"] is True:
+            raise SystemExit("the invitation was accepted, the inviter has to have used all invites")
+        print(f"invitation rejected with {result['status']}: {result['error']}")
+
+        remaining = count_users(first_name, last_name)
+        if remaining != 0:
+            raise SystemExit(f"FAILED: {remaining} extern user(s) left behind by the rejected invitation "
+                             f"({'with' if pass_failed else 'without'} failed)")
+        print(f"OK: no extern user left behind ({'with' if pass_failed else 'without'} failed)")
+
+if __name__ == "__main__":
+    main()
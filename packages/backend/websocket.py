@@ -1,9 +1,15 @@
 # TODO: update_hosts_tutors doesn't remove sessions correctly
 import asyncio
 import base64
+import heapq
+import itertools
+import math
 import os
+import queue
+import time
 import uuid
-from typing import Annotated, Literal
+from http import HTTPStatus
+from typing import Annotated, Literal, NamedTuple
 
 import websockets
 from websockets.exceptions import ConnectionClosed, ConnectionClosedOK, ConnectionClosedError
@@ -11,14 +17,18 @@ import msgpack
 import datetime
 from cryptography.hazmat.primitives import serialization
 import inspect
-from functools import wraps
+from functools import partial, wraps
 from enum import Enum
 
 from packages.backend.sql_connection.common_functions import check_permissions, get_motto
 from packages.backend.data_types import *
-from packages.backend.sql_connection import events, sessions, database as db, users, motto
-from packages.backend import hash_pwd as hp
-from zoneinfo import ZoneInfo
+from packages.backend.sql_connection import events, sessions, database as db, users, motto, statistics
+from packages.backend import frames, hash_pwd as hp
+from packages.backend.google_functions import email as mail
+from packages.backend.guest_manifest import guest_manifest
+from packages.backend.services import auth, config as config_service, guests as guest_service, hosts as host_service, invitees
+from packages.backend.occupancy import occupancy, PUSH_INTERVAL_SECONDS
+from packages.backend.rate_limit import client_address, rate_limiter
 from dotenv import load_dotenv
 from packages.backend.sql_connection.conn_cursor_functions import *
 from packages.backend.basic_functions import *
@@ -26,20 +36,85 @@ from packages.backend.basic_functions import *
 # load environment variables
 load_dotenv("~/stueble/packages/backend/.env")
 
-# initialize variables
-host_upwards_room = set()
-admins_room = set()
+SWEEP_INTERVAL_SECONDS = float(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", "5"))
 
-connections = set()
+# initialize variables
+connections = {} # websocket -> Connection
 sid_to_websocket = {}
-websockets_info = {}
-message_log = {}
+message_log = {} # message_id -> LoggedMessage
+session_messages = {} # session_id -> ids of the messages in message_log, that weren't acknowledged by the session yet
+message_ids = itertools.count()
+
+# events, that the clients acknowledge with their resId, only these are kept in the message log
+ACKNOWLEDGED_EVENTS = {"guestAdded", "guestModified", "guestRemoved", "hostAdded", "hostRemoved", "tutorAdded", "tutorRemoved"}
+
+# (expiration timestamp, session_id) of the connected sessions, the next expiring session on top, see expire_sessions
+session_deadlines = []
+scheduled_sessions = set() # session ids in session_deadlines, the expiration date of a session never changes
+deadline_added = asyncio.Event()
+
+# lists of session_ids deleted from the database, filled by the db listener (websocket_runner), drained by sweep_sessions
+removed_sessions = queue.SimpleQueue()
+
+# tasks of the server that run as long as it does, referenced here so they aren't garbage collected
+background_tasks = set()
+
+class ConnectionContext(NamedTuple):
+    """
+    identity of a websocket connection, resolved once during the handshake (see process_request) \n
+    user_role and capabilities are the ones at the handshake, later changes are pushed by status and update_hosts_tutors
+    """
+    session_id: str
+    user_id: int
+    user_uuid: str
+    user_role: UserRole
+    capabilities: tuple[str, ...]
+    expiration_date: datetime.datetime
 
 # set room datatype
 class Room(str, Enum):
     HOST_UPWARDS = "host_upwards"
     ADMINS = "admins"
 
+# bit of a room in Connection.rooms
+ROOM_FLAGS = {Room.HOST_UPWARDS: 1, Room.ADMINS: 2}
+
+class Connection:
+    """
+    registry entry of an open websocket connection, rooms is a bitmask of ROOM_FLAGS
+    """
+    __slots__ = ("websocket", "context", "rooms")
+
+    def __init__(self, websocket, context: ConnectionContext, rooms: int = 0):
+        self.websocket = websocket
+        self.context = context
+        self.rooms = rooms
+
+class LoggedMessage:
+    """
+    entry of the message log: the encoded frame, the same bytes object that was sent to all recipients and is resent
+    unchanged, and the sessions that didn't acknowledge it yet (a list, since it's much smaller than a set)
+    """
+    __slots__ = ("frame", "session_ids")
+
+    def __init__(self, session_ids: list[str]):
+        self.frame: bytes | None = None
+        self.session_ids = session_ids
+
+def in_room(websocket, room: Room) -> bool:
+    """
+    returns whether a websocket connection is in a room
+    """
+    connection = connections.get(websocket, None)
+    return connection is not None and connection.rooms & ROOM_FLAGS[room] != 0
+
+def room_members(room: Room) -> list:
+    """
+    returns the websocket connections of a room
+    """
+    flag = ROOM_FLAGS[room]
+    return [connection.websocket for connection in connections.values() if connection.rooms & flag]
+
 def update_hosts_tutors(hosts: list[str], method: Literal["add", "remove"]):
     """
     Update the list of hosts
@@ -52,21 +127,71 @@ def update_hosts_tutors(hosts: list[str], method: Literal["add", "remove"]):
     if method not in ["add", "remove"]:
         return {"success": False, "error": "method must be 'add' or 'remove'"}
 
+    flag = ROOM_FLAGS[Room.HOST_UPWARDS]
     for i in hosts:
-        if not i in sid_to_websocket.keys():
+        connection = connections.get(sid_to_websocket.get(i, None), None)
+        if connection is None:
             continue
         if method == "add":
-            host_upwards_room.add(sid_to_websocket[i])
+            connection.rooms |= flag
         else:
-            host_upwards_room.discard(sid_to_websocket[i])
+            connection.rooms &= ~flag
     return {"success": True}
 
 def is_valid_room(room: str) -> bool:
     return room in Room._value2member_map_
 
-# handle websocket_info and sid_to_websocket garbage collection
+# operations of the service layer, the same as the HTTP routes: event -> service function, reply event, {message key: parameter}
+# and whether the operation only reads (read connection) or writes (one transaction)
+SERVICE_EVENTS = {
+    "checkIn": {"service": guest_service.check_in, "reply": "checkInResult", "parameters": {"id": "user_uuid", "present": "present"}, "read_only": False},
+    "checkInBatch": {"service": guest_service.check_in_batch, "reply": "checkInBatchResult", "parameters": {"scans": "scans"}, "read_only": False},
+    "guestVerification": {"service": guest_service.verify_guest, "reply": "guestVerificationResult", "parameters": {"id": "user_uuid", "method": "method"}, "read_only": False},
+    "forceAddGuest": {"service": guest_service.force_add_guest, "reply": "forceAddGuestResult", "parameters": {"id": "user_uuid"}, "read_only": False},
+    "addInvitee": {"service": partial(invitees.change_invitee, method="add"), "reply": "addInviteeResult",
+                   "parameters": {"firstName": "first_name", "lastName": "last_name", "email": "email", "date": "date"}, "read_only": False},
+    "removeInvitee": {"service": partial(invitees.change_invitee, method="remove"), "reply": "removeInviteeResult",
+                      "parameters": {"firstName": "first_name", "lastName": "last_name", "email": "email", "date": "date"}, "read_only": False},
+    "requestUser": {"service": auth.current_user, "reply": "user", "parameters": {}, "read_only": True},
+    "requestHosts": {"service": host_service.list_hosts, "reply": "hosts", "parameters": {"date": "date"}, "read_only": True},
+    "requestTutors": {"service": host_service.list_tutors, "reply": "tutors", "parameters": {}, "read_only": True},
+    "addHosts": {"service": partial(host_service.change_hosts, method="add"), "reply": "addHostsResult", "parameters": {"hosts": "user_uuids", "date": "date"}, "read_only": False},
+    "removeHosts": {"service": partial(host_service.change_hosts, method="remove"), "reply": "removeHostsResult", "parameters": {"hosts": "user_uuids", "date": "date"}, "read_only": False},
+    "addTutors": {"service": partial(host_service.change_tutors, method="add"), "reply": "addTutorsResult", "parameters": {"tutors": "user_uuids"}, "read_only": False},
+    "removeTutors": {"service": partial(host_service.change_tutors, method="remove"), "reply": "removeTutorsResult", "parameters": {"tutors": "user_uuids"}, "read_only": False},
+    "requestConfig": {"service": config_service.get_config, "reply": "config", "parameters": {}, "read_only": True},
+    "updateConfig": {"service": config_service.update_config, "reply": "config", "parameters": {"values": "values"}, "read_only": False},
+}
+
+allowed_events = ["connect", "disconnect", "ping", "heartbeat", "requestMotto", "requestQRCode", "requestPublicKey", "acknowledgement", "requestGuestManifest", "requestGuestList", "requestStats"] + list(SERVICE_EVENTS)
+
+def register_websocket(websocket, context: ConnectionContext):
+    """
+    adds an authenticated websocket to the registries and the rooms of its role
 
-allowed_events = ["connect", "disconnect", "ping", "heartbeat", "requestMotto", "requestQRCode", "requestPublicKey", "acknowledgement"]
+    Parameters:
+        websocket: the websocket connection
+        context (ConnectionContext): the context resolved during the handshake
+    """
+    rooms = 0
+    if context.user_role >= UserRole.HOST:
+        rooms |= ROOM_FLAGS[Room.HOST_UPWARDS]
+    if context.user_role == UserRole.ADMIN:
+        rooms |= ROOM_FLAGS[Room.ADMINS]
+    connections[websocket] = Connection(websocket=websocket, context=context, rooms=rooms)
+    sid_to_websocket[context.session_id] = websocket
+    schedule_expiry(context)
+
+def unregister_websocket(websocket):
+    """
+    removes a websocket from all rooms and registries
+
+    Parameters:
+        websocket: the websocket connection
+    """
+    connection = connections.pop(websocket, None)
+    if connection is not None and sid_to_websocket.get(connection.context.session_id, None) is websocket:
+        del sid_to_websocket[connection.context.session_id]
 
 # add achievements
 def get_websocket_by_sid(sid: str):
@@ -131,57 +256,51 @@ def add_to_message_log(func):
     Returns:
         wrapper: the wrapped function
     """
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        # get name of the function, that called this function
-        caller_name = inspect.stack()[1].function
+    # excluded_functions
+    excluded_functions = allowed_events.copy() + ["handle_ws"]
+    excluded_functions = {re.sub(r'(?<!^)(?=[A-Z])', '_', i).lower() for i in excluded_functions}
+    excluded_functions.remove("request_q_r_code")
+    excluded_functions.add("request_qr_code")
+    excluded_functions.add("service_request")
+
+    sig = inspect.signature(func)
 
-        # excluded_functions
-        excluded_functions = allowed_events.copy() + ["handle_ws"]
-        excluded_functions = [re.sub(r'(?<!^)(?=[A-Z])', '_', i).lower() for i in excluded_functions]
-        excluded_functions.remove("request_q_r_code")
-        excluded_functions.append("request_qr_code")
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        # get name of the function, that called this function, only the calling frame (inspect.stack reads the sources)
+        caller_name = inspect.currentframe().f_back.f_code.co_name
 
         # since these messages have a req_id, ignore them
         if caller_name in excluded_functions:
-            return func(*args, **kwargs)
+            return await func(*args, **kwargs)
 
         # bind parameter names to values
-        sig = inspect.signature(func)
         bound = sig.bind(*args, **kwargs)
         bound.apply_defaults()
         params = bound.arguments
 
-        # initialize room
-        room = set()
-
-        # set room based on function
-        if func.__name__ == "broadcast":
-            if params.get("room", None) is None:
-                room = host_upwards_room
-            if "skip_sid" in params:
-                room.discard(params["skip_sid"])
-        elif func.__name__ == "send":
-            if "websocket" in kwargs:
-                room = {kwargs["websocket"]}
+        message_id = next(message_ids)
+        entry = None
+        if params["event"] in ACKNOWLEDGED_EVENTS:
+            # retrieve session_ids that receive the message
+            if func.__name__ == "broadcast":
+                recipients = resolve_room(params["room"])
             else:
-                room = {args[0]} if len(args) > 0 else None
-
-        # retrieve session_ids that receive the message
-        session_ids = [websockets_info.get(i, {}).get("session_id", None) for i in room]
-        session_ids = [i for i in session_ids if i is not None]
-        if "room" in params:
-            del params["room"]
-        if len(message_log.keys()) == 0:
-            message_id = 0
-        else:
-            message_id = max(list(message_log.keys())) + 1
-
-        # set message log
-        message_log[message_id] = {"params": params, "session_ids": session_ids}
-
-        result = func(*args, resId=message_id, **kwargs)
-        return result
+                recipients = [params["websocket"]]
+            session_ids = {connection.context.session_id for connection in map(connections.get, recipients) if connection is not None}
+            session_ids.discard(params.get("skip_sid", None))
+
+            # set message log before sending, so an early acknowledgement finds the message
+            if len(session_ids) > 0:
+                entry = LoggedMessage(session_ids=list(session_ids))
+                message_log[message_id] = entry
+                for i in session_ids:
+                    session_messages.setdefault(i, set()).add(message_id)
+
+        frame = await func(*args, resId=message_id, **kwargs)
+        if entry is not None:
+            entry.frame = frame
+        return frame
     return wrapper
 
 @add_to_message_log
@@ -194,92 +313,163 @@ async def send(websocket, event: str, data: dict | bool, **kwargs):
         event (str): the event to send
         data (dict | bool): the data to send
         **kwargs: additional keyword arguments to send
+    Returns:
+        bytes: the encoded message
     """
-    message = msgpack.packb({"event": event, **kwargs, "data": data}, use_bin_type=True)
+    message = frames.encode(event, data, **kwargs)
     try:
         await websocket.send(message)
     except (ConnectionClosed, ConnectionClosedOK, ConnectionClosedError):
-        host_upwards_room.discard(websocket)
-        admins_room.discard(websocket)
-        connections.discard(websocket)
-        sid_to_websocket.pop(next(key for key, value in sid_to_websocket.items() if id(value) == id(websocket)), None) # check, whether that works
-        del websockets_info[id(websocket)]
+        unregister_websocket(websocket)
+    return message
+
+async def send_frame(websocket, frame: bytes):
+    """
+    sends an encoded frame (see frames.py) to a websocket, without the message log
+
+    Parameters:
+        websocket: the websocket connection
+        frame (bytes): the frame
+    """
+    try:
+        await websocket.send(frame)
+    except (ConnectionClosed, ConnectionClosedOK, ConnectionClosedError):
+        unregister_websocket(websocket)
+
+def resolve_room(room: None | Room | list) -> list:
+    """
+    returns the websocket connections of a room of broadcast
+
+    Parameters:
+        room (Room | list | None): a room, a list of websocket connections or None for the hosts and above
+    """
+    if room is None:
+        return room_members(Room.HOST_UPWARDS)
+    if isinstance(room, Room):
+        return room_members(room)
+    if isinstance(room, list):
+        return room
+    raise NotImplementedError(f"room {room} not implemented")
 
 @add_to_message_log
-async def broadcast(event, data, room: None | Room | list=None, skip_sid=None, **kwargs):
+async def broadcast(event, data, room: None | Room | list=None, skip_sid=None, stueble_id: int | None=None, **kwargs):
     """
     broadcasts an event to a room
-le_
+
     Parameters:
         event (str): the event to broadcast
         data (dict): the data to send
         skip_sid (str): the session id to skip (optional)
         room (set): the room to broadcast to (optional, defaults to all connections)
+        stueble_id (int | None): stueble of a guest list change, None for the current stueble (optional, not sent)
         **kwargs: additional keyword arguments to send
+    Returns:
+        bytes: the encoded message
     """
-    if room is None or room == Room.HOST_UPWARDS:
-        room = host_upwards_room
-    elif room == Room.ADMINS:
-        room = admins_room
-    else:
-        if isinstance(room, list):
-            pass
-        else:
-            raise NotImplementedError(f"room {room} not implemented")
+    recipients = resolve_room(room)
 
+    # keep the guest manifest of the door scanners in sync, clients use manifestVersion to detect missed changes
+    manifest_version = guest_manifest.apply(event=event, data=data, stueble_id=stueble_id)
+    if manifest_version is not None:
+        kwargs["manifestVersion"] = manifest_version
 
-    message = msgpack.packb({"event": event, **kwargs, "data": data}, use_bin_type=True)
-    for ws in list(room):
-        ws_sid = websockets_info.get(id(ws), {}).get("session_id", None)
-        if ws_sid != skip_sid and ws_sid is not None:
-            try:
-                await ws.send(message)
-            # when websocket connection is already closed, remove it from lists
-            except (ConnectionClosed, ConnectionClosedOK, ConnectionClosedError):
-                host_upwards_room.discard(ws)
-                admins_room.discard(ws)
-                connections.discard(ws)
-                sid_to_websocket.pop(next(key for key, value in sid_to_websocket.items() if id(value) == id(ws)), None) # check, whether that works
-                del websockets_info[id(ws)]
-        if ws_sid is None:
-            pass
+    message = frames.encode(event, data, **kwargs)
+    for ws in recipients:
+        connection = connections.get(ws, None)
+        if connection is None or connection.context.session_id == skip_sid:
+            continue
+        try:
+            await ws.send(message)
+        # when websocket connection is already closed, remove it from lists
+        except (ConnectionClosed, ConnectionClosedOK, ConnectionClosedError):
+            unregister_websocket(ws)
+    return message
 
-async def handle_ws(websocket):
+def load_context(session_id: str):
     """
-    handles a websocket connection
+    reads the user of a session for the connection context, runs in a worker thread during the handshake
 
     Parameters:
-        websocket: the websocket connection
+        session_id (str): the session id from the cookies
+    Returns:
+        dict: {"success": True, "data": ConnectionContext}, {"success": False, "error": e} if error occurred
     """
-    session_id = parse_cookies(headers=websocket.request.headers).get("SID", None)
-    result = await connect(websocket)
-    if result is False:
-        await send(websocket=websocket, event="status", data={"code": "200",
-                                                              "capabilities": [],
-                                                              "authorized": False})
-        return
-    
-    # get connection and cursor
-    conn, cursor = get_conn_cursor()
-    result = sessions.get_session(cursor=cursor, session_id=session_id)
+    conn, cursor = get_read_conn_cursor()
+    result = sessions.get_session_user(cursor=cursor, session_id=session_id)
     close_conn_cursor(conn, cursor)
     if result["success"] is False:
-        await send(websocket=websocket, event="status", data={"code": "401",
-                                                              "capabilities": [],
-                                                              "authorized": False})
-        return
-    
-    _, expiration_date = result["data"]
-    websockets_info[id(websocket)] = {"expiration_date": expiration_date, "session_id": session_id}
+        return result
 
-    sid_to_websocket[session_id] = websocket
+    user_id, user_uuid, user_role, expiration_date = result["data"]
+    user_role = UserRole(user_role)
+    capabilities = tuple(i.value for i in get_leq_roles(user_role) if i.value in ["user", "host", "tutor", "admin"])
+    return {"success": True, "data": ConnectionContext(session_id=session_id,
+                                                       user_id=user_id,
+                                                       user_uuid=str(user_uuid),
+                                                       user_role=user_role,
+                                                       capabilities=capabilities,
+                                                       expiration_date=expiration_date)}
+
+async def process_request(connection, request):
+    """
+    authenticates the upgrade request by the SID cookie before the websocket is accepted, the resolved
+    ConnectionContext is stored as connection.context for the handlers \n
+    requests without a valid session are rejected with 401, too many handshakes of an address with 429, so no
+    websocket is opened for them
+
+    Parameters:
+        connection: the websocket connection, not yet accepted
+        request: the http upgrade request
+    Returns:
+        None to accept the connection, the http response to reject it
+    """
+    session_id = parse_cookies(headers=request.headers).get("SID", None)
+    if session_id is None:
+        return connection.respond(HTTPStatus.UNAUTHORIZED, "missing SID cookie\n")
+    try:
+        uuid.UUID(session_id)
+    except ValueError:
+        return connection.respond(HTTPStatus.UNAUTHORIZED, "invalid SID cookie\n")
+
+    # the session lookup is the only database access before a connection is authenticated, limit it per address
+    ip = client_address(peer=connection.remote_address[0], forwarded_for=request.headers.get("X-Forwarded-For", None))
+    retry_after = rate_limiter.take("handshake", ip=ip)
+    if retry_after > 0:
+        response = connection.respond(HTTPStatus.TOO_MANY_REQUESTS, "Too many requests\n")
+        response.headers["Retry-After"] = str(math.ceil(retry_after))
+        return response
+
+    result = await asyncio.to_thread(load_context, session_id)
+    if result["success"] is False and result["error"] == "no session found":
+        return connection.respond(HTTPStatus.UNAUTHORIZED, "Session expired\n")
+    if result["success"] is False:
+        return connection.respond(HTTPStatus.INTERNAL_SERVER_ERROR, "Internal server error\n")
 
-    connections.add(websocket)
+    connection.context = result["data"]
+    return None
 
-    # for each unsuccessfully past sent message, send it again
-    unsent_messages = [value["params"] for value in message_log.values() if session_id in value["session_ids"]]
-    for message in unsent_messages:
-        await send(websocket=websocket, **message)
+async def handle_ws(websocket):
+    """
+    handles a websocket connection
+
+    Parameters:
+        websocket: the websocket connection
+    """
+    # the connection was authenticated by process_request, unauthenticated upgrades never reach this point
+    context: ConnectionContext = websocket.context
+    session_id = context.session_id
+    register_websocket(websocket, context)
+    await connect(websocket)
+
+    # for each unsuccessfully past sent message, send it again, the frame still contains the original resId
+    unsent_messages = [message_log[i].frame for i in sorted(session_messages.get(session_id, ())) if i in message_log]
+    try:
+        for frame in unsent_messages:
+            if frame is not None:
+                await websocket.send(frame)
+    except (ConnectionClosed, ConnectionClosedOK, ConnectionClosedError):
+        unregister_websocket(websocket)
+        return
 
     # send stueble_status
     result = await stueble_status(session_id=session_id)
@@ -289,16 +479,6 @@ async def handle_ws(websocket):
 
     try:
         async for message in websocket:
-            expiration_date = websockets_info.get(id(websocket), {}).get("expiration_date", None)
-            if expiration_date is None:
-                await send(websocket=websocket, event="error", data={"code": "500",
-                    "message": "Internal server error"})
-            elif expiration_date < datetime.datetime.now(ZoneInfo("Europe/Berlin")):   
-                await send(websocket=websocket, event="error", data={"code": "401",
-                        "message": "Session expired"})
-                await websocket.close(code="1000", reason="Session expired")
-                await disconnect(websocket=websocket)
-                return
             try:
                 msg = msgpack.unpackb(message)
                 event = msg.get("event", None)
@@ -317,6 +497,11 @@ async def handle_ws(websocket):
                 await send(websocket=websocket, event="error", data={"code": "500",
                      "message": "Invalid msgpack format"})
                 continue
+            retry_after = rate_limiter.take(event, session_id=session_id)
+            if retry_after > 0:
+                await send(websocket=websocket, event="error", reqId=req_id, data={"code": "429",
+                     "message": "Too many requests", "retryAfter": round(retry_after, 3)})
+                continue
             if event == "connect":
                 await connect(websocket=websocket)
             elif event == "disconnect":
@@ -346,38 +531,38 @@ async def handle_ws(websocket):
                     await send(websocket=websocket, event="error", data={"code": "400",
                          "message": "reqId must be specified"})
                 await request_public_key(websocket=websocket, req_id=req_id)
+            elif event in SERVICE_EVENTS:
+                if req_id is None:
+                    await send(websocket=websocket, event="error", data={"code": "400",
+                         "message": "reqId must be specified"})
+                    continue
+                await service_request(websocket=websocket, event=event, msg=data, req_id=req_id)
+            elif event == "requestGuestManifest":
+                if req_id is None:
+                    await send(websocket=websocket, event="error", data={"code": "400",
+                         "message": "reqId must be specified"})
+                    continue
+                await request_guest_manifest(websocket=websocket, msg=data, req_id=req_id)
+            elif event == "requestGuestList":
+                if req_id is None:
+                    await send(websocket=websocket, event="error", data={"code": "400",
+                         "message": "reqId must be specified"})
+                    continue
+                await request_guest_list(websocket=websocket, msg=data, req_id=req_id)
+            elif event == "requestStats":
+                if req_id is None:
+                    await send(websocket=websocket, event="error", data={"code": "400",
+                         "message": "reqId must be specified"})
+                    continue
+                await request_stats(websocket=websocket, msg=data, req_id=req_id)
             elif event == "acknowledgement":
-                continue
                 if res_id is None:
                     await send(websocket=websocket, event="error", data={"code": "400",
                          "message": "resId must be specified"})
+                    continue
                 await acknowledgement(websocket=websocket, res_id=res_id)
     finally:
-        host_upwards_room.discard(websocket)
-        admins_room.discard(session_id)
-        connections.discard(websocket)
-        sid_to_websocket.pop(session_id, None)
-
-        # get connection, cursor
-        conn, cursor = get_conn_cursor()
-
-        # get all valid session_ids
-        result = db.read_table(cursor=cursor, 
-                               table_name="sessions", 
-                               keywords=["session_id"],
-                               expect_single_answer=False)
-        close_conn_cursor(conn, cursor)
-        if result["success"] is False:
-            # remove after debugging
-            print("ERROR OCCURRED")
-        # TODO: only remove invalid session_ids from message_log, when acknowledgement received
-        if result["success"] is True:
-            allowed_session_ids = result["data"]
-            for key, value in message_log.items():
-                if any(i not in allowed_session_ids for i in value["session_ids"]):
-                    message_log[key]["session_ids"] = [i for i in value["session_ids"] if i in allowed_session_ids]
-                    if message_log[key]["session_ids"] == []:
-                        del message_log[key]
+        unregister_websocket(websocket)
 
 async def acknowledgement(websocket, res_id: str | int):
     """
@@ -387,102 +572,39 @@ async def acknowledgement(websocket, res_id: str | int):
         websocket (websocket): websocket connection
         res_id (str | int): response id of the message called message_id in backend
     """
-    session_id = parse_cookies(headers=websocket.request.headers).get("SID", None)
-    if session_id is None:
-        await send(websocket=websocket, event="error", data={
-                     "code": "401",
-                     "message": "missing SID cookie"})
-        return False
-    try:
-        uuid.UUID(session_id)
-    except:
-        await send(websocket=websocket, event="status", data={"code": "401",
-                                                              "capabilities": [],
-                                                              "authorized": False})
-        return
+    session_id = websocket.context.session_id
     message_id = res_id
     if message_id is None:
         await send(websocket=websocket, event="error", data={
             "code": "400",
             "message": "missing resId"
         })
-    try:
-        message_log[message_id]["session_ids"].remove(session_id)
-    except ValueError:
+    entry = message_log.get(message_id, None)
+    if entry is None or session_id not in entry.session_ids:
         await send(websocket=websocket, event="error", data={
             "code": "400",
             "message": "invalid resId"
         })
+        return True
+    entry.session_ids.remove(session_id)
+    pending = session_messages.get(session_id, set())
+    pending.discard(message_id)
+    if len(pending) == 0:
+        session_messages.pop(session_id, None)
+    if len(entry.session_ids) == 0:
+        del message_log[message_id]
     return True
 
 
 async def connect(websocket):
     """
-    handle a new websocket connection
+    sends the capabilities of the connection, the user was authenticated during the handshake
 
     Parameters:
         websocket: the websocket connection
     """
-
-    session_id = parse_cookies(headers=websocket.request.headers).get("SID", None)
-    if session_id is None:
-        await send(websocket=websocket, event="error", data={
-                     "code": "401",
-                     "message": "missing SID cookie",
-                     "authorized": False})
-        return False
-    try:
-        uuid.UUID(session_id)
-    except ValueError:
-            await send(websocket=websocket, event="status", data={"code": "401",
-                                                                  "capabilities": [],
-                                                                  "authorized": False})
-            return
-    # get connection and cursor
-    conn, cursor = get_conn_cursor()
-
-    # check permissions
-    result = check_permissions(cursor=cursor, session_id=session_id, required_role=UserRole.HOST)
-
-    close_conn_cursor(conn, cursor)
-    if result["success"] is False and result["error"] == "no matching session and user found":
-        await send(websocket=websocket, event="status", data= {"code": "200",
-                          "capabilities": [],
-                          "authorized": False})
-        return True
-
-    if result["success"] is False:
-        await send(websocket=websocket, event="error", data= {
-                     "code": "500",
-                     "message": str(result["error"]), 
-                     "authorized": False,
-                     "capabilities": []})
-        return False
-
-    capabilities = [i.value for i in get_leq_roles(result["data"]["user_role"]) if i.value in ["user", "host", "tutor", "admin"]]
-
-    if result["data"]["allowed"] is False:
-        await send(websocket=websocket, event="status", data= {
-                     "code": "200",
-                     "capabilities": capabilities,
-                     "authorized": True})
-        return True
-
-    if result["data"]["allowed"] is True:
-        user_role = result["data"]["user_role"]
-        user_role = UserRole(user_role)
-
-        host_upwards_room.add(websocket)
-
-        if user_role == UserRole.ADMIN:
-            admins_room.add(websocket)
-
-        # can only be "authorized": True but still checking
-        await send(websocket=websocket, event="status", data= {
-                "authorized": True if user_role >= UserRole.HOST else False,
-                "capabilities": capabilities,
-                "status_code": "200"})
-        return True
+    await send_frame(websocket=websocket, frame=frames.status(websocket.context.capabilities))
+    return True
 
 async def disconnect(websocket):
     """
@@ -491,21 +613,7 @@ async def disconnect(websocket):
     Parameters:
         websocket: the websocket connection
     """
-    session_id = parse_cookies(headers=websocket.request.headers).get("SID", None)
-    if session_id is None:
-        return
-    try:
-        uuid.UUID(session_id)
-    except:
-        await send(websocket=websocket, event="status", data={"code": "401",
-                                                              "capabilities": [],
-                                                              "authorized": False})
-        return
-    host_upwards_room.discard(websocket)
-    admins_room.discard(websocket)
-    connections.discard(websocket)
-    sid_to_websocket.pop(session_id, None)
-    del websockets_info[id(websocket)]
+    unregister_websocket(websocket)
     return
 
 async def ping(websocket, req_id):
@@ -517,7 +625,7 @@ async def ping(websocket, req_id):
         req_id (str): the request id from the client
     """
 
-    await send(websocket=websocket, event="pong", reqId=req_id, data=True)
+    await send_frame(websocket=websocket, frame=frames.encode("pong", True, reqId=req_id))
     return
 
 async def heartbeat(websocket):
@@ -528,7 +636,7 @@ async def heartbeat(websocket):
         websocket: websocket connection
     """
 
-    await send(websocket=websocket, event="heartbeat")
+    await send_frame(websocket=websocket, frame=frames.HEARTBEAT)
     return
 
 async def request_motto(websocket, msg, req_id):
@@ -555,84 +663,6 @@ async def request_motto(websocket, msg, req_id):
     await send(websocket=websocket, event="motto", reqId=req_id, data=motto)
     return
 
-
-async def verify_guest(websocket, msg):
-    """
-    sets guest verified to True
-    """
-    req_id = msg.get("reqId", None)
-    if req_id is None:
-        await send(websocket=websocket, event="error",
-                   data={"code": "401",
-                         "message": "req_id must be specified"})
-        return
-    user_data = msg.get("data", None)
-    if user_data is None:
-        await send(websocket=websocket, event="error", data=
-            {"code": "400",
-             "message": "data must be specified"})
-        return
-    user_uuid = msg.get("id", None)
-    verification_method = msg.get("method", None)
-    session_id = parse_cookies(headers=websocket.request.headers).get("SID", None)
-    if session_id is None:
-        await send(websocket=websocket, event="error", data={
-            "code": "401",
-            "message": "missing SID cookie"})
-        return
-    try:
-        uuid.UUID(session_id)
-    except:
-        await send(websocket=websocket, event="status", data={"code": "401",
-                                                              "capabilities": [],
-                                                              "authorized": False})
-        return
-
-    if user_uuid is None or verification_method is None:
-        await send(websocket=websocket, event="error", data=
-            {"code": "400",
-             "message": "id and method must be specified"})
-        return
-
-    if not valid_verification_method(verification_method) or verification_method == "kolping":
-        await send(websocket=websocket, event="error", data=
-            {"code": "400",
-             "message": "invalid verification method"})
-        return
-
-    verification_method = VerificationMethod(verification_method)
-
-    # get connection, cursor
-    conn, cursor = get_conn_cursor()
-
-    # check permissions
-    result = check_permissions(cursor=cursor, session_id=session_id, required_role=UserRole.HOST)
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        await send(websocket=websocket, event="error", data=
-            {"code": "401",
-             "message": str(result["error"])})
-        return
-    if result["data"]["allowed"] is False:
-        close_conn_cursor(conn, cursor)
-        await send(websocket=websocket, event="error", data=
-            {"code": "403",
-             "message": "invalid permissions, need role host or above"})
-        return
-
-    result = users.add_verification_method(cursor=cursor, user_uuid=user_uuid, method=verification_method)
-    close_conn_cursor(conn, cursor)
-    if result["success"] is False:
-        await send(websocket=websocket, event="error", data=
-            {"code": "500",
-             "message": str(result["error"])})
-        return
-
-    await send(websocket=websocket, event="guestVerification", data={})
-
-    await broadcast(room=Room.HOST_UPWARDS, websocket=websocket, event="guestVerified", reqId=req_id, data=user_data, skip_sid=session_id)
-    return
-
 async def request_qrcode(websocket, msg, req_id):
     """
     get a new qr-code for a guest
@@ -649,19 +679,12 @@ async def request_qrcode(websocket, msg, req_id):
         stueble_id = None
     # get connection, cursor
 
-    conn, cursor = get_conn_cursor()
-    session_id = parse_cookies(headers=websocket.request.headers).get("SID", None)
-    result = sessions.get_user(cursor=cursor, session_id=session_id, keywords=["id", "user_uuid", "user_role"])
-    if result["success"] is False:
-        close_conn_cursor(conn, cursor)
-        await send(websocket=websocket, event="status", data={"code": "401",
-                                                              "capabilities": [],
-                                                              "authorized": False})
-        return
-    user_id = result["data"][0]
-    user_uuid = result["data"][1]
-    extern = result["data"][2] == "extern"
+    context: ConnectionContext = websocket.context
+    user_id = context.user_id
+    user_uuid = context.user_uuid
+    extern = context.user_role == UserRole.EXTERN
 
+    conn, cursor = get_read_conn_cursor()
     result = events.check_guest(cursor=cursor,
                                 user_id=user_id,
                                 stueble_id=stueble_id)
@@ -706,6 +729,205 @@ async def request_qrcode(websocket, msg, req_id):
     await send(websocket=websocket, event="qrCode", reqId=req_id, data=data)
     return
 
+def run_service(operation: dict, session_id: str, parameters: dict) -> dict:
+    """
+    runs an operation of the service layer with its own connection, runs in a worker thread, since the pool checkout,
+    the queries and the commit block
+
+    Parameters:
+        operation (dict): entry of SERVICE_EVENTS
+        session_id (str): session id of the connection
+        parameters (dict): parameters of the service function
+    Returns:
+        dict: result of the service function (see services/common.py)
+    """
+    if operation["read_only"]:
+        conn, cursor = get_read_conn_cursor()
+        try:
+            return operation["service"](cursor=cursor, session_id=session_id, **parameters)
+        finally:
+            close_conn_cursor(conn, cursor)
+
+    # one transaction like the unit of work of the HTTP routes, committed before the notifications are sent
+    with unit_of_work():
+        conn, cursor = get_conn_cursor()
+        result = operation["service"](cursor=cursor, session_id=session_id, **parameters)
+        close_conn_cursor(conn, cursor, failed=result["success"] is False)
+    return result
+
+async def service_request(websocket, event: str, msg, req_id):
+    """
+    runs an operation of the service layer (see SERVICE_EVENTS), replies with its data and sends its notifications
+
+    Parameters:
+        websocket: the websocket connection
+        event (str): event of SERVICE_EVENTS
+        msg (dict | None): parameters of the operation
+        req_id (str): the request id from the client
+    """
+    operation = SERVICE_EVENTS[event]
+    msg = msg if isinstance(msg, dict) else {}
+    parameters = {parameter: msg.get(key, None) for key, parameter in operation["parameters"].items()}
+
+    result = await asyncio.to_thread(run_service, operation, websocket.context.session_id, parameters)
+    if result["success"] is False:
+        await send(websocket=websocket, event="error", reqId=req_id, data={"code": str(result["status"]),
+                     "message": result["error"]})
+        return
+
+    await send(websocket=websocket, event=operation["reply"], reqId=req_id, data=result["data"])
+    await notify(result["notifications"])
+
+async def notify(notifications: list[dict]):
+    """
+    sends the notifications of a service operation (see services/common.py)
+
+    Parameters:
+        notifications (list): broadcasts, stuebleStatus, status, rooms and mail notifications in order
+    """
+    for notification in notifications:
+        event = notification["event"]
+        if event == "mail":
+            # the operation is already committed, a failed mail doesn't fail it
+            try:
+                await asyncio.to_thread(mail.send_mail, notification["recipient"], notification["data"]["subject"],
+                                        notification["data"]["body"], html=True, images=notification["data"]["images"])
+            except Exception as e:
+                print(f"Could not send the mail: {e!r}")
+        elif event == "rooms":
+            update_hosts_tutors(notification["session_ids"], notification["data"])
+        elif event == "status":
+            await status(user_uuid=notification["user_uuid"])
+        elif event == "stuebleStatus":
+            await stueble_status(session_id=notification["session_id"], **notification["data"])
+        else:
+            await broadcast(event=event, data=notification["data"], skip_sid=notification.get("skip_sid", None),
+                            stueble_id=notification.get("stueble_id", None))
+
+def load_guest_manifest(force: bool = False) -> dict:
+    """
+    (re)loads the guest manifest with a read only connection, runs in a worker thread
+
+    Parameters:
+        force (bool): reconcile the manifest of an unchanged stueble as well (see GuestManifest.load)
+    Returns:
+        dict: {"success": True}, {"success": False, "error": e} if error occurred
+    """
+    conn, cursor = get_read_conn_cursor()
+    try:
+        return guest_manifest.load(cursor=cursor, force=force)
+    finally:
+        close_conn_cursor(conn, cursor)
+
+async def request_guest_manifest(websocket, msg, req_id):
+    """
+    sends the guest manifest of the current stueble, so hosts can check scanned qr codes without a server round trip \n
+    with a version only the changes since that version are sent, if they are still available
+
+    Parameters:
+        websocket: the websocket connection
+        msg (dict | None): {"version": int | None}
+        req_id (str): the request id from the client
+    """
+    if not in_room(websocket, Room.HOST_UPWARDS):
+        await send(websocket=websocket, event="error", reqId=req_id, data={"code": "403",
+                     "message": "invalid permissions, need role host or above"})
+        return
+
+    version = msg.get("version", None) if isinstance(msg, dict) else None
+    if version is not None and not isinstance(version, int):
+        await send(websocket=websocket, event="error", reqId=req_id, data={"code": "400",
+                     "message": "version must be an integer"})
+        return
+
+    result = await asyncio.to_thread(load_guest_manifest)
+    if result["success"] is False:
+        await send(websocket=websocket, event="error", reqId=req_id, data={"code": "500",
+                     "message": str(result["error"])})
+        return
+
+    await send(websocket=websocket, event="guestManifest", reqId=req_id, data=guest_manifest.snapshot(since=version))
+
+async def request_guest_list(websocket, msg, req_id):
+    """
+    sends the guest list of the current stueble as column arrays, optionally as zlib compressed msgpack payload \n
+    the version is the manifest version, the guestAdded, guestRemoved and guestModified messages with a higher
+    manifestVersion keep the list up to date
+
+    Parameters:
+        websocket: the websocket connection
+        msg (dict | None): {"compress": bool}
+        req_id (str): the request id from the client
+    """
+    if not in_room(websocket, Room.HOST_UPWARDS):
+        await send(websocket=websocket, event="error", reqId=req_id, data={"code": "403",
+                     "message": "invalid permissions, need role host or above"})
+        return
+
+    compress = msg.get("compress", False) if isinstance(msg, dict) else False
+    if not isinstance(compress, bool):
+        await send(websocket=websocket, event="error", reqId=req_id, data={"code": "400",
+                     "message": "compress must be a boolean"})
+        return
+
+    result = await asyncio.to_thread(load_guest_manifest)
+    if result["success"] is False:
+        await send(websocket=websocket, event="error", reqId=req_id, data={"code": "500",
+                     "message": str(result["error"])})
+        return
+
+    await send(websocket=websocket, event="guestList", reqId=req_id, data=guest_manifest.columnar(compress=compress))
+
+async def request_stats(websocket, msg, req_id):
+    """
+    sends the statistics of a stueble (see GET /stats), only for tutors and above
+
+    Parameters:
+        websocket: the websocket connection
+        msg (dict | None): {"stuebleId": int | None}, the current stueble if stuebleId is missing
+        req_id (str): the request id from the client
+    """
+    stueble_id = msg.get("stuebleId", None) if isinstance(msg, dict) else None
+    if stueble_id is not None and not isinstance(stueble_id, int):
+        await send(websocket=websocket, event="error", reqId=req_id, data={"code": "400",
+                     "message": "stuebleId must be an integer"})
+        return
+
+    session_id = websocket.context.session_id
+
+    # get connection and cursor, the role is checked in the database since it can change during the connection
+    conn, cursor = get_read_conn_cursor()
+
+    result = check_permissions(cursor=cursor, session_id=session_id, required_role=UserRole.TUTOR)
+    if result["success"] is False:
+        close_conn_cursor(conn, cursor)
+        await send(websocket=websocket, event="error", reqId=req_id, data={"code": "401",
+                     "message": str(result["error"])})
+        return
+    if result["data"]["allowed"] is False:
+        close_conn_cursor(conn, cursor)
+        await send(websocket=websocket, event="error", reqId=req_id, data={"code": "403",
+                     "message": "invalid permissions, need role tutor or above"})
+        return
+
+    if stueble_id is None:
+        result = motto.get_motto(cursor=cursor)
+        if result["success"] is False:
+            close_conn_cursor(conn, cursor)
+            await send(websocket=websocket, event="error", reqId=req_id, data={"code": "404",
+                         "message": "no stueble party found"})
+            return
+        stueble_id = result["data"][2]
+
+    result = statistics.get_stats(cursor=cursor, stueble_id=stueble_id)
+    close_conn_cursor(conn, cursor)
+    if result["success"] is False:
+        await send(websocket=websocket, event="error", reqId=req_id, data={"code": "500",
+                     "message": str(result["error"])})
+        return
+
+    await send(websocket=websocket, event="stats", reqId=req_id, data=result["data"])
+
 async def request_public_key(websocket, req_id):
     """
     sends the public key
@@ -827,11 +1049,7 @@ async def stueble_status(session_id: str | int, date: datetime.date | None=None,
     if invited_guests is not None:
         data["invitedGuests"] = invited_guests
 
-    user_room = [sid_to_websocket.get(i, None) for i in session_ids]
-    try:
-        user_room.remove(None)
-    except:
-        pass
+    user_room = [sid_to_websocket[i] for i in session_ids if i in sid_to_websocket]
     await broadcast(event="stuebleStatus", data=data, room=user_room, skip_sid=skip_sid)
     return {"success": True}
 
@@ -859,20 +1077,199 @@ async def status(user_id: Annotated[str | int, "Explicit with user_uuid"] = None
     data = {"code": "200",
             "capabilities": capabilities}
     
-    result = sessions.get_session_ids(cursor=cursor, user_id=user_id)
+    result = sessions.get_session_ids(cursor=cursor, user_id=result["data"][0], uuid=True)
     close_conn_cursor(conn, cursor)
     if result["success"] is False:
         return result
     session_ids = result["data"]
     for sid in session_ids:
-        websocket = get_websocket_by_sid(sid=sid)
+        websocket = get_websocket_by_sid(sid=str(sid))
         if websocket is not None:
-            asyncio.run(send(websocket=websocket, event="status", data=data))
+            await send(websocket=websocket, event="status", data=data)
 
 
 # Start server
+def forget_sessions(removed: set[str]):
+    """
+    removes sessions from the message log, messages, that no session has to receive any more, are deleted
+
+    Parameters:
+        removed (set[str]): the session ids
+    """
+    affected_messages = set()
+    for session_id in removed:
+        affected_messages.update(session_messages.pop(session_id, ()))
+    for message_id in affected_messages:
+        entry = message_log.get(message_id, None)
+        if entry is None:
+            continue
+        entry.session_ids = [i for i in entry.session_ids if i not in removed]
+        if len(entry.session_ids) == 0:
+            del message_log[message_id]
+
+def schedule_expiry(context: ConnectionContext):
+    """
+    adds the session of a new connection to the deadlines of expire_sessions
+
+    Parameters:
+        context (ConnectionContext): the context of the connection
+    """
+    if context.session_id in scheduled_sessions:
+        return
+    scheduled_sessions.add(context.session_id)
+    heapq.heappush(session_deadlines, (context.expiration_date.timestamp(), context.session_id))
+    deadline_added.set()
+
+async def close_expired(websocket):
+    """
+    tells the client that its session expired and closes the connection \n
+    sent without the message log, since the session can't acknowledge the message any more
+
+    Parameters:
+        websocket: the websocket connection
+    """
+    try:
+        await websocket.send(frames.encode("error", {"code": "401", "message": "Session expired"}))
+        await websocket.close(code=1000, reason="Session expired")
+    except (ConnectionClosed, ConnectionClosedOK, ConnectionClosedError):
+        pass
+
+async def expire_sessions():
+    """
+    closes the connections of sessions at their expiration date \n
+    only wakes up for the next deadline of session_deadlines (or a new connection), sessions expiring at the same time
+    (e.g. 05:30, see sessions.create_session) are closed together
+    """
+    while True:
+        timeout = session_deadlines[0][0] - time.time() if len(session_deadlines) > 0 else None
+        if timeout is None or timeout > 0:
+            deadline_added.clear()
+            try:
+                await asyncio.wait_for(deadline_added.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        now = time.time()
+        expired = set()
+        while len(session_deadlines) > 0 and session_deadlines[0][0] <= now:
+            expired.add(heapq.heappop(session_deadlines)[1])
+        scheduled_sessions.difference_update(expired)
+
+        try:
+            closing = []
+            for session_id in expired:
+                websocket = sid_to_websocket.get(session_id, None)
+                if websocket is None:
+                    continue
+                unregister_websocket(websocket)
+                closing.append(close_expired(websocket))
+            await asyncio.gather(*closing, return_exceptions=True)
+            forget_sessions(expired)
+        except Exception as e:
+            print(f"Could not close expired sessions: {e!r}")
+
+async def sweep_sessions():
+    """
+    periodically removes deleted sessions from the connection registry and the message log in bulk \n
+    the session_ids are pushed into removed_sessions by the db listener, so nothing is read from the database here
+    """
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
+        try:
+            removed = set()
+            while True:
+                try:
+                    removed.update(removed_sessions.get_nowait())
+                except queue.Empty:
+                    break
+            if len(removed) == 0:
+                continue
+
+            forget_sessions(removed)
+
+            # close websockets of removed sessions
+            closing = []
+            for session_id in removed:
+                websocket = sid_to_websocket.get(session_id, None)
+                if websocket is None:
+                    continue
+                unregister_websocket(websocket)
+                closing.append(websocket.close(code=1008, reason="Session removed"))
+            await asyncio.gather(*closing, return_exceptions=True)
+        except Exception as e:
+            print(f"Could not sweep removed sessions: {e!r}")
+
+def reconcile_occupancy():
+    """
+    reloads the occupancy counts from the database, runs in a worker thread
+    """
+    conn, cursor = get_read_conn_cursor()
+    try:
+        result = occupancy.reconcile(cursor=cursor)
+    finally:
+        close_conn_cursor(conn, cursor)
+    if result["success"] is False:
+        print(f"Could not reconcile occupancy: {result['error']}")
+
+async def push_occupancy():
+    """
+    sends the changed occupancy counts to the hosts as occupancy frame, at most once per PUSH_INTERVAL_SECONDS \n
+    the frames aren't added to the message log, a missed frame is replaced by the next one
+    """
+    while True:
+        await asyncio.sleep(PUSH_INTERVAL_SECONDS)
+        try:
+            if occupancy.reconcile_due():
+                await asyncio.to_thread(reconcile_occupancy)
+            changes = occupancy.changes()
+            hosts = room_members(Room.HOST_UPWARDS)
+            if len(changes) == 0 or len(hosts) == 0:
+                continue
+            messages = [frames.encode("occupancy", change) for change in changes]
+            for websocket in hosts:
+                try:
+                    for message in messages:
+                        await websocket.send(message)
+                except (ConnectionClosed, ConnectionClosedOK, ConnectionClosedError):
+                    unregister_websocket(websocket)
+        except Exception as e:
+            # e.g. the pool had no connection for the reconciliation, it is tried again with the next push
+            print(f"Could not push occupancy: {e!r}")
+
+async def reconcile_guest_manifest():
+    """
+    reconciles the guest manifest with the database every RECONCILE_SECONDS (see guest_manifest.py), so lost messages
+    and a new current stueble are picked up without a request of a host
+    """
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
+        if not guest_manifest.reconcile_due():
+            continue
+        try:
+            result = await asyncio.to_thread(load_guest_manifest, True)
+            if result["success"] is False:
+                print(f"Could not reconcile the guest manifest: {result['error']}")
+        except Exception as e:
+            print(f"Could not reconcile the guest manifest: {e!r}")
+
+def start_background_task(coroutine):
+    """
+    starts a task that runs as long as the server, the task handles its own errors per iteration
+
+    Parameters:
+        coroutine: the coroutine of the task
+    """
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
 async def main():
-    async with websockets.serve(handle_ws, "127.0.0.1", 3001, ping_interval=25, ping_timeout=20, close_timeout=9):
+    async with websockets.serve(handle_ws, "127.0.0.1", 3001, process_request=process_request, ping_interval=25, ping_timeout=20, close_timeout=9):
+        start_background_task(sweep_sessions())
+        start_background_task(expire_sessions())
+        start_background_task(push_occupancy())
+        start_background_task(reconcile_guest_manifest())
         await asyncio.Future()
 
 if __name__ == "__main__":
@@ -1,11 +1,18 @@
 import json
 import select
+import time
 import warnings
 
 import psycopg2
 from psycopg2.extensions import connection, cursor
 import requests
 
+from packages.backend import websocket as ws
+from packages.backend.admission import admission
+from packages.backend.guest_list_cache import guest_list_cache
+from packages.backend.guest_manifest import guest_manifest
+from packages.backend.occupancy import occupancy
+from packages.backend.resident_directory import resident_directory
 from packages.backend.data_types import Event_Notify
 from packages.backend.sql_connection import database as db
 from packages.backend.sql_connection import users
@@ -15,53 +22,146 @@ def is_valid_event_notify(other):
         return other in Event_Notify._value2member_map_
     return NotImplemented
 
+LISTEN_CHANNELS = ("automatically_removed_users", "removed_sessions", "users_changed", "guest_slot_freed",
+                   "occupancy_changed", "guest_list_changed")
+RECONNECT_SECONDS = 5
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
 conn, cursor = db.connect()
 
-def listen_to_db(connection: connection, cursor: cursor):
+def resync(cursor: cursor):
     """
-    Listens to the database for notifications on the channel 'automatically_removed_users'.
-    When a notification is received, it processes the payload and retrieves user information.
-    The payload is expected to be a JSON string with keys: event, user_id, stueble_id
+    notifications sent while the listener wasn't connected are lost, so everything that is kept up to date by them is
+    reloaded: the resident directory, the cached guest lists, the guest manifest, the occupancy counts and the admission
+    counters, and the connected sessions are checked for sessions that were removed meanwhile
+
+    Parameters:
+        cursor: psycopg2 cursor object
+    """
+    resident_directory.invalidate()
+    guest_list_cache.invalidate()
+    guest_manifest.invalidate()
+    occupancy.invalidate()
+    admission.resync()
+
+    session_ids = list(ws.sid_to_websocket)
+    if len(session_ids) == 0:
+        return
+    result = db.custom_call(cursor=cursor,
+                            query="SELECT session_id::text FROM sessions WHERE session_id::text = ANY(%s)",
+                            type_of_answer=db.ANSWER_TYPE.LIST_ANSWER,
+                            variables=(session_ids,))
+    if result["success"] is False:
+        warnings.warn(f"Could not check the connected sessions: {result['error']}")
+        return
+    removed = set(session_ids) - {row[0] for row in result["data"]}
+    if len(removed) > 0:
+        ws.removed_sessions.put(list(removed))
+
+def handle_notification(cursor: cursor, notify):
+    """
+    handles one notification, see listen_to_db
+
+    Parameters:
+        cursor: psycopg2 cursor object
+        notify: the notification
+    """
+    if notify.channel == "users_changed":
+        resident_directory.invalidate()
+        guest_list_cache.invalidate()
+        return
+    if notify.channel == "guest_list_changed":
+        guest_list_cache.invalidate(stueble_id=int(notify.payload) if notify.payload != "" else None)
+        return
+    if notify.channel == "guest_slot_freed":
+        admission.slot_freed(stueble_id=int(notify.payload))
+        return
+    data = json.loads(notify.payload)
+    if notify.channel == "occupancy_changed":
+        occupancy.update(stueble_id=data["stueble_id"], present=data.get("present", None), registered=data.get("registered", None))
+        return
+    if notify.channel == "removed_sessions":
+        ws.removed_sessions.put(data)
+        return
+    if not set(data.keys()) == {"event", "user_id", "stueble_id"}:
+        # TODO catch this, e.g. by sending an error message to api.py
+        warnings.warn("Keys don't match")
+        return
+    # event = data["event"]
+    # event = Event_Notify(event) # only possible events are arrive and leave for notifications to be sent
+    user_id = data["user_id"]
+    stueble_id = data["stueble_id"]
+    result = users.get_user(cursor=cursor, user_id=user_id, keywords=["first_name", "last_name", "user_uuid"])
+    if result["success"] is False:
+        # TODO catch this, e.g. by sending an error message to api.py
+        warnings.warn(f"Could not get user with id {user_id}")
+        return
+    # NOTE only use user_uuid for the guest_list not publicly available for hosts etc.
+    first_name, last_name, user_uuid = result["data"]
+    removed_user_data = {"first_name": first_name,
+            "last_name": last_name,
+            "user_uuid": user_uuid,
+            "stueble_id": stueble_id}
+            # "event": event}
+    # TODO configure url
+    response = requests.post("http://127.0.0.1:3000/websocket_local", json=removed_user_data, timeout=10)
+    if response.status_code != 200:
+        warnings.warn(f"Could not send data to websocket server: {response.text}")
+        return
+    # TODO handle error
+
+def listen_to_db(connection: connection, cursor: cursor, reconnected: bool = False):
+    """
+    Listens to the database for notifications on the channels 'automatically_removed_users', 'removed_sessions',
+    'users_changed', 'guest_slot_freed', 'occupancy_changed' and 'guest_list_changed'.
+    For 'automatically_removed_users' the payload is expected to be a JSON string with keys: event, user_id, stueble_id,
+    the user information is retrieved and sent to api.py.
+    For 'removed_sessions' the payload is a JSON list of session_ids, which is handed to the session sweeper of the websocket server.
+    For 'users_changed' (no payload) the resident directory and the cached guest lists are marked as outdated.
+    For 'guest_slot_freed' the payload is the stueble_id, the admission moves up its waitlist.
+    For 'occupancy_changed' the payload is a JSON object with stueble_id and the new present or registered count.
+    For 'guest_list_changed' the payload is the stueble_id, or empty for all stuebles, whose cached guest list is outdated.
+    A notification that can't be handled is skipped with a warning, connection errors are raised, see run_listener.
 
     Parameters:
         connection: psycopg2 connection object
         cursor: psycopg2 cursor object
+        reconnected (bool): whether notifications may have been missed since the last connection
     """
     connection.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)  # autocommit mode
-    cursor.execute("LISTEN automatically_removed_users;")
+    for channel in LISTEN_CHANNELS:
+        cursor.execute(f"LISTEN {channel};")
+    # after LISTEN, so no change between the reload and the first notification is missed
+    if reconnected:
+        resync(cursor)
     while True:
         if select.select([connection], [], [], 0.5) == ([], [], []):
             continue
         connection.poll()
         while connection.notifies:
             notify = connection.notifies.pop(0)
-            data = json.loads(notify.payload)
-            if not set(data.keys()) == {"event", "user_id", "stueble_id"}:
-                # TODO catch this, e.g. by sending an error message to api.py
-                warnings.warn("Keys don't match")
-                continue
-            # event = data["event"]
-            # event = Event_Notify(event) # only possible events are arrive and leave for notifications to be sent
-            user_id = data["user_id"]
-            stueble_id = data["stueble_id"]
-            result = users.get_user(cursor=cursor, user_id=user_id, keywords=["first_name", "last_name", "user_uuid"])
-            if result["success"] is False:
-                # TODO catch this, e.g. by sending an error message to api.py
-                warnings.warn(f"Could not get user with id {user_id}")
-                continue
-            # NOTE only use user_uuid for the guest_list not publicly available for hosts etc.
-            first_name, last_name, user_uuid = result["data"]
-            removed_user_data = {"first_name": first_name,
-                    "last_name": last_name,
-                    "user_uuid": user_uuid,
-                    "stueble_id": stueble_id}
-                    # "event": event}
-            # TODO configure url
-            response = requests.post("http://127.0.0.1:3000/websocket_local", json=removed_user_data)
-            if response.status_code != 200:
-                warnings.warn(f"Could not send data to websocket server: {response.text}")
-                continue
-            # TODO handle error
+            try:
+                handle_notification(cursor, notify)
+            except CONNECTION_ERRORS:
+                raise
+            except Exception as e:
+                warnings.warn(f"Could not handle notification on {notify.channel} with payload {notify.payload!r}: {e!r}")
 
 def run_listener():
-    listen_to_db(conn, cursor)
\ No newline at end of file
+    """
+    runs listen_to_db, reconnects every RECONNECT_SECONDS if the connection is lost
+    """
+    global conn, cursor
+    reconnected = False
+    while True:
+        try:
+            if conn is None or conn.closed:
+                conn, cursor = db.connect()
+            listen_to_db(conn, cursor, reconnected=reconnected)
+        except CONNECTION_ERRORS as e:
+            warnings.warn(f"Lost the connection of the db listener, reconnecting in {RECONNECT_SECONDS}s: {e!r}")
+            if conn is not None and not conn.closed:
+                conn.close()
+            conn = None
+            reconnected = True
+            time.sleep(RECONNECT_SECONDS)
@@ -4,6 +4,7 @@
 -- SET DateStyle TO ISO, YMD;
 
 CREATE EXTENSION IF NOT EXISTS "pgcrypto";
+CREATE EXTENSION IF NOT EXISTS "pg_trgm";
 
 -- enum for user_role in table users
 CREATE TYPE USER_ROLE AS ENUM ('admin', 'tutor', 'host', 'user', 'extern');
@@ -35,6 +36,12 @@ CREATE TABLE IF NOT EXISTS users (
     verified BOOLEAN DEFAULT FALSE
 );
 
+-- indexes for the user search (sql_connection/search.py), the expressions have to match the queries there
+-- ranked search: trigram word similarity on the full name and user name, word prefixes via the tsvector
+CREATE INDEX IF NOT EXISTS users_full_name_trgm_idx ON users USING GIN (lower(first_name || ' ' || last_name) gin_trgm_ops) WHERE user_role != 'extern';
+CREATE INDEX IF NOT EXISTS users_user_name_trgm_idx ON users USING GIN (lower(user_name) gin_trgm_ops) WHERE user_role != 'extern';
+CREATE INDEX IF NOT EXISTS users_search_vector_idx ON users USING GIN (to_tsvector('simple', first_name || ' ' || last_name || ' ' || COALESCE(user_name, ''))) WHERE user_role != 'extern';
+
 -- table for stueble mottos
 CREATE TABLE IF NOT EXISTS stueble_motto (
     id SERIAL PRIMARY KEY,
@@ -63,6 +70,52 @@ CREATE TABLE IF NOT EXISTS events (
     stueble_id INTEGER REFERENCES stueble_motto(id) NOT NULL
 );
 
+-- the triggers look up the last event of a user for a stueble on every insert
+CREATE INDEX IF NOT EXISTS events_stueble_user_idx ON events (stueble_id, user_id, submitted DESC);
+
+-- number of registered invitees per inviter and stueble, maintained by count_guests (triggers.sql)
+CREATE TABLE IF NOT EXISTS stueble_invites (
+    stueble_id INTEGER REFERENCES stueble_motto(id) ON DELETE CASCADE NOT NULL,
+    inviter_id INTEGER REFERENCES users(id) ON DELETE CASCADE NOT NULL,
+    invitees INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (stueble_id, inviter_id)
+);
+
+-- number of registered guests per stueble, maintained by count_guests (triggers.sql)
+-- kept apart from stueble_motto, whose date CHECK is evaluated again on every update of the row
+CREATE TABLE IF NOT EXISTS stueble_counters (
+    stueble_id INTEGER PRIMARY KEY REFERENCES stueble_motto(id) ON DELETE CASCADE,
+    registered_guests INTEGER NOT NULL DEFAULT 0
+);
+
+-- attendance rollups per stueble, maintained by collect_stats (triggers.sql), backfilled with rebuild_stueble_stats (procedures.sql)
+CREATE TABLE IF NOT EXISTS stueble_stats (
+    stueble_id INTEGER PRIMARY KEY REFERENCES stueble_motto(id) ON DELETE CASCADE,
+    registered_intern INTEGER NOT NULL DEFAULT 0,
+    registered_extern INTEGER NOT NULL DEFAULT 0,
+    present INTEGER NOT NULL DEFAULT 0,
+    peak_present INTEGER NOT NULL DEFAULT 0,
+    peak_at TIMESTAMPTZ,
+    arrived_guests INTEGER NOT NULL DEFAULT 0, -- guests that arrived at least once
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- arrivals, departures and presence per stueble and 5 minute bucket
+CREATE TABLE IF NOT EXISTS stueble_stats_buckets (
+    stueble_id INTEGER REFERENCES stueble_motto(id) ON DELETE CASCADE NOT NULL,
+    bucket_start TIMESTAMPTZ NOT NULL,
+    arrivals INTEGER NOT NULL DEFAULT 0,
+    departures INTEGER NOT NULL DEFAULT 0,
+    max_present INTEGER NOT NULL DEFAULT 0,
+    present INTEGER NOT NULL DEFAULT 0, -- at the end of the bucket
+    PRIMARY KEY (stueble_id, bucket_start)
+);
+
+-- stuebles from before collect_stats whose rollups still have to be rebuilt (see statistics.backfill)
+CREATE TABLE IF NOT EXISTS stueble_stats_backfill (
+    stueble_id INTEGER PRIMARY KEY REFERENCES stueble_motto(id) ON DELETE CASCADE
+);
+
 -- table to save configuration settings
 CREATE TABLE IF NOT EXISTS configurations (
     id SERIAL PRIMARY KEY,
@@ -1,10 +1,9 @@
 SELECT cron.schedule(
-               '52 4 * * *',
-               $$DELETE * FROM sessions WHERE expiration_date <= NOW();
-                WITH config AS (reset_code_expiration_minutes AS expiration_time;
-                FROM configurations)
+               '35 5 * * *', -- sessions expire at 05:30
+               $$DELETE FROM sessions WHERE expiration_date <= NOW();
 
                 DELETE FROM verification_codes
-                USING config
-                WHERE created_at + (config.reset_code_expiration_minutes || ' minute')::interval > NOW();$$
+                USING configurations
+                WHERE configurations.key = 'reset_code_expiration_minutes'
+                  AND verification_codes.created_at + (configurations.value || ' minute')::interval <= NOW();$$
 );
\ No newline at end of file
@@ -0,0 +1,88 @@
+-- Description: brings an existing database up to date, create_tables.sql can't be rerun because of the CREATE TYPEs
+-- run directly after triggers.sql (registrations fail until the counters exist), every statement can be run repeatedly
+
+-- guest counters for the capacity and invite limit checks of event_guest_change
+-- the counter lived on stueble_motto before, updating those rows fails for past stuebles because of the date CHECK
+ALTER TABLE stueble_motto DROP COLUMN IF EXISTS registered_guests;
+
+CREATE TABLE IF NOT EXISTS stueble_counters (
+    stueble_id INTEGER PRIMARY KEY REFERENCES stueble_motto(id) ON DELETE CASCADE,
+    registered_guests INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS stueble_invites (
+    stueble_id INTEGER REFERENCES stueble_motto(id) ON DELETE CASCADE NOT NULL,
+    inviter_id INTEGER REFERENCES users(id) ON DELETE CASCADE NOT NULL,
+    invitees INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (stueble_id, inviter_id)
+);
+
+CREATE INDEX IF NOT EXISTS events_stueble_user_idx ON events (stueble_id, user_id, submitted DESC);
+
+-- backfill the counters from the events (same as count_guests: the last add / remove of a user counts)
+-- events are locked against inserts, so no registration gets lost between the backfill and the trigger
+BEGIN;
+LOCK TABLE events IN SHARE MODE;
+
+WITH last_events AS (
+    SELECT DISTINCT ON (stueble_id, user_id) stueble_id, event_type
+    FROM events
+    WHERE event_type IN ('add', 'remove')
+    ORDER BY stueble_id, user_id, submitted DESC, id DESC
+)
+INSERT INTO stueble_counters (stueble_id, registered_guests)
+SELECT id, (SELECT COUNT(*) FROM last_events WHERE last_events.stueble_id = stueble_motto.id AND event_type = 'add')
+FROM stueble_motto
+ON CONFLICT (stueble_id) DO UPDATE SET registered_guests = EXCLUDED.registered_guests;
+
+DELETE FROM stueble_invites;
+INSERT INTO stueble_invites (stueble_id, inviter_id, invitees)
+SELECT stueble_id, invited_by, COUNT(*)
+FROM (SELECT DISTINCT ON (stueble_id, user_id) stueble_id, user_id, event_type, invited_by
+      FROM events
+      WHERE event_type IN ('add', 'remove')
+      ORDER BY stueble_id, user_id, submitted DESC, id DESC) AS last_events
+WHERE event_type = 'add' AND invited_by IS NOT NULL
+GROUP BY stueble_id, invited_by;
+COMMIT;
+
+-- attendance rollups per stueble, maintained by collect_stats (triggers.sql), backfilled with rebuild_stueble_stats (procedures.sql)
+CREATE TABLE IF NOT EXISTS stueble_stats (
+    stueble_id INTEGER PRIMARY KEY REFERENCES stueble_motto(id) ON DELETE CASCADE,
+    registered_intern INTEGER NOT NULL DEFAULT 0,
+    registered_extern INTEGER NOT NULL DEFAULT 0,
+    present INTEGER NOT NULL DEFAULT 0,
+    peak_present INTEGER NOT NULL DEFAULT 0,
+    peak_at TIMESTAMPTZ,
+    arrived_guests INTEGER NOT NULL DEFAULT 0, -- guests that arrived at least once
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- arrivals, departures and presence per stueble and 5 minute bucket
+CREATE TABLE IF NOT EXISTS stueble_stats_buckets (
+    stueble_id INTEGER REFERENCES stueble_motto(id) ON DELETE CASCADE NOT NULL,
+    bucket_start TIMESTAMPTZ NOT NULL,
+    arrivals INTEGER NOT NULL DEFAULT 0,
+    departures INTEGER NOT NULL DEFAULT 0,
+    max_present INTEGER NOT NULL DEFAULT 0,
+    present INTEGER NOT NULL DEFAULT 0, -- at the end of the bucket
+    PRIMARY KEY (stueble_id, bucket_start)
+);
+
+-- stuebles from before collect_stats whose rollups still have to be rebuilt (see statistics.backfill)
+CREATE TABLE IF NOT EXISTS stueble_stats_backfill (
+    stueble_id INTEGER PRIMARY KEY REFERENCES stueble_motto(id) ON DELETE CASCADE
+);
+
+-- rollups of stuebles with events before collect_stats are incomplete, they are rebuilt in batches with
+-- python -m packages.backend.initialization.backfill_statistics
+INSERT INTO stueble_stats_backfill (stueble_id)
+SELECT DISTINCT stueble_id FROM events
+ON CONFLICT (stueble_id) DO NOTHING;
+
+-- user search (sql_connection/search.py): word_similarity and <% need pg_trgm, the index expressions have to match the
+-- queries there
+CREATE EXTENSION IF NOT EXISTS "pg_trgm";
+CREATE INDEX IF NOT EXISTS users_full_name_trgm_idx ON users USING GIN (lower(first_name || ' ' || last_name) gin_trgm_ops) WHERE user_role != 'extern';
+CREATE INDEX IF NOT EXISTS users_user_name_trgm_idx ON users USING GIN (lower(user_name) gin_trgm_ops) WHERE user_role != 'extern';
+CREATE INDEX IF NOT EXISTS users_search_vector_idx ON users USING GIN (to_tsvector('simple', first_name || ' ' || last_name || ' ' || COALESCE(user_name, ''))) WHERE user_role != 'extern';
@@ -0,0 +1,116 @@
+-- Description: functions that bundle several statements into a single round trip for hot paths
+
+-- door check-in: checks the permissions of the host, verifies the guest on arrival, inserts the arrive / leave event
+-- and returns everything needed for the broadcast (the checks of event_guest_change still run on the insert)
+CREATE OR REPLACE FUNCTION check_in_guest(host_session_id UUID, guest_uuid UUID, guest_present BOOLEAN)
+RETURNS TABLE (
+    first_name TEXT,
+    last_name TEXT,
+    room INTEGER,
+    residence RESIDENCE,
+    extern BOOLEAN,
+    session_ids TEXT[]
+) AS $$
+DECLARE
+    host_role USER_ROLE;
+    guest users%ROWTYPE;
+    current_stueble_id INTEGER;
+BEGIN
+    SELECT u.user_role INTO host_role
+    FROM sessions s JOIN users u ON s.user_id = u.id
+    WHERE s.session_id = host_session_id;
+
+    IF host_role IS NULL
+    THEN
+        RAISE EXCEPTION 'no matching session and user found; code: 401';
+    END IF;
+    -- admin < tutor < host in the enum order
+    IF host_role > 'host'
+    THEN
+        RAISE EXCEPTION 'invalid permissions, need role host or above; code: 403';
+    END IF;
+
+    SELECT * INTO guest FROM users WHERE user_uuid = guest_uuid;
+    IF NOT FOUND
+    THEN
+        RAISE EXCEPTION 'no user found; code: 404';
+    END IF;
+
+    SELECT id INTO current_stueble_id
+    FROM stueble_motto
+    WHERE date_of_time = CURRENT_DATE OR (CURRENT_TIME < '06:00:00' AND date_of_time = (CURRENT_DATE - INTERVAL '1 day'));
+    IF current_stueble_id IS NULL
+    THEN
+        RAISE EXCEPTION 'no stueble party found for today or yesterday; code: 404';
+    END IF;
+
+    IF guest_present AND guest.verified IS NOT TRUE
+    THEN
+        UPDATE users SET verified = TRUE WHERE id = guest.id;
+    END IF;
+
+    INSERT INTO events (user_id, event_type, stueble_id)
+    VALUES (guest.id, CASE WHEN guest_present THEN 'arrive' ELSE 'leave' END::EVENT_TYPE, current_stueble_id);
+
+    RETURN QUERY
+    SELECT guest.first_name,
+           guest.last_name,
+           guest.room,
+           guest.residence,
+           guest.user_role = 'extern',
+           ARRAY(SELECT s.session_id::text FROM sessions s WHERE s.user_id = guest.id);
+END;
+$$ LANGUAGE plpgsql;
+
+-- rebuilds the rollups of collect_stats for one stueble from its events, used to backfill past stuebles
+-- collect_stats takes the same advisory lock, so events of this stueble wait for the rebuild and none is counted
+-- twice or missed, events of other stuebles are not blocked
+CREATE OR REPLACE FUNCTION rebuild_stueble_stats(stueble INTEGER)
+RETURNS void AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('stueble_stats'), stueble);
+
+    DELETE FROM stueble_stats_buckets WHERE stueble_id = stueble;
+    DELETE FROM stueble_stats WHERE stueble_id = stueble;
+
+    -- presence changes in order: +1 for a valid arrive, -1 for a valid leave, like collect_stats
+    CREATE TEMPORARY TABLE presence ON COMMIT DROP AS
+    SELECT id, submitted, user_id, delta, SUM(delta) OVER (ORDER BY submitted, id) AS present
+    FROM (SELECT id, submitted, user_id,
+                 CASE WHEN event_type = 'arrive' AND COALESCE(previous_event, 'leave') != 'arrive' THEN 1
+                      WHEN event_type = 'leave' AND previous_event = 'arrive' THEN -1
+                      ELSE 0 END AS delta
+          FROM (SELECT id, submitted, user_id, event_type,
+                       LAG(event_type) OVER (PARTITION BY user_id ORDER BY submitted, id) AS previous_event
+                FROM events
+                WHERE stueble_id = stueble AND event_type IN ('arrive', 'leave')) AS ordered_events) AS changes
+    WHERE delta != 0;
+
+    INSERT INTO stueble_stats (stueble_id, registered_intern, registered_extern, present, peak_present, peak_at, arrived_guests)
+    SELECT stueble,
+           COUNT(*) FILTER (WHERE last_events.event_type = 'add' AND u.user_role != 'extern'),
+           COUNT(*) FILTER (WHERE last_events.event_type = 'add' AND u.user_role = 'extern'),
+           COALESCE((SELECT present FROM presence ORDER BY submitted DESC, id DESC LIMIT 1), 0),
+           COALESCE((SELECT MAX(present) FROM presence), 0),
+           (SELECT submitted FROM presence ORDER BY present DESC, submitted ASC, id ASC LIMIT 1),
+           (SELECT COUNT(DISTINCT user_id) FROM presence WHERE delta = 1)
+    FROM (SELECT DISTINCT ON (user_id) user_id, event_type
+          FROM events
+          WHERE stueble_id = stueble AND event_type IN ('add', 'remove')
+          ORDER BY user_id, submitted DESC, id DESC) AS last_events
+    JOIN users u ON u.id = last_events.user_id;
+
+    INSERT INTO stueble_stats_buckets (stueble_id, bucket_start, arrivals, departures, max_present, present)
+    SELECT stueble,
+           date_bin('5 minutes', submitted, TIMESTAMPTZ '2000-01-01') AS bucket_start,
+           COUNT(*) FILTER (WHERE delta = 1),
+           COUNT(*) FILTER (WHERE delta = -1),
+           MAX(present),
+           (ARRAY_AGG(present ORDER BY submitted DESC, id DESC))[1]
+    FROM presence
+    GROUP BY bucket_start;
+
+    DROP TABLE presence;
+    DELETE FROM stueble_stats_backfill WHERE stueble_id = stueble;
+END;
+$$ LANGUAGE plpgsql;
@@ -2,18 +2,22 @@
 CREATE OR REPLACE FUNCTION event_guest_change()
 RETURNS trigger AS $$
 DECLARE inviter_role USER_ROLE;
-DECLARE inviter_users INTEGER;
 DECLARE automatically_removed_user INTEGER;
 DECLARE present BOOLEAN;
 DECLARE all_invitees_absent BOOLEAN;
 DECLARE maximum_invitees INTEGER;
+DECLARE user_role_of_guest USER_ROLE;
+DECLARE guest_count INTEGER;
+DECLARE invitee_count INTEGER;
 BEGIN
     -- skip for force insert
     IF current_setting('additional.skip_triggers', true) = 'on' THEN
         RETURN NEW;
     END IF;
+    user_role_of_guest := COALESCE((SELECT user_role FROM users WHERE id = NEW.user_id), 'extern');
+
     -- check, whether admins are trying to arrive / leave
-    IF COALESCE((SELECT user_role FROM users WHERE id = NEW.user_id), 'extern') = 'admin'
+    IF user_role_of_guest = 'admin'
     THEN
         RAISE EXCEPTION 'Admins are not allowed to arrive / leave stueble; code: 400';
     END IF;
@@ -70,18 +74,18 @@ BEGIN
         IF NEW.event_type = 'add'
         THEN
 
-            IF COALESCE((SELECT user_role FROM users WHERE id = NEW.user_id), 'extern') = 'host'
+            IF user_role_of_guest = 'host'
             THEN
                 RAISE EXCEPTION 'Hosts are not allowed to be added to stueble; code: 400';
             END IF;
 
             -- check, whether user is extern and needs to be invited
-            IF NEW.invited_by IS NULL AND (SELECT user_role FROM users WHERE id = NEW.user_id) = 'extern'
+            IF NEW.invited_by IS NULL AND user_role_of_guest = 'extern'
             THEN
                 RAISE EXCEPTION 'Externs need to be invited; code: 400';
             END IF;
 
-            IF NEW.invited_by IS NOT NULL AND (SELECT user_role FROM users WHERE id = NEW.user_id) != 'extern'
+            IF NEW.invited_by IS NOT NULL AND user_role_of_guest != 'extern'
             THEN
                 RAISE EXCEPTION 'Only externs can be invited; code: 400';
             END IF;
@@ -109,44 +113,40 @@ BEGIN
                 RAISE EXCEPTION 'User cannot be added to stueble % since already added to stueble %; code: 400', NEW.stueble_id, NEW.stueble_id;
             END IF;
 
-            -- check, whether maximum capacity of guests is already reached
-            IF (SELECT COUNT(*)
-                FROM (SELECT DISTINCT ON (user_id) event_type
-                      FROM events
-                      WHERE event_type IN ('add', 'remove') AND stueble_id = NEW.stueble_id
-                      ORDER BY user_id, submitted DESC) as last_events
-                WHERE event_type = 'add') >=
-               (SELECT CAST(value AS INTEGER) FROM configurations WHERE key = 'maximum_guests_per_stueble')
-            THEN
-                RAISE EXCEPTION 'Maximum capacity of guests for stueble % already reached; code: 400', NEW.stueble_id;
-            END IF;
-
-            IF COALESCE((SELECT user_role FROM users WHERE id = NEW.invited_by), 'extern') != 'tutor'
-            THEN
-                maximum_invitees := COALESCE((SELECT CAST(value AS INTEGER) FROM configurations WHERE key = 'maximum_invites_per_user'), 0);
-            ELSE
-                maximum_invitees := COALESCE((SELECT CAST(value AS INTEGER) FROM configurations WHERE key = 'maximum_guests_per_tutor'), 0);
-            END IF;
-
             -- check, whether max_number of guests for inviter is already exceeded
             IF NEW.invited_by IS NOT NULL
             THEN
-                WITH last_events AS (SELECT DISTINCT ON (user_id) event_type
-                                     FROM events
-                                     WHERE (event_type IN ('add', 'remove') AND invited_by = NEW.invited_by AND
-                                            stueble_id = NEW.stueble_id)
-                                     ORDER BY user_id, submitted DESC)
-                SELECT COUNT(*)
-                INTO inviter_users
-                FROM last_events
-                WHERE event_type = 'add';
-                IF inviter_users >=
-                   maximum_invitees
+                SELECT CAST(value AS INTEGER) INTO maximum_invitees
+                FROM configurations
+                WHERE key = CASE WHEN inviter_role = 'tutor' THEN 'maximum_guests_per_tutor' ELSE 'maximum_invites_per_user' END;
+                maximum_invitees := COALESCE(maximum_invitees, 0);
+
+                -- the row has to exist to be locked, otherwise two first invites of an inviter could both pass
+                INSERT INTO stueble_invites (stueble_id, inviter_id) VALUES (NEW.stueble_id, NEW.invited_by)
+                ON CONFLICT (stueble_id, inviter_id) DO NOTHING;
+                SELECT invitees INTO invitee_count
+                FROM stueble_invites
+                WHERE stueble_id = NEW.stueble_id AND inviter_id = NEW.invited_by
+                FOR UPDATE;
+                IF invitee_count >= maximum_invitees
                 THEN
                     RAISE EXCEPTION 'Inviter % has already reached the maximum number of guests; code: 400', NEW.invited_by;
                 END IF;
             END IF;
 
+            -- check, whether maximum capacity of guests is already reached
+            -- the counter is maintained by count_guests, the row lock serializes concurrent registrations of the
+            -- stueble until the transaction ends, so the compare can't be raced; it is taken as the last check so
+            -- rejected registrations don't queue up on it
+            -- the row has to exist to be locked, it is created with the first registration of the stueble
+            INSERT INTO stueble_counters (stueble_id) VALUES (NEW.stueble_id)
+            ON CONFLICT (stueble_id) DO NOTHING;
+            SELECT registered_guests INTO guest_count FROM stueble_counters WHERE stueble_id = NEW.stueble_id FOR UPDATE;
+            IF guest_count >= (SELECT CAST(value AS INTEGER) FROM configurations WHERE key = 'maximum_guests')
+            THEN
+                RAISE EXCEPTION 'Maximum capacity of guests for stueble % already reached; code: 400', NEW.stueble_id;
+            END IF;
+
         -- check whether remove is valid
         ELSE
             IF COALESCE((SELECT event_type
@@ -185,7 +185,7 @@ BEGIN
             END IF;
 
             -- remove invitees of the removed user if user is not extern
-            IF (SELECT user_role FROM users WHERE id = NEW.user_id) != 'extern'
+            IF user_role_of_guest != 'extern'
             THEN
                 -- if already arrived at stueble forbid removing
                 INSERT INTO events (user_id, stueble_id, event_type)
@@ -215,7 +215,7 @@ BEGIN
     IF NEW.event_type IN ('add', 'arrive')
     THEN
         -- check, whether inviter is still added for stueble
-        IF COALESCE((SELECT user_role FROM users WHERE id = NEW.user_id), 'extern') = 'extern'
+        IF user_role_of_guest = 'extern'
             AND COALESCE((SELECT event_type
                             FROM events
                             WHERE user_id = NEW.invited_by
@@ -224,7 +224,7 @@ BEGIN
                             ORDER BY submitted
                                 DESC
                             LIMIT 1),
-                            'remove') != 'add' AND COALESCE((SELECT user_role FROM users WHERE id = NEW.invited_by), 'extern') NOT IN ('admin', 'tutor', 'host')
+                            'remove') != 'add' AND COALESCE(inviter_role, (SELECT user_role FROM users WHERE id = NEW.invited_by), 'extern') NOT IN ('admin', 'tutor', 'host')
         THEN
             RAISE EXCEPTION 'Inviter of user % is not registered for stueble % anymore; code: 400', NEW.user_id, NEW.stueble_id;
             END IF;
@@ -416,6 +416,189 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- notifies the websocket server about deleted sessions (logout, expiry cron job, cascading user deletion)
+-- payloads are limited to 8000 bytes, therefore the session_ids are sent in chunks of 150
+CREATE OR REPLACE FUNCTION notify_removed_sessions()
+RETURNS trigger AS $$
+DECLARE
+    chunk TEXT;
+BEGIN
+    FOR chunk IN
+        SELECT json_agg(session_id)::text
+        FROM (SELECT session_id, (row_number() OVER () - 1) / 150 AS chunk_number FROM removed_sessions) AS numbered
+        GROUP BY chunk_number
+    LOOP
+        PERFORM pg_notify('removed_sessions', chunk);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- keeps stueble_counters.registered_guests and stueble_invites.invitees in sync with the add / remove events
+-- runs for forced inserts as well, events are never updated or deleted
+-- a freed slot is announced on guest_slot_freed, so the admission (admission.py) can move up the waitlist
+-- the new count is sent on occupancy_changed for the live occupancy (occupancy.py)
+CREATE OR REPLACE FUNCTION count_guests()
+RETURNS trigger AS $$
+DECLARE previous_event EVENT_TYPE;
+DECLARE previous_inviter INTEGER;
+DECLARE registered_count INTEGER;
+BEGIN
+    -- last add / remove of the user before this event
+    SELECT event_type, invited_by INTO previous_event, previous_inviter
+    FROM events
+    WHERE stueble_id = NEW.stueble_id
+      AND user_id = NEW.user_id
+      AND event_type IN ('add', 'remove')
+      AND id != NEW.id
+    ORDER BY submitted DESC, id DESC
+    LIMIT 1;
+
+    IF NEW.event_type = 'add' AND COALESCE(previous_event, 'remove') != 'add'
+    THEN
+        INSERT INTO stueble_counters (stueble_id, registered_guests) VALUES (NEW.stueble_id, 1)
+        ON CONFLICT (stueble_id) DO UPDATE SET registered_guests = stueble_counters.registered_guests + 1
+        RETURNING registered_guests INTO registered_count;
+        IF NEW.invited_by IS NOT NULL
+        THEN
+            INSERT INTO stueble_invites (stueble_id, inviter_id, invitees) VALUES (NEW.stueble_id, NEW.invited_by, 1)
+            ON CONFLICT (stueble_id, inviter_id) DO UPDATE SET invitees = stueble_invites.invitees + 1;
+        END IF;
+    ELSIF NEW.event_type = 'remove' AND previous_event = 'add'
+    THEN
+        UPDATE stueble_counters SET registered_guests = registered_guests - 1 WHERE stueble_id = NEW.stueble_id
+        RETURNING registered_guests INTO registered_count;
+        PERFORM pg_notify('guest_slot_freed', NEW.stueble_id::text);
+        IF previous_inviter IS NOT NULL
+        THEN
+            UPDATE stueble_invites SET invitees = invitees - 1
+            WHERE stueble_id = NEW.stueble_id AND inviter_id = previous_inviter;
+        END IF;
+    ELSE
+        RETURN NULL;
+    END IF;
+    -- sent with the commit, the row lock orders the counts of concurrent transactions
+    PERFORM pg_notify('occupancy_changed', json_build_object('stueble_id', NEW.stueble_id, 'registered', registered_count)::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- keeps the rollups of statistics.py up to date: registrations split by intern / extern, presence with its peak and
+-- arrivals / departures per 5 minute bucket
+-- runs for forced inserts as well, events are never updated or deleted
+CREATE OR REPLACE FUNCTION collect_stats()
+RETURNS trigger AS $$
+DECLARE previous_event EVENT_TYPE;
+DECLARE is_extern BOOLEAN;
+DECLARE delta INTEGER := 0;
+DECLARE first_arrival BOOLEAN := FALSE;
+DECLARE now_present INTEGER;
+BEGIN
+    -- held until the commit, orders the event against rebuild_stueble_stats (procedures.sql) of the same stueble
+    PERFORM pg_advisory_xact_lock(hashtext('stueble_stats'), NEW.stueble_id);
+    INSERT INTO stueble_stats (stueble_id) VALUES (NEW.stueble_id) ON CONFLICT (stueble_id) DO NOTHING;
+
+    IF NEW.event_type IN ('add', 'remove')
+    THEN
+        SELECT event_type INTO previous_event
+        FROM events
+        WHERE stueble_id = NEW.stueble_id AND user_id = NEW.user_id AND event_type IN ('add', 'remove') AND id != NEW.id
+        ORDER BY submitted DESC, id DESC
+        LIMIT 1;
+
+        IF NEW.event_type = 'add' AND COALESCE(previous_event, 'remove') != 'add'
+        THEN
+            delta := 1;
+        ELSIF NEW.event_type = 'remove' AND previous_event = 'add'
+        THEN
+            delta := -1;
+        ELSE
+            RETURN NULL;
+        END IF;
+
+        is_extern := COALESCE((SELECT user_role = 'extern' FROM users WHERE id = NEW.user_id), FALSE);
+        UPDATE stueble_stats
+        SET registered_intern = registered_intern + CASE WHEN is_extern THEN 0 ELSE delta END,
+            registered_extern = registered_extern + CASE WHEN is_extern THEN delta ELSE 0 END,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE stueble_id = NEW.stueble_id;
+        RETURN NULL;
+    END IF;
+
+    SELECT event_type INTO previous_event
+    FROM events
+    WHERE stueble_id = NEW.stueble_id AND user_id = NEW.user_id AND event_type IN ('arrive', 'leave') AND id != NEW.id
+    ORDER BY submitted DESC, id DESC
+    LIMIT 1;
+
+    IF NEW.event_type = 'arrive' AND COALESCE(previous_event, 'leave') != 'arrive'
+    THEN
+        delta := 1;
+        first_arrival := previous_event IS NULL;
+    ELSIF NEW.event_type = 'leave' AND previous_event = 'arrive'
+    THEN
+        delta := -1;
+    ELSE
+        RETURN NULL;
+    END IF;
+
+    -- the right hand sides see the values before the update
+    UPDATE stueble_stats
+    SET present = present + delta,
+        peak_present = GREATEST(peak_present, present + delta),
+        peak_at = CASE WHEN present + delta > peak_present THEN NEW.submitted ELSE peak_at END,
+        arrived_guests = arrived_guests + CASE WHEN first_arrival THEN 1 ELSE 0 END,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE stueble_id = NEW.stueble_id
+    RETURNING present INTO now_present;
+    PERFORM pg_notify('occupancy_changed', json_build_object('stueble_id', NEW.stueble_id, 'present', now_present)::text);
+
+    INSERT INTO stueble_stats_buckets AS bucket (stueble_id, bucket_start, arrivals, departures, max_present, present)
+    VALUES (NEW.stueble_id,
+            date_bin('5 minutes', NEW.submitted, TIMESTAMPTZ '2000-01-01'),
+            CASE WHEN delta = 1 THEN 1 ELSE 0 END,
+            CASE WHEN delta = -1 THEN 1 ELSE 0 END,
+            now_present,
+            now_present)
+    ON CONFLICT (stueble_id, bucket_start) DO UPDATE
+    SET arrivals = bucket.arrivals + EXCLUDED.arrivals,
+        departures = bucket.departures + EXCLUDED.departures,
+        max_present = GREATEST(bucket.max_present, EXCLUDED.max_present),
+        present = EXCLUDED.present;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- notifies the resident directory (resident_directory.py) that it has to be reloaded
+-- identical notifications of one transaction are only delivered once
+CREATE OR REPLACE FUNCTION notify_users_changed()
+RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('users_changed', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- invalidates the cached guest lists (guest_list_cache.py) of the stuebles of the inserted events, once per statement
+-- without payload (verification of a guest) all cached guest lists are invalidated
+CREATE OR REPLACE FUNCTION notify_guest_list_changed()
+RETURNS trigger AS $$
+DECLARE
+    changed_stueble INTEGER;
+BEGIN
+    IF TG_TABLE_NAME = 'users'
+    THEN
+        PERFORM pg_notify('guest_list_changed', '');
+        RETURN NULL;
+    END IF;
+    FOR changed_stueble IN SELECT DISTINCT stueble_id FROM new_events
+    LOOP
+        PERFORM pg_notify('guest_list_changed', changed_stueble::text);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
 -- NOTE: DO NOT RENAME THE TRIGGERS, SINCE THEIR ALPHABETICAL ORDER SPECIFIES THE ORDER OF EXECUTION
 CREATE OR REPLACE TRIGGER event_add_invited_by_trigger
 BEFORE INSERT OR UPDATE ON events
@@ -427,6 +610,17 @@ BEFORE INSERT OR UPDATE ON events
 FOR EACH ROW
 EXECUTE FUNCTION event_guest_change();
 
+CREATE OR REPLACE TRIGGER count_guests_trigger
+    AFTER INSERT ON events
+    FOR EACH ROW
+    WHEN (NEW.event_type IN ('add', 'remove'))
+    EXECUTE FUNCTION count_guests();
+
+CREATE OR REPLACE TRIGGER collect_stats_trigger
+    AFTER INSERT ON events
+    FOR EACH ROW
+    EXECUTE FUNCTION collect_stats();
+
 CREATE OR REPLACE TRIGGER set_uuid_hash_trigger
     BEFORE INSERT ON users -- only on insert
     FOR EACH ROW EXECUTE FUNCTION set_uuid_hash();
@@ -457,4 +651,24 @@ CREATE OR REPLACE TRIGGER add_websockets_affected_trigger
 
 CREATE OR REPLACE TRIGGER remove_messages_trigger
     AFTER DELETE ON websockets_affected
-    FOR EACH ROW EXECUTE FUNCTION remove_messages();
\ No newline at end of file
+    FOR EACH ROW EXECUTE FUNCTION remove_messages();
+
+CREATE OR REPLACE TRIGGER notify_removed_sessions_trigger
+    AFTER DELETE ON sessions
+    REFERENCING OLD TABLE AS removed_sessions
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_removed_sessions();
+
+-- only columns held by the directory, e.g. verifying a guest at the door doesn't cause a reload
+CREATE OR REPLACE TRIGGER notify_users_changed_trigger
+    AFTER INSERT OR DELETE OR UPDATE OF first_name, last_name, room, residence, user_name, email, password_hash, user_role ON users
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_users_changed();
+
+CREATE OR REPLACE TRIGGER notify_guest_list_changed_trigger
+    AFTER INSERT ON events
+    REFERENCING NEW TABLE AS new_events
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_guest_list_changed();
+
+-- the other columns of the guest list are covered by users_changed
+CREATE OR REPLACE TRIGGER notify_guest_list_verified_trigger
+    AFTER UPDATE OF verified ON users
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_guest_list_changed();